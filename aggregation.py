@@ -0,0 +1,119 @@
+"""Date windowing, resampling and downsampling for the graphs
+
+Plots draw at most a few hundred points however long the journal is: long
+histories are bucketed by day, week or month (mean with a min/max band,
+sums for additive columns) or thinned with Largest-Triangle-Three-Buckets
+to a point budget.
+"""
+import numpy as np
+import pandas as pd
+
+BUCKETS = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+# 'auto' picks the finest bucket that fits the point budget; 'none' plots raw
+# rows; 'lttb' keeps raw rows but thins every line to the point budget
+BUCKET_CHOICES = ['auto', 'none', 'lttb'] + list(BUCKETS)
+# Totals per bucket rather than averages
+SUM_COLUMNS = ['exercise_minutes', 'total_med_mg']
+BAND_SUFFIXES = ('__min', '__max')
+DEFAULT_MAX_POINTS = 400
+
+
+def select_window(df, start=None, end=None):
+    """Rows whose date falls within [start, end]; unparseable bounds are ignored
+
+    df must be sorted by date (analytics.prepare sorts it), so the window is
+    found by binary search and returned as a slice.
+    """
+    start = pd.to_datetime(start, errors='coerce') if start else pd.NaT
+    end = pd.to_datetime(end, errors='coerce') if end else pd.NaT
+    dates = df['date']
+    first = 0 if pd.isna(start) else dates.searchsorted(start, side='left')
+    last = len(df) if pd.isna(end) else dates.searchsorted(end, side='right')
+    return df.iloc[first:last]
+
+
+def choose_bucket(df, max_points):
+    """Finest bucket whose number of points fits max_points"""
+    if df.empty:
+        return 'none'
+    span_days = (df['date'].max() - df['date'].min()).days + 1
+    if len(df) <= max_points:
+        return 'none'
+    if span_days <= max_points:
+        return 'day'
+    if span_days / 7 <= max_points:
+        return 'week'
+    return 'month'
+
+
+def resample(df, bucket):
+    """Aggregate numeric columns per bucket: mean with min/max band, or sum"""
+    numeric = df.select_dtypes(include='number').columns.tolist()
+    sums = [col for col in numeric if col in SUM_COLUMNS]
+    means = [col for col in numeric if col not in SUM_COLUMNS]
+
+    grouped = df.set_index('date')[numeric].resample(BUCKETS[bucket], label='left', closed='left')
+    out = pd.concat([grouped[means].mean(),
+                     grouped[sums].sum(),
+                     grouped[means].min().add_suffix(BAND_SUFFIXES[0]),
+                     grouped[means].max().add_suffix(BAND_SUFFIXES[1])], axis=1)
+    # Drop buckets without a single entry rather than plotting zeros
+    out = out[grouped.size() > 0]
+    return out.reset_index()
+
+
+def aggregate(df, bucket='auto', max_points=DEFAULT_MAX_POINTS):
+    """Return the frame the time-series plots should draw"""
+    if bucket not in BUCKET_CHOICES:
+        bucket = 'auto'
+    if bucket == 'auto':
+        bucket = choose_bucket(df, max_points)
+    if bucket == 'none':
+        return df
+    if bucket == 'lttb':
+        df = df.copy(deep=False)
+        df.attrs['point_budget'] = max_points
+        return df
+    return resample(df, bucket)
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps
+
+    x and y are float arrays without NaNs, x ascending. The first and last
+    points are always kept; every bucket in between contributes the point
+    forming the largest triangle with the previously kept point and the
+    average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = x[-1], y[-1]
+        else:
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(dates, values, budget):
+    """Thin a (dates, values) series to at most budget points with LTTB"""
+    keep = ~np.isnan(values)
+    dates, values = dates[keep], values[keep]
+    if len(values) <= budget:
+        return dates, values
+    indices = lttb_indices(dates.astype('datetime64[ns]').astype(np.int64).astype(float), values, budget)
+    return dates[indices], values[indices]
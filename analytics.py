@@ -0,0 +1,141 @@
+"""The journal prepared once for analysis and shared by every consumer
+
+The graphs, their image endpoints and the PDF export all need the same
+thing: parsed dates, invalid rows dropped, sorted, numbers as numbers and
+the derived medication total. PreparedCache builds that once per data
+version and hands the same PreparedData to every request until the
+journal or the field configuration changes. The running statistics of a
+version are carried over to the next one by applying the rows that
+changed, when the store knows them.
+"""
+import json
+import threading
+from functools import cached_property
+
+import pandas as pd
+
+import metrics
+import running_stats
+
+MED_COLS = ['med1_mg', 'med2_mg', 'med3_mg', 'med4_mg']
+SUMMARY_STATS = ['mean', 'min', 'max']
+
+
+def number_fields(df, fields):
+    """Configured number fields present in df, in configuration order"""
+    return [name for name, config in fields.items() if config['type'] == 'number' and name in df.columns]
+
+
+def prepare(df, fields):
+    """Parse dates, drop rows without one, sort, type numbers and add total_med_mg"""
+    if 'date' not in df.columns:  # no entries at all
+        return df
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])  # Remove rows with invalid dates
+    df = df.sort_values('date', kind='stable')
+
+    # Plain float columns (NaN for missing) for the plotting and stats code;
+    # the store's nullable integers would need an na_value at every use
+    for col in number_fields(df, fields):
+        if pd.api.types.is_extension_array_dtype(df[col]) or not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+    med_cols = [col for col in MED_COLS if col in df.columns]
+    df['total_med_mg'] = df[med_cols].apply(pd.to_numeric, errors='coerce').sum(axis=1) if med_cols else 0
+    return df
+
+
+def summary_stats(df, fields):
+    """Mean, min and max of every number field with data, in one pass
+
+    Returns a frame indexed by field name with a label column.
+    """
+    columns = number_fields(df, fields)
+    stats = df[columns].agg(SUMMARY_STATS).T.dropna(how='all')
+    stats.insert(0, 'label', [fields[name]['label'] for name in stats.index])
+    return stats
+
+
+class PreparedData:
+    """One version of the journal, ready for plotting and reporting"""
+
+    def __init__(self, df, fields, version=None, stats=None):
+        self.loaded = len(df)  # rows before those without a valid date were dropped
+        with metrics.span('analytics.prepare'):
+            self.frame = prepare(df, fields)
+        self.fields = fields
+        self.version = version
+        if stats is not None:
+            self.stats = stats
+
+    @property
+    def empty(self):
+        return self.frame.empty
+
+    @cached_property
+    def summary(self):
+        return summary_stats(self.frame, self.fields)
+
+    @cached_property
+    def stats(self):
+        """Running correlations and daily sums of the number columns"""
+        with metrics.span('analytics.stats'):
+            return running_stats.JournalStats(self.frame)
+
+
+class PreparedCache:
+    """The PreparedData of the latest (data version, fields) seen
+
+    One per selection, e.g. the free-text fields a PDF export adds to the
+    columns the graphs need.
+
+    changes(since, until) should return the (removed, added) rows of every
+    write between two versions, or None if they are not known; with it the
+    running statistics are updated rather than rebuilt.
+    """
+
+    def __init__(self, changes=None):
+        self._changes = changes
+        self._key = None
+        self._prepared = {}
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def _carry_stats(self, key, fields):
+        """The previous version's statistics brought up to date, or None"""
+        old = next((prepared.__dict__['stats'] for prepared in self._prepared.values()
+                    if 'stats' in prepared.__dict__), None)
+        if old is None or self._changes is None or self._key[1] != key[1]:
+            return None
+        steps = self._changes(self._key[0], key[0])
+        if steps is None:
+            return None
+        stats = old.copy()  # requests still drawing the old version keep theirs intact
+        for removed, added in steps:
+            stats.update(None if removed is None else prepare(removed.copy(deep=False), fields),
+                         None if added is None else prepare(added.copy(deep=False), fields))
+        return stats
+
+    def get(self, version, fields, load, selection=frozenset()):
+        """Prepared data for version, calling load() for the raw frame only on a change
+
+        load() returns (version loaded, frame), e.g. DataStore.load_versioned().
+        When a write moved the journal past version before the load, the
+        result is kept under the version actually loaded, with statistics
+        of its own rather than ones carried to version.
+        """
+        key = (version, json.dumps(fields, sort_keys=True))
+        with self._lock:
+            if key != self._key:
+                self._stats = self._carry_stats(key, fields) if self._key is not None else None
+                self._prepared = {}
+                self._key = key
+            if selection in self._prepared:
+                return self._prepared[selection]
+            loaded, df = load()
+            if loaded != version:
+                prepared = PreparedData(df, fields, loaded)
+                if loaded is not None:
+                    self._key, self._stats, self._prepared = (loaded, key[1]), None, {selection: prepared}
+                return prepared
+            self._prepared[selection] = PreparedData(df, fields, version, self._stats)
+            return self._prepared[selection]
@@ -1,26 +1,85 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-import pandas as pd
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, make_response, Response, stream_template, get_flashed_messages, g, has_app_context
 import os
-import json
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import seaborn as sns
-import io
-import base64
+import multiprocessing
+import re
+import tempfile
+import time
+import click
+import functools
+import importlib
 from datetime import datetime
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, PageBreak, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
 from flask import send_file
+from werkzeug.local import LocalProxy
+from datastore import DataStore, CSVBackend, ColumnarBackend, SQLiteBackend, StaleWriteError, storage_frame
+from plot_cache import PlotCache
+from plot_renderer import PlotRenderer
+from pdf_jobs import PDFJobs
+from concurrent.futures import TimeoutError as PlotTimeoutError
+import plots
+import aggregation
+import bulk
+import entry_query
+import journals
+import metrics
+import migrations
+import running_stats
+import search
+import validation
 
 app = Flask(__name__)
 app.secret_key = 'klinikum_report_secret_key'
 
 CSV_FILE = 'klinikum_4weeks.csv'
 FIELDS_CONFIG_FILE = 'fields_config.json'
+# Field changes and whether the stored journal has caught up with them
+SCHEMA_LOG_FILE = os.environ.get('SCHEMA_LOG_FILE', 'schema_migrations.json')
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'klinikum.db')
+# 'csv' (default), 'sqlite', 'parquet' or 'feather'; run `flask --app app migrate-to-sqlite`
+# or `flask --app app import-csv` first
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'csv')
+COLUMNAR_FILE = os.environ.get('COLUMNAR_FILE') or f'klinikum.{STORAGE_BACKEND}'
+# Named journals, one directory each, served under /j/<name>/, and how many
+# of them a worker keeps loaded before dropping the least recently used
+JOURNALS_DIR = os.environ.get('JOURNALS_DIR', 'journals')
+JOURNAL_CACHE_SIZE = int(os.environ.get('JOURNAL_CACHE_SIZE', '32'))
+
+# Rendered graphs: in-memory LRU size and optional shared on-disk tier
+PLOT_CACHE_SIZE = int(os.environ.get('PLOT_CACHE_SIZE', '64'))
+PLOT_CACHE_DIR = os.environ.get('PLOT_CACHE_DIR') or None
+# Processes rendering graphs concurrently (0 = render in the request) and
+# how long one image request waits for its plot
+PLOT_WORKERS = int(os.environ.get('PLOT_WORKERS', '0'))
+PLOT_TIMEOUT = float(os.environ.get('PLOT_TIMEOUT', '60'))
+# 'seaborn' or 'fast' (plain matplotlib, same look, much cheaper on long histories)
+PLOT_RENDERER = os.environ.get('PLOT_RENDERER', 'seaborn')
+# Points a time-series graph draws before it is bucketed or downsampled
+PLOT_MAX_POINTS = int(os.environ.get('PLOT_MAX_POINTS', str(aggregation.DEFAULT_MAX_POINTS)))
+PLOT_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Finished PDF reports and their job status files, and the processes building them
+PDF_EXPORT_DIR = os.environ.get('PDF_EXPORT_DIR') or os.path.join(tempfile.gettempdir(), 'klinikum_exports')
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', '1'))
+# Free-text fields listed under Daily Notes unless the export asks for others (?include=)
+PDF_NOTE_FIELDS = os.environ.get('PDF_NOTE_FIELDS', 'notes').split(',')
+# Finished reports are kept for reuse up to this much disk and this many days
+PDF_EXPORT_MAX_MB = float(os.environ.get('PDF_EXPORT_MAX_MB', '200'))
+PDF_EXPORT_MAX_DAYS = float(os.environ.get('PDF_EXPORT_MAX_DAYS', '7'))
+PDF_JOB_ID = re.compile(r'[0-9a-f]{40}')
+# Import the plotting and PDF modules at startup instead of on first use;
+# with `gunicorn --preload` the workers then share them with the master
+PRELOAD_MODULES = os.environ.get('PRELOAD_MODULES', '0') == '1'
+# Answer requests made with ?profile=1 with a profile of the request
+# (timings themselves are switched by METRICS_ENABLED, see metrics.py)
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '0') == '1'
+
+# Entries per page of GET /api/entries, and how many errors a bulk import reports
+API_DEFAULT_PER_PAGE = 100
+API_MAX_PER_PAGE = 1000
+API_MAX_ERRORS = 100
+# Content types read as NDJSON by POST /api/entries/bulk
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+STALE_WRITE_MESSAGE = 'The journal was changed by someone else in the meantime. Please review and try again.'
 
 # Default field configuration
 DEFAULT_FIELDS = {
@@ -28,13 +87,13 @@ DEFAULT_FIELDS = {
     "mood_score": {"label": "Mood Score", "type": "number", "required": True, "min": 1, "max": 10},
     "panic_intensity": {"label": "Panic Intensity", "type": "number", "required": True, "min": 1, "max": 10},
     "headache_intensity": {"label": "Headache Intensity", "type": "number", "required": True, "min": 1, "max": 10},
-    "sleep_hours": {"label": "Sleep Hours", "type": "number", "required": True, "min": 0, "max": 24},
+    "sleep_hours": {"label": "Sleep Hours", "type": "number", "required": True, "min": 0, "max": 24, "step": 0.5},
     "hope_score": {"label": "Hope Score", "type": "number", "required": True, "min": 1, "max": 10},
     "sedation_feeling": {"label": "Sedation Feeling", "type": "number", "required": True, "min": 1, "max": 10},
-    "med1_mg": {"label": "Medication 1 (mg)", "type": "number", "required": True, "min": 0, "max": None},
-    "med2_mg": {"label": "Medication 2 (mg)", "type": "number", "required": True, "min": 0, "max": None},
-    "med3_mg": {"label": "Medication 3 (mg)", "type": "number", "required": True, "min": 0, "max": None},
-    "med4_mg": {"label": "Medication 4 (mg)", "type": "number", "required": True, "min": 0, "max": None},
+    "med1_mg": {"label": "Medication 1 (mg)", "type": "number", "required": True, "min": 0, "max": None, "step": 0.5},
+    "med2_mg": {"label": "Medication 2 (mg)", "type": "number", "required": True, "min": 0, "max": None, "step": 0.5},
+    "med3_mg": {"label": "Medication 3 (mg)", "type": "number", "required": True, "min": 0, "max": None, "step": 0.5},
+    "med4_mg": {"label": "Medication 4 (mg)", "type": "number", "required": True, "min": 0, "max": None, "step": 0.5},
     "energy_level": {"label": "Energy Level", "type": "number", "required": False, "min": 1, "max": 10},
     "appetite": {"label": "Appetite", "type": "number", "required": False, "min": 1, "max": 10},
     "social_interaction": {"label": "Social Interaction", "type": "number", "required": False, "min": 1, "max": 10},
@@ -45,111 +104,243 @@ DEFAULT_FIELDS = {
     "remarks": {"label": "Remarks", "type": "textarea", "required": False, "min": None, "max": None}
 }
 
+def journal_file(file_name, directory=None):
+    """Where a journal keeps file_name: as configured for the default journal, else in its directory"""
+    return file_name if directory is None else os.path.join(directory, os.path.basename(file_name))
+
+def create_backend(directory=None):
+    """Create the journal storage backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        return SQLiteBackend(journal_file(SQLITE_FILE, directory))
+    if STORAGE_BACKEND in ColumnarBackend.formats:
+        return ColumnarBackend(journal_file(COLUMNAR_FILE, directory), STORAGE_BACKEND)
+    return CSVBackend(journal_file(CSV_FILE, directory))
+
+def open_journal(name, directory=None):
+    """The journal kept in directory, or the default one in the working directory"""
+    store = DataStore(create_backend(directory), journal_file(FIELDS_CONFIG_FILE, directory), DEFAULT_FIELDS)
+    return journals.Journal(name, directory, store, migrations.MigrationLog(journal_file(SCHEMA_LOG_FILE, directory)))
+
+default_journal = open_journal(None)
+journal_registry = journals.JournalRegistry(JOURNALS_DIR, open_journal, JOURNAL_CACHE_SIZE)
+
+def current_journal():
+    """The journal being served: the one named by /j/<journal>/ or --journal, else the default"""
+    if has_app_context():
+        return g.get('journal', default_journal)
+    return default_journal
+
+# The current journal's storage and caches, so views, commands and scripts
+# work on whichever journal they were asked for (outside a request, the default)
+store = LocalProxy(lambda: current_journal().store)
+prepared_cache = LocalProxy(lambda: current_journal().prepared_cache)
+search_index = LocalProxy(lambda: current_journal().search_index)
+schema_log = LocalProxy(lambda: current_journal().schema_log)
+compactor = LocalProxy(lambda: current_journal().compactor)
+plot_cache = PlotCache(PLOT_CACHE_SIZE, PLOT_CACHE_DIR)
+pdf_jobs = PDFJobs(PDF_EXPORT_DIR, PDF_WORKERS, max_bytes=int(PDF_EXPORT_MAX_MB * 1024 * 1024),
+                   max_age=PDF_EXPORT_MAX_DAYS * 24 * 3600)
+plot_renderer = PlotRenderer(plot_cache, PLOT_WORKERS, PLOT_TIMEOUT, PLOT_RENDERER)
+
+def preload():
+    """Import matplotlib, seaborn and reportlab now rather than on the first graph or export
+
+    Run in the gunicorn master (--preload), the forked workers share the
+    imported modules copy-on-write instead of each importing its own. The
+    forkserver is told to load them too, so plot and PDF pool processes
+    start with them already imported.
+    """
+    importlib.import_module('pdf_report')  # imports plot_drawing as well
+    plots.apply_theme()
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        multiprocessing.get_context('forkserver').set_forkserver_preload(['plot_drawing', 'pdf_report'])
+
+if PRELOAD_MODULES:
+    preload()
+
+if PROFILE_REQUESTS:
+    app.wsgi_app = metrics.ProfilerMiddleware(app.wsgi_app)
+
+def journal_route(rule, **options):
+    """app.route() at rule for the default journal and at /j/<journal>rule for named ones"""
+    def decorator(view):
+        app.add_url_rule(f'/j/<journal>{rule}', view_func=view, **options)
+        return app.route(rule, **options)(view)
+    return decorator
+
+@app.url_value_preprocessor
+def select_journal(endpoint, values):
+    """Serve /j/<journal>/... from that journal, or 404 if there is none"""
+    if values and 'journal' in values:
+        journal = journal_registry.get(values.pop('journal'))
+        if journal is None:
+            abort(404)
+        g.journal = journal
+
+@app.url_defaults
+def stay_in_journal(endpoint, values):
+    """Links made while serving a named journal go to its own pages"""
+    journal = g.get('journal')
+    if journal is not None and 'journal' not in values and app.url_map.is_endpoint_expecting(endpoint, 'journal'):
+        values['journal'] = journal.name
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    """Time every request into klinikum_request_seconds by endpoint, method and status"""
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe('request_seconds', time.perf_counter() - started, endpoint=request.endpoint or 'none',
+                        method=request.method, status=response.status_code)
+    return response
+
 def load_fields_config():
-    """Load field configuration from JSON file"""
-    if os.path.exists(FIELDS_CONFIG_FILE):
-        with open(FIELDS_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return DEFAULT_FIELDS
+    """Load field configuration (cached until fields_config.json changes)"""
+    return store.load_fields()
 
 def save_fields_config(fields):
     """Save field configuration to JSON file"""
-    with open(FIELDS_CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(fields, f, indent=2, ensure_ascii=False)
-
-def load_data():
-    """Load data from CSV file"""
-    if os.path.exists(CSV_FILE):
-        df = pd.read_csv(CSV_FILE)
-        # Ensure all configured fields exist
-        fields = load_fields_config()
-        for field in fields.keys():
-            if field not in df.columns:
-                df[field] = '' if fields[field]['type'] == 'text' or fields[field]['type'] == 'textarea' else 0
-        return df
-    return pd.DataFrame()
+    store.save_fields(fields)
+
+def record_migration(action, field_name, config=None, previous=None):
+    """Log a field change and let the background compactor carry it over to storage"""
+    schema_log.record(action, field_name, config, previous)
+    compactor.start()
+
+def load_data(columns=None):
+    """Load data from storage (cached until it changes), optionally only some columns"""
+    return store.load_data(columns)
 
 def save_data(df):
     """Save data to CSV file"""
-    df.to_csv(CSV_FILE, index=False, encoding='utf-8')
+    store.save_data(df)
 
-@app.route('/')
+@journal_route('/')
 def index():
-    """Display all entries"""
+    """Display one page of entries, filtered by date range and field values"""
+    # Read the version first: if a write slips in before load_data() the
+    # links carry an older token and are rejected rather than misdirected
+    version = store.version()
     df = load_data()
     fields = load_fields_config()
 
+    start, end = request.args.get('from', ''), request.args.get('to', '')
+    filters, invalid = entry_query.parse_filters(fields, request.args)
+    if invalid:
+        flash(f'Ignoring filters that are not numbers or ranges: {", ".join(invalid)}', 'warning')
+    per_page = request.args.get('per_page', entry_query.DEFAULT_PER_PAGE, type=int)
+    if per_page not in entry_query.PER_PAGE_CHOICES:
+        per_page = entry_query.DEFAULT_PER_PAGE
+    shown_fields = entry_query.project_fields(fields, request.args.getlist('cols'))
+
     if df.empty:
         flash('No data found. Please add your first entry!', 'warning')
-        return render_template('index.html', entries=[], fields=fields)
-
-    entries = df.to_dict('records')
-    return render_template('index.html', entries=entries, fields=fields)
-
-@app.route('/edit/<int:index>', methods=['GET', 'POST'])
+        matches = df
+    else:
+        matches = entry_query.filter_entries(df, fields, start, end, filters)
+    rows, page, pages = entry_query.paginate(matches, request.args.get('page', 1, type=int), per_page)
+    entries = entry_query.display_records(rows, list(shown_fields))
+
+    # Links to other pages keep every filter but the page number
+    query = request.args.to_dict(flat=False)
+    query.pop('page', None)
+
+    # Flashed messages are taken from the session before the body streams,
+    # after which the session cookie can no longer be updated
+    get_flashed_messages(with_categories=True)
+    return stream_template('index.html', entries=entries, fields=fields, shown_fields=shown_fields,
+                           version=version, total=len(df), matches=len(matches), page=page, pages=pages,
+                           per_page=per_page, per_page_choices=entry_query.PER_PAGE_CHOICES,
+                           start=start, end=end, filters=filters, query=query,
+                           filter_prefix=entry_query.FILTER_PREFIX)
+
+def parse_number(value):
+    """Form input as an int, or a float when it has a fractional part"""
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+def flash_errors(errors):
+    """Show validation errors above the form"""
+    for error in errors:
+        flash(error['message'], 'danger')
+
+def row_link_version():
+    """Version a row link must match, or None when row ids never shift"""
+    if store.backend.positional_ids:
+        return request.args.get('version')
+    return None
+
+@journal_route('/edit/<int:index>', methods=['GET', 'POST'])
 def edit(index):
     """Edit a specific entry"""
-    df = load_data()
     fields = load_fields_config()
 
     if request.method == 'POST':
-        # Update the entry with all configured fields
-        for field_name, field_config in fields.items():
-            value = request.form.get(field_name, '')
-
-            if field_config['type'] == 'number':
-                try:
-                    df.loc[index, field_name] = int(value) if value else 0
-                except ValueError:
-                    df.loc[index, field_name] = 0
-            else:
-                df.loc[index, field_name] = value
-
-        save_data(df)
-        flash('Entry updated successfully!', 'success')
+        updated_entry, errors = validation.validator(fields).validate_entry(request.form)
+        if errors:
+            flash_errors(errors)
+            entry = {field_name: request.form.get(field_name, '') for field_name in fields}
+            entry['index'] = index
+            return render_template('edit.html', entry=entry, fields=fields, version=request.form.get('version')), 400
+
+        try:
+            updated = store.update_entry(index, updated_entry, request.form.get('version'))
+        except StaleWriteError:
+            flash(STALE_WRITE_MESSAGE, 'danger')
+            return redirect(url_for('edit', index=index))
+        if updated:
+            flash('Entry updated successfully!', 'success')
+        else:
+            flash('Entry not found!', 'danger')
         return redirect(url_for('index'))
 
-    entry = df.iloc[index].to_dict()
+    version = store.version()
+    expected_version = row_link_version()
+    if expected_version is not None and expected_version != version:
+        flash(STALE_WRITE_MESSAGE, 'danger')
+        return redirect(url_for('index'))
+    entry = store.get_entry(index)
+    if entry is None:
+        flash('Entry not found!', 'danger')
+        return redirect(url_for('index'))
     entry['index'] = index
-    return render_template('edit.html', entry=entry, fields=fields)
+    return render_template('edit.html', entry=entry, fields=fields, version=version)
 
-@app.route('/add', methods=['GET', 'POST'])
+@journal_route('/add', methods=['GET', 'POST'])
 def add():
     """Add a new entry"""
     fields = load_fields_config()
 
     if request.method == 'POST':
-        df = load_data()
-        new_entry = {}
+        new_entry, errors = validation.validator(fields).validate_entry(request.form)
+        if errors:
+            flash_errors(errors)
+            return render_template('add.html', fields=fields, entry=request.form), 400
 
-        for field_name, field_config in fields.items():
-            value = request.form.get(field_name, '')
-
-            if field_config['type'] == 'number':
-                try:
-                    new_entry[field_name] = int(value) if value else 0
-                except ValueError:
-                    new_entry[field_name] = 0
-            else:
-                new_entry[field_name] = value
-
-        df = pd.concat([df, pd.DataFrame([new_entry])], ignore_index=True)
-        save_data(df)
+        store.add_entry(new_entry)
         flash('New entry added successfully!', 'success')
         return redirect(url_for('index'))
 
     return render_template('add.html', fields=fields)
 
-@app.route('/delete/<int:index>')
+@journal_route('/delete/<int:index>')
 def delete(index):
     """Delete an entry"""
-    df = load_data()
-    df = df.drop(index).reset_index(drop=True)
-    save_data(df)
-    flash('Entry deleted successfully!', 'success')
+    try:
+        deleted = store.delete_entry(index, row_link_version())
+    except StaleWriteError:
+        flash(STALE_WRITE_MESSAGE, 'danger')
+        return redirect(url_for('index'))
+    if deleted:
+        flash('Entry deleted successfully!', 'success')
+    else:
+        flash('Entry not found!', 'danger')
     return redirect(url_for('index'))
 
-@app.route('/fields', methods=['GET', 'POST'])
+@journal_route('/fields', methods=['GET', 'POST'])
 def manage_fields():
     """Manage custom fields"""
     if request.method == 'POST':
@@ -163,8 +354,14 @@ def manage_fields():
             field_required = request.form.get('field_required') == 'on'
             field_min = request.form.get('field_min', '')
             field_max = request.form.get('field_max', '')
-
-            if field_name and field_label:
+            field_step = request.form.get('field_step', '')
+
+            if field_name in fields:
+                flash(f'A field named "{field_name}" already exists!', 'danger')
+            elif schema_log.pending_delete(field_name):
+                flash(f'The data of the deleted field "{field_name}" is still being removed. '
+                      f'Please try again in a moment.', 'warning')
+            elif field_name and field_label:
                 fields[field_name] = {
                     "label": field_label,
                     "type": field_type,
@@ -172,13 +369,14 @@ def manage_fields():
                     "min": int(field_min) if field_min else None,
                     "max": int(field_max) if field_max else None
                 }
+                if field_type == 'number' and field_step:
+                    fields[field_name]["step"] = parse_number(field_step)
                 save_fields_config(fields)
 
-                # Add column to existing data
-                df = load_data()
-                if not df.empty and field_name not in df.columns:
-                    df[field_name] = '' if field_type in ['text', 'textarea'] else 0
-                    save_data(df)
+                # Existing entries read the new field as empty until the
+                # compactor writes the column out
+                store.add_field(field_name, fields[field_name])
+                record_migration('add', field_name, fields[field_name])
 
                 flash(f'Field "{field_label}" added successfully!', 'success')
             else:
@@ -190,8 +388,9 @@ def manage_fields():
             if field_to_delete and field_to_delete not in protected_fields:
                 fields = load_fields_config()
                 if field_to_delete in fields:
-                    del fields[field_to_delete]
+                    previous = fields.pop(field_to_delete)
                     save_fields_config(fields)
+                    record_migration('delete', field_to_delete, previous=previous)
                     flash(f'Field deleted successfully!', 'success')
             else:
                 flash('Cannot delete protected fields (date, notes, thoughts, remarks)!', 'danger')
@@ -199,16 +398,30 @@ def manage_fields():
         return redirect(url_for('manage_fields'))
 
     fields = load_fields_config()
-    return render_template('fields.html', fields=fields)
+    schema = schema_log.read()
+    if any(migration['applied'] is None for migration in schema['migrations']):
+        compactor.start()  # e.g. left over from a restart
+    return render_template('fields.html', fields=fields, schema=schema)
 
-@app.route('/reset-fields', methods=['POST'])
+@journal_route('/reset-fields', methods=['POST'])
 def reset_fields():
     """Reset fields to default configuration"""
+    fields = load_fields_config()
     save_fields_config(DEFAULT_FIELDS)
+    # Log what the reset changes, as if each field had been edited by hand
+    for field_name, previous in fields.items():
+        if field_name not in DEFAULT_FIELDS:
+            record_migration('delete', field_name, previous=previous)
+        elif DEFAULT_FIELDS[field_name]['type'] != previous['type']:
+            record_migration('retype', field_name, DEFAULT_FIELDS[field_name], previous)
+    for field_name, config in DEFAULT_FIELDS.items():
+        if field_name not in fields:
+            store.add_field(field_name, config)
+            record_migration('add', field_name, config)
     flash('Fields reset to default configuration!', 'success')
     return redirect(url_for('manage_fields'))
 
-@app.route('/edit-field/<field_name>', methods=['GET', 'POST'])
+@journal_route('/edit-field/<field_name>', methods=['GET', 'POST'])
 def edit_field(field_name):
     """Edit an existing field"""
     fields = load_fields_config()
@@ -223,8 +436,10 @@ def edit_field(field_name):
         field_required = request.form.get('field_required') == 'on'
         field_min = request.form.get('field_min', '')
         field_max = request.form.get('field_max', '')
+        field_step = request.form.get('field_step', '')
 
         if field_label:
+            previous = fields[field_name]
             fields[field_name] = {
                 "label": field_label,
                 "type": field_type,
@@ -232,7 +447,12 @@ def edit_field(field_name):
                 "min": int(field_min) if field_min else None,
                 "max": int(field_max) if field_max else None
             }
+            if field_type == 'number' and field_step:
+                fields[field_name]["step"] = parse_number(field_step)
             save_fields_config(fields)
+            if field_type != previous['type']:
+                # Loads convert the old values until the compactor has
+                record_migration('retype', field_name, fields[field_name], previous)
             flash(f'Field "{field_label}" updated successfully!', 'success')
             return redirect(url_for('manage_fields'))
         else:
@@ -241,445 +461,395 @@ def edit_field(field_name):
     field_config = fields[field_name]
     return render_template('edit_field.html', field_name=field_name, field_config=field_config)
 
-def create_plot_base64(fig):
-    """Convert matplotlib figure to base64 string"""
-    img = io.BytesIO()
-    fig.savefig(img, format='png', bbox_inches='tight', dpi=150)
-    img.seek(0)
-    plot_data = base64.b64encode(img.getvalue()).decode()
-    plt.close(fig)
-    return plot_data
+def plot_cache_key(spec, fingerprint, fmt):
+    return (fingerprint, spec.plot_id, plots.THEME_NAME, PLOT_RENDERER, plots.DPI, fmt)
 
-@app.route('/graphs')
-def graphs():
-    """Display visualizations"""
-    df = load_data()
+def plot_window():
+    """Graph window and bucketing from the query string (?from=&to=&bucket=&points=)"""
+    return {key: request.args[key] for key in ('from', 'to', 'bucket', 'points') if request.args.get(key)}
+
+def analysis_columns(fields, note_fields=()):
+    """Every column except the free text, which only the PDF's Daily Notes read"""
+    skipped = {name for name, config in fields.items()
+               if config['type'] in ('text', 'textarea') and name not in note_fields}
+    return [name for name in dict.fromkeys(store.columns() + list(fields)) if name not in skipped]
 
+def prepared_data(note_fields=()):
+    """The journal prepared for analysis, shared by the graphs and the PDF export
+
+    Text fields are left in storage unless listed in note_fields.
+    """
+    fields = load_fields_config()
+    return prepared_cache.get(store.version(), fields,
+                              lambda: store.load_versioned(analysis_columns(fields, note_fields)),
+                              frozenset(note_fields))
+
+def plot_data(sources=None):
+    """Journal prepared for plotting within the requested window
+
+    Returns (rows in the window, {source: frame} as plots.plot_frames()
+    builds them, running statistics, fields); everything but fields is
+    None if there is nothing to plot.
+    """
+    prepared = prepared_data()
+    df, fields = prepared.frame, prepared.fields
     if df.empty:
+        return None, None, None, fields
+    window = plot_window()
+    rows = aggregation.select_window(df, window.get('from'), window.get('to'))
+    if rows.empty:
+        return None, None, None, fields
+    # The whole journal's statistics are kept up to date between writes;
+    # a narrower window gets its own from its rows
+    stats = prepared.stats if len(rows) == len(df) else running_stats.JournalStats(rows)
+    max_points = request.args.get('points', PLOT_MAX_POINTS, type=int)
+    max_points = min(max(max_points, 10), 5000)
+    with metrics.span('plot.frames'):
+        frames = plots.plot_frames(rows, stats, window.get('bucket', 'auto'), max_points, sources)
+    return rows, frames, stats, fields
+
+def recent_averages(stats, fields):
+    """[(label, [mean per trend window])] of the trend columns, up to the latest entry"""
+    means = [stats.window_means(days) for days in plots.TREND_WINDOWS]
+    return [(fields.get(col, {}).get('label', col), [window[col] for window in means])
+            for col in plots.TREND_COLUMNS if col in stats.columns]
+
+@journal_route('/graphs')
+def graphs():
+    """Display visualizations"""
+    if not prepared_data().loaded:
         flash('No data available for visualization. Please add entries first.', 'warning')
         return redirect(url_for('index'))
 
     try:
-        # Prepare data
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['date'])  # Remove rows with invalid dates
-        df = df.sort_values('date')
+        df, frames, stats, fields = plot_data()
 
-        if df.empty:
+        if df is None:
             flash('No valid date entries found. Please check your data.', 'warning')
             return redirect(url_for('index'))
 
-        # Check if we have numeric columns for medication
-        df['total_med_mg'] = 0
-        for col in ['med1_mg', 'med2_mg', 'med3_mg', 'med4_mg']:
-            if col in df.columns:
-                df['total_med_mg'] += pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-        # Set theme - Minimal black and white
-        sns.set_theme(style="whitegrid",
-                      rc={"axes.facecolor":"#ffffff",
-                          "grid.color":"#cccccc",
-                          "figure.figsize":(12,6),
-                          "axes.edgecolor":"#000000",
-                          "axes.linewidth":2,
-                          "grid.linewidth":0.5,
-                          "xtick.color":"#000000",
-                          "ytick.color":"#000000",
-                          "text.color":"#000000",
-                          "font.family":"monospace"})
-
-        plots = []
-
-        # 1. Mood / Panic / Headache
-        if all(col in df.columns for col in ['mood_score', 'panic_intensity', 'headache_intensity']):
-            fig1, ax1 = plt.subplots(figsize=(12,6))
-            sns.lineplot(df, x='date', y='mood_score', label='Mood', color='#000', lw=2.5, marker='o', ax=ax1)
-            sns.lineplot(df, x='date', y='panic_intensity', label='Panic', color='#000', lw=2.5, ls='--', marker='s', ax=ax1)
-            sns.lineplot(df, x='date', y='headache_intensity', label='Headache', color='#666', lw=2.5, ls=':', marker='^', ax=ax1)
-            ax1.set_title('Mood, Panic, and Headache Over Time', fontsize=14, fontweight='bold')
-            ax1.set_xlabel('Date'); ax1.set_ylabel('Score (1-10)')
-            ax1.legend(); fig1.tight_layout()
-            plots.append({
-                'title': 'Mood, Panic, and Headache Trends',
-                'image': create_plot_base64(fig1)
-            })
-
-        # 2. Medications
-        med_cols = [col for col in ['med1_mg', 'med2_mg', 'med3_mg', 'med4_mg'] if col in df.columns]
-        if med_cols:
-            fig2, ax2 = plt.subplots(figsize=(12,6))
-            colors_bw = ['#000', '#333', '#666', '#999']
-            markers = ['o', 's', '^', 'D']
-            linestyles = ['-', '--', '-.', ':']
-            for i, col in enumerate(med_cols):
-                sns.lineplot(df, x='date', y=col, lw=2.5, label=f'Med {i+1}',
-                           color=colors_bw[i], marker=markers[i], linestyle=linestyles[i], ax=ax2)
-            ax2.set_title('Medication Dosages Over Time', fontsize=14, fontweight='bold')
-            ax2.set_xlabel('Date'); ax2.set_ylabel('Dosage (mg)')
-            ax2.legend(); fig2.tight_layout()
-            plots.append({
-                'title': 'Medication Tracking',
-                'image': create_plot_base64(fig2)
-            })
-
-        # 3. Headache vs Total Meds
-        if 'headache_intensity' in df.columns and df['total_med_mg'].sum() > 0:
-            fig3, ax3 = plt.subplots(figsize=(12,6))
-            ax3_twin = ax3.twinx()
-            sns.lineplot(df, x='date', y='headache_intensity', label='Headache',
-                         color='#000', lw=2.5, marker='o', ax=ax3)
-            sns.lineplot(df, x='date', y='total_med_mg', label='Total Medication',
-                         color='#666', lw=2.5, ls='--', marker='s', ax=ax3_twin)
-            ax3.set_title('Headache vs Total Medication', fontsize=14, fontweight='bold')
-            ax3.set_xlabel('Date')
-            ax3.set_ylabel('Headache Intensity', color='#000')
-            ax3_twin.set_ylabel('Total Medication (mg)', color='#666')
-            ax3.legend(loc='upper left'); ax3_twin.legend(loc='upper right')
-            fig3.tight_layout()
-            plots.append({
-                'title': 'Headache vs Medication Relationship',
-                'image': create_plot_base64(fig3)
-            })
-
-        # 4. Energy, Appetite, Social (if available)
-        wellness_cols = []
-        if 'energy_level' in df.columns:
-            wellness_cols.append(('energy_level', 'Energy', '#000', 'o', '-'))
-        if 'appetite' in df.columns:
-            wellness_cols.append(('appetite', 'Appetite', '#333', 's', '--'))
-        if 'social_interaction' in df.columns:
-            wellness_cols.append(('social_interaction', 'Social', '#666', '^', '-.'))
-
-        if wellness_cols:
-            fig4, ax4 = plt.subplots(figsize=(12,6))
-            for col, label, color, marker, ls in wellness_cols:
-                sns.lineplot(df, x='date', y=col, label=label, color=color, lw=2.5, marker=marker, linestyle=ls, ax=ax4)
-            ax4.set_title('Wellness Metrics Over Time', fontsize=14, fontweight='bold')
-            ax4.set_xlabel('Date'); ax4.set_ylabel('Score (1-10)')
-            ax4.legend(); fig4.tight_layout()
-            plots.append({
-                'title': 'Wellness Tracking',
-                'image': create_plot_base64(fig4)
-            })
-
-        # 5. Sleep Hours
-        if 'sleep_hours' in df.columns:
-            fig5, ax5 = plt.subplots(figsize=(12,6))
-            sns.lineplot(df, x='date', y='sleep_hours', color='#000', lw=2.5, marker='o', ax=ax5)
-            ax5.axhline(y=7, color='#666', linestyle='--', linewidth=2, label='Recommended (7h)')
-            ax5.set_title('Sleep Pattern', fontsize=14, fontweight='bold')
-            ax5.set_xlabel('Date'); ax5.set_ylabel('Hours')
-            ax5.legend(); fig5.tight_layout()
-            plots.append({
-                'title': 'Sleep Tracking',
-                'image': create_plot_base64(fig5)
-            })
-
-        # 6. Correlation Heatmap (for numeric columns)
-        numeric_cols = df.select_dtypes(include=['int64', 'float64']).columns.tolist()
-        numeric_cols = [col for col in numeric_cols if col != 'total_med_mg']
-
-        if len(numeric_cols) > 1:
-            fig6, ax6 = plt.subplots(figsize=(10,8))
-            corr = df[numeric_cols].corr()
-            sns.heatmap(corr, annot=True, cmap='Greys', center=0, fmt='.2f', ax=ax6,
-                        square=True, linewidths=2, linecolor='#000', cbar=True)
-            ax6.set_title('Correlation Matrix', fontsize=14, fontweight='bold')
-            fig6.tight_layout()
-            plots.append({
-                'title': 'Correlation Analysis',
-                'image': create_plot_base64(fig6)
-            })
-
-        # 7. Exercise tracking (if available)
-        if 'exercise_minutes' in df.columns:
-            fig7, ax7 = plt.subplots(figsize=(12,6))
-            sns.barplot(df, x='date', y='exercise_minutes', color='#000', edgecolor='#000', linewidth=1.5, ax=ax7)
-            ax7.set_title('Exercise Activity', fontsize=14, fontweight='bold')
-            ax7.set_xlabel('Date'); ax7.set_ylabel('Minutes')
-            plt.xticks(rotation=45)
-            fig7.tight_layout()
-            plots.append({
-                'title': 'Exercise Log',
-                'image': create_plot_base64(fig7)
-            })
-
-        # 8. Hope vs Mood (if available)
-        if 'hope_score' in df.columns and 'mood_score' in df.columns:
-            fig8, ax8 = plt.subplots(figsize=(12,6))
-            sns.lineplot(df, x='date', y='mood_score', label='Mood', color='#000', lw=2.5, marker='o', ax=ax8)
-            sns.lineplot(df, x='date', y='hope_score', label='Hope', color='#666', lw=2.5, marker='s', linestyle='--', ax=ax8)
-            ax8.set_title('Mood vs Hope Score', fontsize=14, fontweight='bold')
-            ax8.set_xlabel('Date'); ax8.set_ylabel('Score (1-10)')
-            ax8.legend(); fig8.tight_layout()
-            plots.append({
-                'title': 'Emotional Well-being',
-                'image': create_plot_base64(fig8)
-            })
-
-        # 9. Death Thoughts Tracking (if available)
-        if 'die_thoughts' in df.columns:
-            fig9, ax9 = plt.subplots(figsize=(12,6))
-            sns.lineplot(df, x='date', y='die_thoughts', color='#000', lw=3, marker='o', markersize=8, ax=ax9)
-            ax9.fill_between(df['date'], df['die_thoughts'], alpha=0.2, color='#000')
-            ax9.set_title('Death Thoughts Intensity Over Time', fontsize=14, fontweight='bold')
-            ax9.set_xlabel('Date'); ax9.set_ylabel('Intensity (0-10)')
-            ax9.axhline(y=5, color='#666', linestyle='--', linewidth=1.5, alpha=0.5, label='Moderate Level')
-            ax9.legend(); fig9.tight_layout()
-            plots.append({
-                'title': 'Death Thoughts Tracking',
-                'image': create_plot_base64(fig9)
-            })
-
-        # 10. Custom numeric fields (auto-detect and graph)
-        fields = load_fields_config()
-        custom_numeric_fields = []
-        predefined = ['mood_score', 'panic_intensity', 'headache_intensity', 'sleep_hours',
-                      'hope_score', 'sedation_feeling', 'med1_mg', 'med2_mg', 'med3_mg', 'med4_mg',
-                      'energy_level', 'appetite', 'social_interaction', 'exercise_minutes', 'die_thoughts']
-
-        for field_name, field_config in fields.items():
-            if field_name not in predefined and field_config['type'] == 'number' and field_name in df.columns:
-                custom_numeric_fields.append((field_name, field_config['label']))
-
-        if custom_numeric_fields:
-            fig10, ax10 = plt.subplots(figsize=(12,6))
-            for field_name, field_label in custom_numeric_fields:
-                sns.lineplot(df, x='date', y=field_name, label=field_label, lw=2.5, marker='o', ax=ax10)
-            ax10.set_title('Custom Metrics Over Time', fontsize=14, fontweight='bold')
-            ax10.set_xlabel('Date'); ax10.set_ylabel('Value')
-            ax10.legend(); fig10.tight_layout()
-            plots.append({
-                'title': 'Custom Fields Tracking',
-                'image': create_plot_base64(fig10)
-            })
-
-        # Clear any remaining matplotlib figures to free memory
-        plt.close('all')
-
-        return render_template('graphs.html', plots=plots, entry_count=len(df))
+        # Images are fetched separately from graph_image(), in parallel and lazily.
+        # Start rendering the stale ones now so they are ready when asked for.
+        available = list(plots.available_plots(frames, fields))
+        plot_renderer.prefetch([(plot_cache_key(spec, fingerprint, 'png'), spec, frame, fields, 'png')
+                                for spec, frame, fingerprint in available])
+        available = [{'plot_id': spec.plot_id, 'title': spec.title} for spec, _, _ in available]
+        text_fields = [name for name, config in fields.items() if config['type'] in ('text', 'textarea')]
+        return render_template('graphs.html', plots=available, entry_count=len(df),
+                               window=plot_window(), buckets=aggregation.BUCKET_CHOICES,
+                               text_fields=text_fields, averages=recent_averages(stats, fields),
+                               trend_windows=plots.TREND_WINDOWS)
 
     except Exception as e:
-        plt.close('all')  # Clean up any figures
         flash(f'Error generating graphs: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
-@app.route('/export-pdf')
+@journal_route('/graphs/<plot_id>.<any(png, svg):fmt>')
+def graph_image(plot_id, fmt):
+    """Serve one plot as an image, revalidated by ETag/Last-Modified"""
+    spec = plots.PLOTS_BY_ID.get(plot_id)
+    if spec is None:
+        abort(404)
+    _, frames, _, fields = plot_data([spec.source])
+    frame = frames[spec.source] if frames is not None else None
+    columns = spec.columns(frame, fields) if frame is not None else None
+    if columns is None:
+        abort(404)
+
+    fingerprint = plots.data_fingerprint(frame, columns, fields)
+    etag = f'{fingerprint}-{plots.THEME_NAME}-{PLOT_RENDERER}-{plots.DPI}-{fmt}'
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            data = plot_renderer.render(plot_cache_key(spec, fingerprint, fmt), spec, frame, fields, fmt)
+        except PlotTimeoutError:
+            abort(503)
+        response = Response(data, mimetype=PLOT_MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.last_modified = store.last_modified()
+    response.cache_control.no_cache = True  # always revalidate, usually a 304
+    return response.make_conditional(request)
+
+@app.route('/graphs/cache-stats')
+def graphs_cache_stats():
+    """Plot cache hit/miss counters for this worker"""
+    return jsonify(plot_cache.stats())
+
+@app.route('/journals', methods=['GET', 'POST'])
+def list_journals():
+    """The named journals, and a form to start a new one"""
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        try:
+            journal_registry.create(name).store.save_fields(DEFAULT_FIELDS)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('list_journals'))
+        flash(f'Journal "{name}" created.', 'success')
+        return redirect(url_for('index', journal=name))
+
+    names = journal_registry.names()
+    if wants_json():
+        return jsonify(journals=names, loaded=journal_registry.stats())
+    return render_template('journals.html', names=names)
+
+@app.route('/metrics')
+def metrics_text():
+    """Request and stage timings and storage counters of this worker, for Prometheus"""
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+@journal_route('/export-pdf', methods=['GET', 'POST'])
 def export_pdf():
-    """Export complete report as PDF"""
-    df = load_data()
-
-    if df.empty:
+    """Start building the PDF report in the background and show its progress"""
+    fields = load_fields_config()
+    note_fields = [name for name in request.values.getlist('include') or PDF_NOTE_FIELDS
+                   if fields.get(name, {}).get('type') in ('text', 'textarea')]
+    prepared = prepared_data(note_fields)
+    if not prepared.loaded:
         flash('No data to export!', 'warning')
         return redirect(url_for('index'))
 
     try:
-        # Prepare data
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['date'])
-        df = df.sort_values('date')
-        fields = load_fields_config()
+        df, fields = prepared.frame, prepared.fields
 
         if df.empty:
             flash('No valid date entries found for export.', 'warning')
             return redirect(url_for('index'))
 
-        # Create PDF
-        pdf_filename = f'klinikum_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-        # Use temp directory that works on both Windows and Unix
-        import tempfile
-        pdf_path = os.path.join(tempfile.gettempdir(), pdf_filename)
-
-        doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-        story = []
-        styles = getSampleStyleSheet()
-
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#2c3e50'),
-            spaceAfter=30,
-            alignment=1  # Center
-        )
-
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            textColor=colors.HexColor('#37b24d'),
-            spaceAfter=12,
-            spaceBefore=12
-        )
-
-        # Title
-        story.append(Paragraph("Medical Recovery Report", title_style))
-        story.append(Paragraph(f"Generated: {datetime.now().strftime('%B %d, %Y at %H:%M')}", styles['Normal']))
-        story.append(Paragraph(f"Total Entries: {len(df)}", styles['Normal']))
-        story.append(Paragraph(f"Date Range: {df['date'].min().strftime('%Y-%m-%d')} to {df['date'].max().strftime('%Y-%m-%d')}", styles['Normal']))
-        story.append(Spacer(1, 0.5*inch))
-
-        # Note to Readers
-        note_style = ParagraphStyle(
-            'NoteStyle',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#333333'),
-            spaceAfter=8,
-            leftIndent=20,
-            rightIndent=20,
-            alignment=4  # Justify
-        )
-
-        note_title_style = ParagraphStyle(
-            'NoteTitleStyle',
-            parent=styles['Heading3'],
-            fontSize=12,
-            textColor=colors.HexColor('#000000'),
-            spaceAfter=10,
-            fontName='Helvetica-Bold'
-        )
-
-        story.append(Paragraph("Note to Readers", note_title_style))
-        story.append(Paragraph(
-            "This data is subjective and reflects how I felt. This report is a personal and analytical reflection on my time in the Klinikum. "
-            "It combines information drawn from memory, journals, WhatsApp conversations, and available medical data to trace the patterns of my mental state during recovery.",
-            note_style
-        ))
-        story.append(Paragraph(
-            "The intention behind this work is not to diagnose or justify, but to understand — to recognize how sleep, medication, thought patterns, and emotional changes interacted across days and weeks.",
-            note_style
-        ))
-        story.append(Paragraph(
-            "While I have taken care to ensure the accuracy of data and interpretation, this report remains deeply personal and subjective in nature. "
-            "Some parts were reconstructed retrospectively and may not perfectly represent medical reality, but they reflect my lived experience as faithfully as possible.",
-            note_style
-        ))
-        story.append(Paragraph(
-            "Readers are encouraged to approach this document with empathy and respect, keeping in mind that mental health is complex, non-linear, and often resistant to tidy explanations. "
-            "What follows is not just data — it's the story of a mind learning to make sense of itself.",
-            note_style
-        ))
-        story.append(Spacer(1, 0.3*inch))
-
-        # Summary Statistics
-        story.append(Paragraph("Summary Statistics", heading_style))
-
-        summary_data = [['Metric', 'Average', 'Min', 'Max']]
-        for field_name, field_config in fields.items():
-            if field_config['type'] == 'number' and field_name in df.columns:
-                col_data = pd.to_numeric(df[field_name], errors='coerce')
-                if not col_data.isna().all():
-                    summary_data.append([
-                        field_config['label'],
-                        f"{col_data.mean():.1f}",
-                        f"{col_data.min():.0f}",
-                        f"{col_data.max():.0f}"
-                    ])
-
-        summary_table = Table(summary_data)
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#37b24d')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(summary_table)
-        story.append(PageBreak())
-
-        # Generate and add graphs
-        story.append(Paragraph("Visualizations", heading_style))
-        story.append(Spacer(1, 0.2*inch))
-
-        # Calculate total_med_mg for graphs
-        df['total_med_mg'] = 0
-        for col in ['med1_mg', 'med2_mg', 'med3_mg', 'med4_mg']:
-            if col in df.columns:
-                df['total_med_mg'] += pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-        sns.set_theme(style="whitegrid",
-                      rc={"axes.facecolor":"#ffffff",
-                          "grid.color":"#cccccc",
-                          "axes.edgecolor":"#000000",
-                          "axes.linewidth":2,
-                          "grid.linewidth":0.5,
-                          "font.family":"monospace"})
-
-        # Graph 1: Mood/Panic/Headache
-        if all(col in df.columns for col in ['mood_score', 'panic_intensity', 'headache_intensity']):
-            fig, ax = plt.subplots(figsize=(7,4))
-            sns.lineplot(df, x='date', y='mood_score', label='Mood', color='#000', lw=2, marker='o', ax=ax)
-            sns.lineplot(df, x='date', y='panic_intensity', label='Panic', color='#000', lw=2, ls='--', marker='s', ax=ax)
-            sns.lineplot(df, x='date', y='headache_intensity', label='Headache', color='#666', lw=2, ls=':', marker='^', ax=ax)
-            ax.set_title('Core Symptoms', fontweight='bold')
-            ax.legend()
-            fig.tight_layout()
-
-            img_buffer = io.BytesIO()
-            fig.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
-            img_buffer.seek(0)
-            story.append(RLImage(img_buffer, width=6*inch, height=3.5*inch))
-            plt.close(fig)
-            story.append(Spacer(1, 0.2*inch))
-
-        # Graph 2: Sleep
-        if 'sleep_hours' in df.columns:
-            fig, ax = plt.subplots(figsize=(7,4))
-            sns.lineplot(df, x='date', y='sleep_hours', color='#000', lw=2, marker='o', ax=ax)
-            ax.axhline(y=7, color='#666', linestyle='--', linewidth=2, label='Recommended')
-            ax.set_title('Sleep Pattern', fontweight='bold')
-            ax.legend()
-            fig.tight_layout()
-
-            img_buffer = io.BytesIO()
-            fig.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
-            img_buffer.seek(0)
-            story.append(RLImage(img_buffer, width=6*inch, height=3.5*inch))
-            plt.close(fig)
-            story.append(PageBreak())
-
-        # Daily Notes
-        story.append(Paragraph("Daily Notes", heading_style))
-        story.append(Spacer(1, 0.1*inch))
-
-        for _, row in df.iterrows():
-            date_str = row['date'].strftime('%B %d, %Y')
-            note_text = str(row.get('notes', 'No notes'))
-
-            story.append(Paragraph(f"<b>{date_str}</b>", styles['Normal']))
-            story.append(Paragraph(note_text, styles['Normal']))
-            story.append(Spacer(1, 0.15*inch))
-
-        # Footer
-        story.append(PageBreak())
-        footer_style = ParagraphStyle(
-            'FooterStyle',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.HexColor('#666666'),
-            alignment=1  # Center
-        )
-        story.append(Spacer(1, 1*inch))
-        story.append(Paragraph("Generated with care and introspection", footer_style))
-        story.append(Paragraph(f"Data period: {df['date'].min().strftime('%B %Y')} - {df['date'].max().strftime('%B %Y')}", footer_style))
-        # Uncomment and modify the line below to add a link
-        # story.append(Paragraph('<link href="https://your-website.com">Additional Resources</link>', footer_style))
-
-        # Build PDF
-        doc.build(story)
-
-        return send_file(pdf_path, as_attachment=True, download_name=pdf_filename, mimetype='application/pdf')
+        # An unchanged journal maps to the same job, finished or still running
+        job_id = pdf_jobs.submit(df, fields, PLOT_RENDERER, note_fields, prepared.summary)
 
     except Exception as e:
-        plt.close('all')  # Clean up any figures
         flash(f'Error generating PDF: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
+    if wants_json():
+        return jsonify(job_id=job_id, status_url=url_for('export_status', job_id=job_id)), 202
+    return redirect(url_for('export_status', job_id=job_id), code=303)
+
+def wants_json():
+    """Whether the client asked for JSON rather than a page"""
+    return request.accept_mimetypes.best == 'application/json'
+
+@journal_route('/export-pdf/<job_id>')
+def export_status(job_id):
+    """Progress of a PDF export; the PDF itself once it is finished"""
+    status = pdf_jobs.status(job_id) if PDF_JOB_ID.fullmatch(job_id) else None
+    if status is None:
+        abort(404)
+
+    if wants_json():
+        if status['state'] == 'done':
+            status['download_url'] = url_for('export_status', job_id=job_id)
+        return jsonify(status)
+
+    if status['state'] == 'done':
+        finished = datetime.fromtimestamp(status['finished'])
+        pdf_jobs.touch(job_id)
+        try:
+            # Sent straight from the file in blocks, with Range support
+            return send_file(pdf_jobs.pdf_path(job_id), as_attachment=True, mimetype='application/pdf',
+                             download_name=f'klinikum_report_{finished.strftime("%Y%m%d_%H%M%S")}.pdf')
+        except FileNotFoundError:
+            status.update(state='failed', error='The report has expired. Please export it again.')
+    if status['state'] == 'failed':
+        flash(f'Error generating PDF: {status.get("error", "unknown error")}', 'danger')
+        return redirect(url_for('index'))
+    return render_template('export.html', job_id=job_id, status=status)
+
+def api_error(message, status=400):
+    """Stop the request with a JSON error"""
+    abort(make_response(jsonify(error=message), status))
+
+def api_selection():
+    """Entries picked by the query string (from, to, f_<field>, cols), configured fields only"""
+    fields = load_fields_config()
+    filters, invalid = entry_query.parse_filters(fields, request.args)
+    if invalid:
+        api_error(f'Filters that are not numbers or ranges: {", ".join(invalid)}')
+    df = load_data()
+    if not df.empty:
+        df = entry_query.filter_entries(df, fields, request.args.get('from', ''), request.args.get('to', ''), filters)
+    return df.reindex(columns=list(entry_query.project_fields(fields, request.args.getlist('cols'))))
+
+@journal_route('/data-health')
+def data_health():
+    """Check every stored entry against the field configuration"""
+    fields = load_fields_config()
+    report = validation.validator(fields).audit(store.raw_data())
+    if wants_json():
+        return jsonify(report)
+    return render_template('health.html', report=report, fields=fields, version=store.version())
+
+@journal_route('/search')
+def search_entries():
+    """Entries whose free-text fields match ?q=, newest first, with highlighted snippets"""
+    version = store.version()
+    fields = load_fields_config()
+    query = request.args.get('q', '').strip()
+    start, end = request.args.get('from', ''), request.args.get('to', '')
+    order = request.args.get('order', search.ORDERS[0])
+    if order not in search.ORDERS:
+        order = search.ORDERS[0]
+
+    hits, page, pages, total = [], 1, 1, 0
+    if query:
+        if not search.FTS5:
+            flash('Search needs SQLite with the FTS5 extension, which this Python was built without.', 'danger')
+        else:
+            search_index.sync(store, fields)
+            hits, page, pages, total = search_index.search(query, start, end, order,
+                                                           request.args.get('page', 1, type=int))
+    if wants_json():
+        return jsonify(query=query, matches=total, page=page, pages=pages, version=version,
+                       hits=[dict(hit, snippets=[{'field': field_name, 'html': str(snippet)}
+                                                 for field_name, snippet in hit['snippets']]) for hit in hits])
+
+    # Links to other pages keep the query, dates and order
+    args = request.args.to_dict()
+    args.pop('page', None)
+    return render_template('search.html', query=query, start=start, end=end, order=order, orders=search.ORDERS,
+                           total=total, hits=hits, page=page, pages=pages, args=args, fields=fields,
+                           version=version)
+
+@journal_route('/api/entries')
+def api_entries():
+    """One page of entries as JSON, filtered like the listing"""
+    version = store.version()
+    df = api_selection()
+    per_page = min(max(request.args.get('per_page', API_DEFAULT_PER_PAGE, type=int), 1), API_MAX_PER_PAGE)
+    rows, page, pages = entry_query.paginate(df, request.args.get('page', 1, type=int), per_page)
+    entries = entry_query.display_records(storage_frame(rows), list(rows.columns))
+    return jsonify(entries=entries, page=page, pages=pages, per_page=per_page, matches=len(df), version=version)
+
+@journal_route('/api/entries/bulk', methods=['POST'])
+def api_bulk_import():
+    """Add entries from a JSON array or an NDJSON stream, one write per batch
+
+    Entries failing validation are skipped and reported; the others are
+    stored.
+    """
+    fields = load_fields_config()
+    if request.mimetype in NDJSON_MIMETYPES:
+        batches = bulk.ndjson_batches(line.decode('utf-8', errors='replace') for line in request.stream)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            api_error('Expected a JSON array of entries, or NDJSON sent as application/x-ndjson')
+        batches = bulk.json_batches(items)
+
+    validator = validation.validator(fields)
+    added, rejected, errors = 0, 0, []
+    for batch, batch_errors in batches:
+        rows, invalid = validator.validate(batch)
+        store.add_entries(rows)
+        added += len(rows)
+        batch_errors = sorted(batch_errors + invalid, key=lambda error: error['row'])
+        rejected += len({error['row'] for error in batch_errors})
+        errors.extend(batch_errors[:API_MAX_ERRORS - len(errors)])
+    return jsonify(added=added, rejected=rejected, errors=errors, version=store.version())
+
+@journal_route('/api/entries.<any(ndjson, csv):fmt>')
+def api_export(fmt):
+    """Stream the selected entries as NDJSON or CSV"""
+    df = api_selection()
+    if fmt == 'ndjson':
+        return Response(bulk.ndjson_lines(df), mimetype='application/x-ndjson')
+    return Response(bulk.csv_lines(df), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=klinikum_entries.csv'})
+
+def journal_option(command):
+    """Add --journal NAME to a command, running it against that named journal"""
+    @click.option('--journal', 'journal_name', help=f'a journal in {JOURNALS_DIR} rather than the default one')
+    @functools.wraps(command)
+    def run(journal_name=None, **kwargs):
+        if journal_name is not None:
+            journal = journal_registry.get(journal_name)
+            if journal is None:
+                raise click.ClickException(f'There is no journal named "{journal_name}" in {JOURNALS_DIR}.')
+            g.journal = journal
+        return command(**kwargs)
+    return run
+
+@app.cli.command('create-journal')
+@click.argument('name')
+def create_journal(name):
+    """Start a named journal in JOURNALS_DIR with the default fields"""
+    try:
+        journal_registry.create(name).store.save_fields(DEFAULT_FIELDS)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f'Created journal {name} in {journal_registry.directory(name)}; it is served under /j/{name}/.')
+
+@app.cli.command('migrate-schema')
+@journal_option
+def migrate_schema():
+    """Carry pending field changes over to the stored journal now"""
+    applied = compactor.run()
+    pending = schema_log.pending()
+    print(f'Applied {applied} field changes; schema version {schema_log.version()}.')
+    if pending:
+        print(f'{len(pending)} changes are still pending (another process may be applying them).')
+
+@app.cli.command('migrate-to-sqlite')
+@journal_option
+def migrate_to_sqlite():
+    """Copy every entry from CSV_FILE into SQLITE_FILE"""
+    directory = current_journal().directory
+    csv_file, sqlite_file = journal_file(CSV_FILE, directory), journal_file(SQLITE_FILE, directory)
+    df = CSVBackend(csv_file).read()
+    if df is None:
+        print(f'{csv_file} has no entries to migrate.')
+        return
+    SQLiteBackend(sqlite_file).write(df)
+    print(f'Migrated {len(df)} entries from {csv_file} to {sqlite_file}.')
+    print('Set STORAGE_BACKEND=sqlite to use the database.')
+
+@app.cli.command('import-csv')
+@click.argument('csv_file', required=False)
+@journal_option
+def import_csv(csv_file):
+    """Replace the journal in STORAGE_BACKEND with the entries of a CSV file (the journal's CSV_FILE by default)"""
+    own_csv = journal_file(CSV_FILE, current_journal().directory)
+    csv_file = csv_file or own_csv
+    if STORAGE_BACKEND == 'csv' and os.path.abspath(csv_file) == os.path.abspath(own_csv):
+        print('STORAGE_BACKEND is csv: the CSV file is the journal already.')
+        return
+    df = CSVBackend(csv_file).read()
+    if df is None:
+        print(f'{csv_file} has no entries to import.')
+        return
+    store.save_data(df)
+    print(f'Imported {len(df)} entries from {csv_file} into the {STORAGE_BACKEND} journal.')
+    print_health(validation.validator(load_fields_config()).audit(df))
+
+def print_health(report):
+    """Summarise a data health report on the console"""
+    print(f'{report["invalid"]} of {report["entries"]} entries fail a field check.')
+    for problem in report['problems']:
+        print(f'  {problem["message"]}: {problem["count"]} entries, e.g. {problem["rows"][:5]}')
+    if report['unknown_columns']:
+        print(f'  Columns no field uses: {", ".join(report["unknown_columns"])}')
+
+@app.cli.command('check-data')
+@journal_option
+def check_data():
+    """Check every stored entry against fields_config.json"""
+    print_health(validation.validator(load_fields_config()).audit(store.raw_data()))
+
+@app.cli.command('export-csv')
+@click.argument('csv_file')
+@journal_option
+def export_csv(csv_file):
+    """Write the journal in STORAGE_BACKEND out to a CSV file"""
+    df = load_data()
+    if df.empty:
+        print('The journal has no entries to export.')
+        return
+    CSVBackend(csv_file).write(df.reset_index(drop=True))
+    print(f'Exported {len(df)} entries to {csv_file}.')
+
 if __name__ == '__main__':
     # Initialize fields config if it doesn't exist
     if not os.path.exists(FIELDS_CONFIG_FILE):
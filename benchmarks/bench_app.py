@@ -0,0 +1,219 @@
+"""Time the app's main pages on synthetic journals, as JSON to compare across commits
+
+    python -m benchmarks.bench_app
+    python -m benchmarks.bench_app --sizes 30d 1y --repeat 10 --out before.json
+    python -m benchmarks.bench_app --compare before.json after.json
+
+For every size in benchmarks.journal.SIZES (30 days, a year, ten years and
+a year from each of many users in one journal) writes a generated journal
+for the fields in --fields (DEFAULT_FIELDS unless given) to a scratch
+directory and drives the app through Flask's test client, --repeat times:
+
+    load_data   cold DataStore load of every column
+    index       GET /
+    add         POST /add
+    edit        POST /edit/<id> of the added entry
+    delete      GET /delete/<id> of it again, leaving the journal as it was
+    graphs      GET /graphs and every graph image, from an empty plot cache
+    export_pdf  POST /export-pdf until the report is downloaded, nothing reused
+
+Each size runs in its own process with the configured STORAGE_BACKEND and
+other settings. The JSON report gives the p50/p90/p99/mean/max latency of
+every operation in ms, the peak RSS of the app process and of its largest
+PDF or plot worker, and the size of what was sent.
+"""
+import argparse
+import json
+import multiprocessing.forkserver
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.journal import SIZES, sized_journal  # noqa: E402
+
+OPERATIONS = ('load_data', 'index', 'add', 'edit', 'delete', 'graphs', 'export_pdf')
+PDF_TIMEOUT = 600
+
+
+def percentiles(timings):
+    ms = np.array(timings) * 1000
+    return {'n': len(ms), 'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)),
+            'p99': float(np.percentile(ms, 99)), 'mean': float(ms.mean()), 'max': float(ms.max())}
+
+
+def timed(timings, operation, request):
+    start = time.perf_counter()
+    response = request()
+    timings[operation].append(time.perf_counter() - start)
+    return response
+
+
+def check(response, *statuses):
+    if response.status_code not in (statuses or (200,)):
+        raise RuntimeError(f'{response.request.path}: HTTP {response.status_code}')
+    return response
+
+
+def export_pdf(client):
+    """Start an export, wait for it and download the PDF; returns its bytes"""
+    headers = {'Accept': 'application/json'}
+    status_url = check(client.post('/export-pdf', headers=headers), 202).get_json()['status_url']
+    deadline = time.monotonic() + PDF_TIMEOUT
+    while True:
+        status = check(client.get(status_url, headers=headers)).get_json()
+        if status['state'] == 'done':
+            return check(client.get(status_url)).data
+        if status['state'] == 'failed':
+            raise RuntimeError(f'PDF export failed: {status.get("error")}')
+        if time.monotonic() > deadline:
+            raise RuntimeError('PDF export timed out')
+        time.sleep(0.05)
+
+
+def run_size(size, repeat, fields_file):
+    """Benchmark one size in this process (run from a scratch directory); returns its report"""
+    import app
+    import plots
+    from plot_cache import PlotCache
+
+    fields = app.DEFAULT_FIELDS
+    if fields_file:
+        with open(fields_file, encoding='utf-8') as f:
+            fields = json.load(f)
+    app.save_fields_config(fields)
+    df = sized_journal(size, fields)
+    df.to_csv(app.CSV_FILE, index=False)
+    if app.STORAGE_BACKEND != 'csv':
+        app.app.test_cli_runner().invoke(args=['import-csv'])
+    new_entry = sized_journal('30d', fields, seed=1).iloc[-1].to_dict()
+
+    client = app.app.test_client()
+    timings = {operation: [] for operation in OPERATIONS}
+    sizes = {}
+    for _ in range(repeat):
+        app.store.invalidate()
+        timed(timings, 'load_data', app.load_data)
+
+        sizes['index_bytes'] = len(check(timed(timings, 'index', lambda: client.get('/'))).data)
+
+        check(timed(timings, 'add', lambda: client.post('/add', data=new_entry)), 302)
+        entry_id = int(app.load_data().index[-1])
+        version = app.store.version()
+        check(timed(timings, 'edit', lambda: client.post(f'/edit/{entry_id}?version={version}',
+                                                          data=dict(new_entry, version=version))), 302)
+        version = app.store.version()
+        check(timed(timings, 'delete', lambda: client.get(f'/delete/{entry_id}?version={version}')), 302)
+
+        app.plot_renderer.cache = PlotCache(app.PLOT_CACHE_SIZE)
+
+        def graphs():
+            page = check(client.get('/graphs')).get_data(as_text=True)
+            images = [check(client.get(f'/graphs/{spec.plot_id}.png')).data
+                      for spec in plots.PLOTS if f'/graphs/{spec.plot_id}.png' in page]
+            return images
+        images = timed(timings, 'graphs', graphs)
+        sizes['graph_count'] = len(images)
+        sizes['graph_bytes'] = sum(len(image) for image in images)
+
+        shutil.rmtree(app.PDF_EXPORT_DIR)
+        os.makedirs(app.PDF_EXPORT_DIR)
+        sizes['pdf_bytes'] = len(timed(timings, 'export_pdf', lambda: export_pdf(client)))
+
+    app.pdf_jobs.shutdown()
+    app.plot_renderer.shutdown()
+    if hasattr(multiprocessing.forkserver, '_forkserver'):
+        # The pool workers are the forkserver's children: stop it so their
+        # peak shows in RUSAGE_CHILDREN
+        multiprocessing.forkserver._forkserver._stop()
+    backend = app.store.backend
+    sizes['journal_bytes'] = os.path.getsize(backend.db_file if app.STORAGE_BACKEND == 'sqlite' else backend.path)
+    return {'entries': len(df), 'days': SIZES[size][0], 'users': SIZES[size][1],
+            'operations': {operation: percentiles(timings[operation]) for operation in OPERATIONS},
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_worker_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            'output': sizes}
+
+
+def measure(size, repeat, fields_file):
+    """Run one size in a fresh process; returns its report"""
+    work_dir = tempfile.mkdtemp(prefix='klinikum_bench_')
+    env = dict(os.environ, PDF_EXPORT_DIR=os.path.join(work_dir, 'exports'),
+               PLOT_CACHE_DIR='', PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    command = [sys.executable, '-m', 'benchmarks.bench_app', '--run', size, '--repeat', str(repeat)]
+    if fields_file:
+        command += ['--fields', os.path.abspath(fields_file)]
+    try:
+        return json.loads(subprocess.run(command, cwd=work_dir, env=env, stdout=subprocess.PIPE,
+                                         check=True).stdout)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_file, after_file):
+    """Print the p50 of every operation in two reports side by side"""
+    with open(before_file, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_file, encoding='utf-8') as f:
+        after = json.load(f)
+    print(f'p50 ms: {before_file} ({before.get("commit")}) -> {after_file} ({after.get("commit")})')
+    for size, report in after['sizes'].items():
+        if size not in before['sizes']:
+            continue
+        print(f'\n{size} ({report["entries"]} entries)')
+        for operation, stats in report['operations'].items():
+            old = before['sizes'][size]['operations'].get(operation)
+            if old:
+                print(f'  {operation:<12}{old["p50"]:>10.1f}{stats["p50"]:>10.1f}{stats["p50"] / old["p50"]:>8.2f}x')
+        old_rss, new_rss = before['sizes'][size]['peak_rss_mb'], report['peak_rss_mb']
+        print(f'  {"peak RSS MB":<12}{old_rss:>10.0f}{new_rss:>10.0f}{new_rss / old_rss:>8.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fields', help='field configuration to generate the journals for (JSON)')
+    parser.add_argument('--out', help='write the report here instead of printing it')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two reports')
+    parser.add_argument('--run', choices=list(SIZES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.run:
+        json.dump(run_size(args.run, args.repeat, args.fields), sys.stdout)
+        return
+
+    report = {'commit': commit(), 'python': platform.python_version(), 'created': time.time(),
+              'storage_backend': os.environ.get('STORAGE_BACKEND', 'csv'), 'repeat': args.repeat, 'sizes': {}}
+    for size in args.sizes:
+        print(f'{size}...', file=sys.stderr)
+        report['sizes'][size] = measure(size, args.repeat, args.fields)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
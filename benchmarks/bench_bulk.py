@@ -0,0 +1,81 @@
+"""Time a backfill entry by entry against one validated batch
+
+    python -m benchmarks.bench_bulk
+    python -m benchmarks.bench_bulk --journal 10000 --entries 1000
+
+For every backend, starts from a journal of --journal entries and adds
+--entries more: once through add_entry() one at a time, as the form does,
+and once through validation.validate() and a single add_entries(), as
+POST /api/entries/bulk does.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datastore  # noqa: E402
+import validation  # noqa: E402
+from app import DEFAULT_FIELDS  # noqa: E402
+from benchmarks.journal import entries_journal  # noqa: E402
+
+
+def make_store(work_dir, backend_name, df, fields):
+    fields_file = os.path.join(work_dir, 'fields_config.json')
+    with open(fields_file, 'w', encoding='utf-8') as f:
+        json.dump(fields, f)
+    path = os.path.join(work_dir, f'journal.{backend_name}')
+    for leftover in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    if backend_name == 'csv':
+        backend = datastore.CSVBackend(path)
+    elif backend_name == 'sqlite':
+        backend = datastore.SQLiteBackend(path)
+    else:
+        backend = datastore.ColumnarBackend(path, backend_name)
+    backend.write(df.copy())
+    return datastore.DataStore(backend, fields_file, fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--journal', type=int, default=10000)
+    parser.add_argument('--entries', type=int, default=500)
+    args = parser.parse_args()
+
+    backends = ['csv', 'sqlite'] + (list(datastore.ColumnarBackend.formats) if datastore.pyarrow is not None else [])
+    fields = DEFAULT_FIELDS
+    df = entries_journal(args.journal, fields)
+    new = entries_journal(args.entries, fields, seed=1)
+
+    work_dir = tempfile.mkdtemp(prefix='klinikum_bulk_')
+    try:
+        print(f'{args.entries} entries added to a journal of {args.journal}')
+        print(f'{"backend":<9}{"one by one":>12}{"one batch":>12}')
+        for backend_name in backends:
+            store = make_store(work_dir, backend_name, df, fields)
+            store.load_data()
+            start = time.perf_counter()
+            for entry in new.to_dict('records'):
+                store.add_entry(entry)
+            single = time.perf_counter() - start
+
+            store = make_store(work_dir, backend_name, df, fields)
+            store.load_data()
+            start = time.perf_counter()
+            rows, errors = validation.validate(new, fields)
+            store.add_entries(rows)
+            batch = time.perf_counter() - start
+            assert not errors and len(store.load_data()) == args.journal + args.entries
+            print(f'{backend_name:<9}{single * 1000:>10.0f}ms{batch * 1000:>10.0f}ms')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
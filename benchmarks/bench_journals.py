@@ -0,0 +1,115 @@
+"""Serve many journals from one process: latency and memory for each LRU size
+
+    python -m benchmarks.bench_journals
+    python -m benchmarks.bench_journals --journals 500 --size 30d --cache-sizes 8 32 128
+
+Creates --journals generated journals of --size (see benchmarks.journal.SIZES)
+in a scratch JOURNALS_DIR with the configured STORAGE_BACKEND. Then, for
+each JOURNAL_CACHE_SIZE in --cache-sizes, a fresh process requests the
+entry table of --requests journals picked at random, a few popular
+journals getting most of the traffic. It reports the p50/p99 of requests
+that found their journal loaded and of those that had to open it, the
+evictions and the peak RSS. For comparison it gives the RSS of a process
+serving a single journal, which is what each journal used to cost.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.journal import SIZES, sized_journal  # noqa: E402
+
+
+def setup(count, size):
+    """Create count journals in JOURNALS_DIR (run in the scratch directory)"""
+    import app
+    for i in range(count):
+        journal = app.journal_registry.create(f'j{i:04d}')
+        journal.store.save_fields(app.DEFAULT_FIELDS)
+        journal.store.save_data(sized_journal(size, app.DEFAULT_FIELDS, seed=i))
+
+
+def serve(count, requests, seed):
+    """Request random journals' entry tables; returns the report of this process"""
+    import app
+    client = app.app.test_client()
+    popularity = 1 / np.arange(1, count + 1)
+    picks = np.random.default_rng(seed).choice(count, requests, p=popularity / popularity.sum())
+    timings = {'loaded': [], 'opened': []}
+    for pick in picks:
+        name = f'j{pick:04d}'
+        state = 'loaded' if name in app.journal_registry.stats()['open'] else 'opened'
+        start = time.perf_counter()
+        response = client.get(f'/j/{name}/')
+        response.get_data()
+        timings[state].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'/j/{name}/: HTTP {response.status_code}')
+    stats = app.journal_registry.stats()
+    report = {'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+              'evicted': stats['evicted'], 'max_open': stats['max_open']}
+    for state, values in timings.items():
+        ms = np.array(values) * 1000
+        report[state] = {'n': len(ms), 'p50': float(np.percentile(ms, 50)) if len(ms) else None,
+                         'p99': float(np.percentile(ms, 99)) if len(ms) else None}
+    return report
+
+
+def child(work_dir, cache_size, *args):
+    env = dict(os.environ, JOURNALS_DIR=os.path.join(work_dir, 'journals'), JOURNAL_CACHE_SIZE=str(cache_size),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_journals', *args], cwd=work_dir, env=env,
+                            stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout or 'null')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--journals', type=int, default=200)
+    parser.add_argument('--size', choices=list(SIZES), default='1y')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--cache-sizes', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--setup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.setup:
+        return setup(args.journals, args.size)
+    if args.serve:
+        json.dump(serve(args.journals, args.requests, args.seed), sys.stdout)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='klinikum_journals_')
+    try:
+        print(f'Creating {args.journals} journals of {args.size}...', file=sys.stderr)
+        child(work_dir, 8, '--setup', '--journals', str(args.journals), '--size', args.size)
+        single = child(work_dir, 1, '--serve', '--journals', '1', '--requests', '50')
+        print(f'{args.journals} journals of {args.size}, {args.requests} requests of GET /j/<journal>/')
+        print(f'One process per journal: {single["peak_rss_mb"]:.0f} MB each, '
+              f'{single["peak_rss_mb"] * args.journals / 1024:.1f} GB for all of them')
+        print(f'{"cache":>6}{"loaded p50":>12}{"p99":>8}{"opened p50":>12}{"p99":>8}{"opened":>8}{"evicted":>9}'
+              f'{"peak RSS":>10}')
+        for cache_size in args.cache_sizes:
+            report = child(work_dir, cache_size, '--serve', '--journals', str(args.journals),
+                           '--requests', str(args.requests), '--seed', str(args.seed))
+            loaded, opened = report['loaded'], report['opened']
+            print(f'{cache_size:>6}{loaded["p50"] or 0:>10.1f}ms{loaded["p99"] or 0:>6.1f}ms'
+                  f'{opened["p50"] or 0:>10.1f}ms{opened["p99"] or 0:>6.1f}ms{opened["n"]:>8}{report["evicted"]:>9}'
+                  f'{report["peak_rss_mb"]:>8.0f}MB')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
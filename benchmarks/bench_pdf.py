@@ -0,0 +1,44 @@
+"""Time building the PDF report for journals of growing length
+
+    python -m benchmarks.bench_pdf
+    python -m benchmarks.bench_pdf --days 1000 10000 --include notes thoughts remarks
+
+Builds the report into memory for every --days journal generated by
+benchmarks.journal (free text with markup characters included), and prints
+the best of --repeat runs together with the time per entry, which should
+stay flat as the journal grows.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_report  # noqa: E402
+from benchmarks.bench_renderers import prepared_journal  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--include', nargs='+', default=['notes'], help='note fields in the Daily Notes')
+    args = parser.parse_args()
+
+    print(f'{"entries":>8}{"build":>10}{"per entry":>12}{"size":>10}')
+    for days in args.days:
+        df, fields = prepared_journal(days)
+        best = None
+        for _ in range(args.repeat):
+            out = io.BytesIO()
+            start = time.perf_counter()
+            pdf_report.build_report(df, fields, out, 'fast', note_fields=args.include)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f'{days:>8}{best:>9.2f}s{best / days * 1000:>10.2f}ms{len(out.getvalue()) / 1024:>8.0f}KB')
+
+
+if __name__ == '__main__':
+    main()
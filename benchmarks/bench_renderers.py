@@ -0,0 +1,74 @@
+"""Compare the seaborn and fast plot renderers on journals of growing length
+
+    python -m benchmarks.bench_renderers
+    python -m benchmarks.bench_renderers --days 30 365 3650 --repeat 3 --out /tmp/plots
+
+Times every plot in the graphs catalogue (draw + PNG encode) for each
+renderer and prints the best of --repeat runs per journal length. With
+--out the images of both renderers are written side by side for a visual
+check.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+import plots  # noqa: E402
+import running_stats  # noqa: E402
+from app import DEFAULT_FIELDS  # noqa: E402
+from benchmarks.journal import generate_journal  # noqa: E402
+
+# The default fields and the one other column the catalogue plots
+FIELDS = dict(DEFAULT_FIELDS, die_thoughts={'label': 'Death Thoughts', 'type': 'number', 'required': False,
+                                            'min': 0, 'max': 10})
+
+
+def prepared_journal(days, seed=0):
+    """One entry per day with every column the catalogue knows about, prepared for plotting"""
+    return analytics.prepare(generate_journal(days, FIELDS, seed=seed), FIELDS), FIELDS
+
+
+def time_renderer(df, fields, renderer, repeat, out_dir=None):
+    timings = {}
+    frames = plots.plot_frames(df, running_stats.JournalStats(df), bucket='none')
+    for spec, frame, _ in plots.available_plots(frames, fields):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = plots.render_plot(spec, frame, fields, renderer=renderer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[spec.plot_id] = best
+        if out_dir:
+            with open(os.path.join(out_dir, f'{len(df)}_{spec.plot_id}_{renderer}.png'), 'wb') as f:
+                f.write(data)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 365, 3650])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', help='directory to write the rendered images to')
+    args = parser.parse_args()
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    for days in args.days:
+        df, fields = prepared_journal(days)
+        results = {renderer: time_renderer(df, fields, renderer, args.repeat, args.out)
+                   for renderer in plots.RENDERERS}
+        print(f'\n{days} days')
+        print(f'{"plot":<26}{"seaborn":>10}{"fast":>10}{"speedup":>10}')
+        for plot_id in results['seaborn']:
+            slow, fast = results['seaborn'][plot_id], results['fast'][plot_id]
+            print(f'{plot_id:<26}{slow:>9.3f}s{fast:>9.3f}s{slow / fast:>9.1f}x')
+        slow, fast = sum(results['seaborn'].values()), sum(results['fast'].values())
+        print(f'{"total":<26}{slow:>9.3f}s{fast:>9.3f}s{slow / fast:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Time full-text search against a scan of every note
+
+    python -m benchmarks.bench_search
+    python -m benchmarks.bench_search --sizes 10y --repeat 20
+
+For every size in benchmarks.journal.SIZES, stores a generated journal as
+CSV and times building the search index, keeping it current across an
+added, an edited and a deleted entry, and a page of hits for each of
+QUERIES, next to a case-insensitive scan of the text columns for the same
+first word (what finding anything took before).
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from app import DEFAULT_FIELDS  # noqa: E402
+from benchmarks.bench_bulk import make_store  # noqa: E402
+from benchmarks.journal import SIZES, sized_journal  # noqa: E402
+
+QUERIES = ('headache', '"walked outside"', 'hope*', 'tired -nurse', 'nosuchword')
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def scan(df, columns, word):
+    return df[columns].apply(lambda column: column.str.contains(word, case=False, regex=False)).any(axis=1).sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    if not search.FTS5:
+        sys.exit('This Python\'s sqlite3 was built without FTS5')
+
+    fields = DEFAULT_FIELDS
+    columns = list(search.text_fields(fields))
+    work_dir = tempfile.mkdtemp(prefix='klinikum_search_')
+    try:
+        for size in args.sizes:
+            df = sized_journal(size, fields)
+            store = make_store(work_dir, 'csv', df, fields)
+            loaded = store.load_data()
+            build = median_ms(lambda: search.SearchIndex().sync(store, fields), args.repeat)
+
+            index = search.SearchIndex()
+            index.sync(store, fields)
+            entry = sized_journal('30d', fields, seed=1).iloc[-1].to_dict()
+            start = time.perf_counter()
+            store.add_entry(entry)
+            index.sync(store, fields)
+            store.update_entry(len(df), dict(entry, notes='edited'))
+            index.sync(store, fields)
+            store.delete_entry(len(df))
+            index.sync(store, fields)
+            update = (time.perf_counter() - start) * 1000
+
+            print(f'\n{size}: {len(df)} entries, index built in {build:.0f}ms, '
+                  f'add + edit + delete kept in {update:.0f}ms (storage writes included)')
+            print(f'{"query":<20}{"matches":>9}{"search":>10}{"scan":>10}')
+            for query in QUERIES:
+                matches = index.search(query)[3]
+                searched = median_ms(lambda: index.search(query), args.repeat)
+                word = query.split()[0].strip('"*')
+                scanned = median_ms(lambda: scan(loaded, columns, word), args.repeat)
+                print(f'{query:<20}{matches:>9}{searched:>8.1f}ms{scanned:>8.1f}ms')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
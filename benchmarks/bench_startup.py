@@ -0,0 +1,148 @@
+"""Startup cost of the app: import time and memory per gunicorn-style worker
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --workers 4 --repeat 5
+
+Reports `python -X importtime -c "import app"` totals (the slowest modules
+included), with matplotlib, seaborn and reportlab loaded up front
+(PRELOAD_MODULES=1, as every worker did before they were made lazy) and
+on first use. Then forks --workers workers the way gunicorn does and
+prints each one's RSS and PSS (its share of pages held with the others)
+after startup and after drawing its first graph:
+
+    eager    every worker imports the app with the plotting and PDF modules
+    lazy     every worker imports the app; plotting loads on the first graph
+    preload  the master imports everything (gunicorn --preload with
+             PRELOAD_MODULES=1) and the workers share it copy-on-write
+
+Linux only for the memory figures (/proc).
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('pandas', 'matplotlib.pyplot', 'seaborn', 'reportlab.platypus')
+MODES = ('eager', 'lazy', 'preload')
+
+
+def import_times(preload):
+    """Cumulative import time in ms of app and HEAVY_MODULES for one fresh interpreter"""
+    env = dict(os.environ, PRELOAD_MODULES='1' if preload else '0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        if name == 'app' or name in HEAVY_MODULES:
+            times[name] = int(cumulative) / 1000
+    return times
+
+
+def memory():
+    """(RSS, PSS) of this process in MB"""
+    sizes = {}
+    for path in ('/proc/self/status', '/proc/self/smaps_rollup'):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('VmRSS', 'Pss'):
+                        sizes[key] = int(value.split()[0]) / 1024
+        except FileNotFoundError:
+            pass
+    return sizes.get('VmRSS'), sizes.get('Pss')
+
+
+def first_graph():
+    import pandas as pd
+
+    import plots
+    df = pd.DataFrame({'date': pd.date_range('2024-01-01', periods=30), 'sleep_hours': [7.0] * 30})
+    plots.render_plot(plots.PLOTS_BY_ID['sleep'], df, {})
+
+
+def worker(mode, ready, go, results):
+    if mode != 'preload':
+        importlib.import_module('app')
+    started = memory()
+    os.write(ready, b'.')
+    os.read(go, 1)  # the PSS figures count every worker, so measure once all are up
+    shared = memory()
+    first_graph()
+    drawn = memory()
+    os.write(results, (json.dumps({'rss': started[0], 'pss': shared[1], 'rss_graph': drawn[0],
+                                   'pss_graph': drawn[1]}) + '\n').encode())
+
+
+def run_workers(mode, workers):
+    """Fork workers as gunicorn does; prints one JSON line per worker"""
+    if mode == 'preload':
+        importlib.import_module('app')
+    ready_r, ready_w = os.pipe()
+    go_r, go_w = os.pipe()
+    results_r, results_w = os.pipe()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker(mode, ready_w, go_r, results_w)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    for _ in range(workers):
+        os.read(ready_r, 1)
+    os.write(go_w, b'.' * workers)
+    for pid in children:
+        os.waitpid(pid, 0)
+    os.close(results_w)
+    with os.fdopen(results_r) as f:
+        sys.stdout.write(f.read())
+
+
+def worker_memory(mode, workers):
+    env = dict(os.environ, PRELOAD_MODULES='0' if mode == 'lazy' else '1', MPLBACKEND='Agg')
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--fork', mode,
+                             '--workers', str(workers)], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return [json.loads(line) for line in result.stdout.splitlines()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--fork', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.fork:
+        return run_workers(args.fork, args.workers)
+
+    print(f'import app, median of {args.repeat} runs (ms, cumulative)')
+    print(f'{"":<9}{"app":>8}' + ''.join(f'{name.split(".")[0]:>12}' for name in HEAVY_MODULES))
+    for label, preload in (('eager', True), ('lazy', False)):
+        runs = [import_times(preload) for _ in range(args.repeat)]
+        row = [statistics.median(run.get(name, 0) for run in runs) for name in ('app',) + HEAVY_MODULES]
+        print(f'{label:<9}' + ''.join(f'{value:>8.0f}' if i == 0 else f'{value:>12.0f}'
+                                     for i, value in enumerate(row)))
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print('\nPer-worker memory needs /proc/self/smaps_rollup (Linux)')
+        return
+    print(f'\n{args.workers} workers, mean MB per worker')
+    print(f'{"":<9}{"RSS":>8}{"PSS":>8}{"RSS+graph":>12}{"PSS+graph":>12}')
+    for mode in MODES:
+        stats = worker_memory(mode, args.workers)
+        means = [statistics.mean(worker[key] for worker in stats) for key in ('rss', 'pss', 'rss_graph', 'pss_graph')]
+        print(f'{mode:<9}{means[0]:>8.0f}{means[1]:>8.0f}{means[2]:>12.0f}{means[3]:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare loading the journal from CSV, Parquet and Feather
+
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --rows 10000 100000 --repeat 5
+
+Writes the same generated journal of the default fields (see
+benchmarks.journal) in every format, then times a cold DataStore load of all columns and of
+the date and number columns the graphs read, best of --repeat runs.
+Parquet and Feather are skipped when pyarrow is not installed.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datastore  # noqa: E402
+from app import DEFAULT_FIELDS  # noqa: E402
+from benchmarks.journal import entries_journal  # noqa: E402
+
+
+def best_load(store, columns, repeat):
+    best = None
+    for _ in range(repeat):
+        store.invalidate()
+        start = time.perf_counter()
+        store.load_data(columns)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    formats = ['csv'] + (list(datastore.ColumnarBackend.formats) if datastore.pyarrow is not None else [])
+    if datastore.pyarrow is None:
+        print('pyarrow is not installed: timing CSV only')
+
+    work_dir = tempfile.mkdtemp(prefix='klinikum_storage_')
+    try:
+        print(f'{"rows":>8} {"format":<8}{"size":>10}{"all columns":>14}{"graph columns":>16}')
+        for rows in args.rows:
+            fields = DEFAULT_FIELDS
+            df = entries_journal(rows, fields)
+            fields_file = os.path.join(work_dir, 'fields_config.json')
+            with open(fields_file, 'w', encoding='utf-8') as f:
+                json.dump(fields, f)
+            graph_columns = [name for name, config in fields.items() if config['type'] in ('date', 'number')]
+
+            for file_format in formats:
+                path = os.path.join(work_dir, f'journal_{rows}.{file_format}')
+                if file_format == 'csv':
+                    backend = datastore.CSVBackend(path)
+                else:
+                    backend = datastore.ColumnarBackend(path, file_format)
+                backend.write(df.copy())
+                store = datastore.DataStore(backend, fields_file, fields)
+                full = best_load(store, None, args.repeat)
+                projected = best_load(store, graph_columns, args.repeat)
+                size = os.path.getsize(path) / 1024 / 1024
+                print(f'{rows:>8} {file_format:<8}{size:>8.1f}MB{full * 1000:>12.0f}ms{projected * 1000:>14.0f}ms')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
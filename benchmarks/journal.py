@@ -0,0 +1,106 @@
+"""Synthetic journals shaped by a field configuration
+
+    from benchmarks.journal import generate_journal, SIZES
+    df = generate_journal(365, fields)
+    df = entries_journal(100000, fields)
+
+Every configured field gets plausible values for its type: scores wander
+between the field's min and max from one day to the next, sleep centres on
+seven hours, medications (*_mg fields) start at a dose and are tapered to
+zero in steps, open-ended numbers such as exercise minutes are zero on most
+days, and notes are long free text (markup characters included). Optional
+fields are left empty on some days. Values come out as strings, the way a
+journal CSV reads.
+"""
+import numpy as np
+import pandas as pd
+
+WORDS = ('slept', 'badly', 'walked', 'outside', 'headache', 'after', 'lunch', 'calmer', 'today', 'R&D', '<3',
+         'anxious', 'talked', 'with', 'nurse', 'dose', 'reduced', 'felt', 'hopeful', 'tired')
+
+# name: (days per user, users); 'users' is a year from each of many users
+# kept in one journal, several entries per date
+SIZES = {'30d': (30, 1), '1y': (365, 1), '10y': (3650, 1), 'users': (365, 50)}
+
+DOSES = (12.5, 25, 50, 100, 200)
+
+
+def number_values(rng, name, config, days):
+    low, high = config.get('min'), config.get('max')
+    step = config.get('step') or 1
+    if name.endswith('_mg'):
+        # Courses tapered to zero: a dose cut by a quarter of it every 2-8
+        # weeks, and now and then a new course after the last one ended
+        dose = rng.choice((0,) + DOSES)
+        cut = dose / 4
+        values = np.empty(days)
+        day = 0
+        while day < days:
+            span = rng.integers(14, 57)
+            values[day:day + span] = dose
+            dose = max(dose - cut, 0)
+            if not dose and rng.random() < 0.1:
+                dose = rng.choice(DOSES)
+                cut = dose / 4
+            day += span
+    elif name == 'sleep_hours':
+        values = rng.normal(7, 1.5, days)
+    elif high is None and low is not None:
+        # Open-ended amounts, exercise minutes say: nothing on most days
+        values = np.where(rng.random(days) < 0.6, 0, rng.integers(10, 90, days))
+    else:
+        # A score drifting around the middle of its range (0-10 when unbounded)
+        low_end, high_end = (low, high) if high is not None else (0, 10)
+        middle, spread = (low_end + high_end) / 2, (high_end - low_end) / 2
+        values = np.empty(days)
+        value = middle
+        for day, change in enumerate(rng.normal(0, spread / 4, days)):
+            value = value + change - (value - middle) * 0.1
+            values[day] = value
+        values = np.clip(values, low_end, high_end)
+    values = np.round(values / step) * step
+    values = np.clip(values, low if low is not None else 0, high if high is not None else np.inf)
+    return [f'{value:g}' for value in values]
+
+
+def text_values(rng, config, days, words):
+    low, high = words
+    filled = np.ones(days, dtype=bool) if config.get('required') else rng.random(days) < 0.4
+    return [' '.join(rng.choice(WORDS, rng.integers(low, high))) if keep else '' for keep in filled]
+
+
+def user_journal(rng, fields, days, start):
+    columns = {}
+    for name, config in fields.items():
+        if config['type'] == 'date':
+            columns[name] = pd.date_range(start, periods=days, freq='D').strftime('%Y-%m-%d')
+        elif config['type'] == 'number':
+            columns[name] = number_values(rng, name, config, days)
+        elif config['type'] == 'textarea':
+            columns[name] = text_values(rng, config, days, (20, 200))
+        else:
+            columns[name] = text_values(rng, config, days, (1, 6))
+    return pd.DataFrame(columns)
+
+
+def generate_journal(days, fields, users=1, seed=0, start='2015-01-01'):
+    """users journals of days entries each, merged in date order"""
+    rng = np.random.default_rng(seed)
+    journals = [user_journal(rng, fields, days, pd.Timestamp(start) + pd.Timedelta(days=int(rng.integers(0, 30))))
+                for _ in range(users)]
+    df = pd.concat(journals, ignore_index=True)
+    date_fields = [name for name, config in fields.items() if config['type'] == 'date']
+    if users > 1 and date_fields:
+        df = df.sort_values(date_fields[0], kind='stable', ignore_index=True)
+    return df
+
+
+def sized_journal(size, fields, seed=0):
+    """The journal for one of SIZES"""
+    days, users = SIZES[size]
+    return generate_journal(days, fields, users, seed)
+
+
+def entries_journal(entries, fields, seed=0):
+    """A journal of exactly entries entries: a year from each of as many users as it takes"""
+    return generate_journal(365, fields, -(-entries // 365), seed).iloc[:entries]
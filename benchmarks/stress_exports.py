@@ -0,0 +1,79 @@
+"""Export many distinct PDF reports and check the export directory stays bounded
+
+    python -m benchmarks.stress_exports
+    python -m benchmarks.stress_exports --reports 60 --days 60 --max-kb 1024 --workers 2
+
+Every report is built from a different synthetic journal, so none can be
+reused. After each batch the export directory must hold no more than
+max(--max-kb, newest report) bytes and no leftover temp files, and the
+reports that were kept must still download.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_renderers import prepared_journal  # noqa: E402
+from pdf_jobs import PDFJobs  # noqa: E402
+
+
+def wait_for(jobs, job_ids, timeout):
+    deadline = time.monotonic() + timeout
+    pending = set(job_ids)
+    while pending:
+        for job_id in list(pending):
+            status = jobs.status(job_id)
+            if status['state'] == 'failed':
+                raise AssertionError(f'{job_id}: {status["error"]}')
+            if status['state'] == 'done':
+                pending.discard(job_id)
+        if time.monotonic() > deadline:
+            raise AssertionError(f'{len(pending)} exports still running after {timeout}s')
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reports', type=int, default=40)
+    parser.add_argument('--days', type=int, default=30, help='entries per journal')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-kb', type=int, default=1024, help='export directory budget')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    export_dir = tempfile.mkdtemp(prefix='klinikum_exports_')
+    jobs = PDFJobs(export_dir, args.workers, max_bytes=args.max_kb * 1024)
+    peak = 0
+    start = time.perf_counter()
+    try:
+        for batch_start in range(0, args.reports, args.workers):
+            job_ids = []
+            for seed in range(batch_start, min(batch_start + args.workers, args.reports)):
+                df, fields = prepared_journal(args.days, seed=seed)
+                job_ids.append(jobs.submit(df, fields, 'fast'))
+            wait_for(jobs, job_ids, args.timeout)
+            time.sleep(0.1)  # let the done callbacks run their eviction
+
+            usage = jobs.disk_usage()
+            newest = max(os.path.getsize(jobs.pdf_path(job_id)) for job_id in job_ids
+                         if os.path.exists(jobs.pdf_path(job_id)))
+            bound = max(jobs.max_bytes, newest)
+            assert usage <= bound, f'export dir holds {usage} bytes, bound is {bound}'
+            assert not [name for name in os.listdir(export_dir) if name.endswith('.tmp')], 'temp files left'
+            peak = max(peak, usage)
+    finally:
+        jobs.shutdown()
+
+    kept = [name for name in os.listdir(export_dir) if name.endswith('.pdf')]
+    for name in kept:
+        with open(os.path.join(export_dir, name), 'rb') as f:
+            assert f.read(5) == b'%PDF-', f'{name} is not a PDF'
+    print(f'{args.reports} reports in {time.perf_counter() - start:.1f}s, '
+          f'{len(kept)} kept, peak {peak / 1024:.0f} KiB of {args.max_kb} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Hammer /add and /edit from many processes and threads and check nothing is lost
+
+Runs against a throwaway copy of the journal:
+
+    python -m benchmarks.stress_writes --processes 4 --threads 4 --rounds 25
+    STORAGE_BACKEND=sqlite python -m benchmarks.stress_writes
+
+Every worker adds entries tagged with a unique marker and increments
+med4_mg on the first entry through the edit form (GET for the version
+token, POST with it). Afterwards every marker must be present exactly once,
+and med4_mg must have grown by exactly the number of edits that were
+accepted: a lost update or a torn write makes one of those checks fail.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSION_RE = re.compile(r'name="version" value="([^"]*)"')
+COUNTER_FIELD = 'med4_mg'
+COUNTER_RE = re.compile(r'name="%s"\s+value="([^"]*)"' % COUNTER_FIELD)
+
+
+def make_workdir():
+    """Copy the journal and field config into a temp dir and chdir there"""
+    workdir = tempfile.mkdtemp(prefix='klinikum_stress_')
+    for name in ('klinikum_4weeks.csv', 'fields_config.json'):
+        shutil.copy(os.path.join(REPO_DIR, name), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    return workdir
+
+
+def worker(worker_id, threads, rounds, results):
+    import app as app_module
+
+    accepted = []
+
+    def run(thread_id):
+        client = app_module.app.test_client()
+        fields = app_module.load_fields_config()
+        row_id = int(app_module.load_data().index[0])
+        edits = 0
+        for i in range(rounds):
+            form = {name: '1' if config['type'] == 'number' else '' for name, config in fields.items()}
+            form.update(date='2030-01-01', notes=f'stress-{worker_id}-{thread_id}-{i}')
+            client.post('/add', data=form)
+
+            page = client.get(f'/edit/{row_id}').get_data(as_text=True)
+            version = VERSION_RE.search(page).group(1)
+            counter = float(COUNTER_RE.search(page).group(1) or 0)
+            entry = app_module.store.get_entry(row_id)
+            form = {name: '' if entry[name] is None else str(entry[name]) for name in fields}
+            form.update({COUNTER_FIELD: str(int(counter) + 1), 'version': version})
+            response = client.post(f'/edit/{row_id}', data=form)
+            if response.headers['Location'].endswith('/'):
+                edits += 1
+        accepted.append(edits)
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(sum(accepted))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=25)
+    args = parser.parse_args()
+
+    workdir = make_workdir()
+    import app as app_module
+    if app_module.STORAGE_BACKEND == 'sqlite':
+        app_module.app.test_cli_runner().invoke(args=['migrate-to-sqlite'])
+        app_module.store.invalidate()
+    before = app_module.load_data()
+    start_counter = int(before[COUNTER_FIELD].iloc[0])
+
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(p, args.threads, args.rounds, results))
+             for p in range(args.processes)]
+    for proc in procs:
+        proc.start()
+    accepted_edits = sum(results.get() for _ in procs)
+    for proc in procs:
+        proc.join()
+
+    app_module.store.invalidate()
+    after = app_module.load_data()
+    markers = after['notes'].astype(str)
+    markers = markers[markers.str.startswith('stress-')]
+    expected_adds = args.processes * args.threads * args.rounds
+    final_counter = int(after[COUNTER_FIELD].iloc[0])
+
+    print(f'workdir:        {workdir}')
+    print(f'adds:           {len(markers)} / {expected_adds} (unique {markers.nunique()})')
+    print(f'edits accepted: {accepted_edits} of {expected_adds}, counter moved by {final_counter - start_counter}')
+    ok = (len(markers) == markers.nunique() == expected_adds
+          and len(after) == len(before) + expected_adds
+          and final_counter - start_counter == accepted_edits)
+    print('OK' if ok else 'FAILED: lost or duplicated writes')
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Bulk import and streaming export of journal entries
+
+Imports arrive as a JSON array or as NDJSON (one JSON object per line).
+Either way they are cut into batches of up to BATCH_SIZE entries, each
+validated as a whole and stored in a single write, so backfilling months
+of entries costs a handful of writes rather than one per entry. NDJSON is
+read line by line, so a large upload never sits in memory at once.
+
+Exports are produced EXPORT_CHUNK rows at a time, so the first bytes go
+out before the whole journal has been formatted.
+"""
+import json
+import os
+
+import pandas as pd
+
+from datastore import storage_frame
+
+BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '5000'))
+EXPORT_CHUNK = 1000
+
+
+def frame(entries, rows):
+    """DataFrame of entries indexed by their 1-based row numbers"""
+    return pd.DataFrame(entries, index=pd.Index(rows, name='row'))
+
+
+def json_batches(items, size=BATCH_SIZE):
+    """Yield (DataFrame, errors) batches from a parsed JSON array"""
+    for start in range(0, len(items), size):
+        entries, rows, errors = [], [], []
+        for row, item in enumerate(items[start:start + size], start + 1):
+            if isinstance(item, dict):
+                entries.append(item)
+                rows.append(row)
+            else:
+                errors.append({'row': row, 'field': None, 'message': 'Not a JSON object'})
+        yield frame(entries, rows), errors
+
+
+def ndjson_batches(lines, size=BATCH_SIZE):
+    """Yield (DataFrame, errors) batches from an iterable of NDJSON lines
+
+    Rows are numbered by line; blank lines are skipped.
+    """
+    entries, rows, errors = [], [], []
+    for row, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            item = None
+        if isinstance(item, dict):
+            entries.append(item)
+            rows.append(row)
+        else:
+            errors.append({'row': row, 'field': None, 'message': 'Not a JSON object'})
+        if len(entries) >= size:
+            yield frame(entries, rows), errors
+            entries, rows, errors = [], [], []
+    if entries or errors:
+        yield frame(entries, rows), errors
+
+
+def export_chunks(df):
+    """df in EXPORT_CHUNK-row slices, as the backends would store them"""
+    for start in range(0, len(df), EXPORT_CHUNK):
+        yield storage_frame(df.iloc[start:start + EXPORT_CHUNK])
+
+
+def ndjson_lines(df):
+    """Yield df as NDJSON, one object per entry"""
+    for chunk in export_chunks(df):
+        yield chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n'
+
+
+def csv_lines(df):
+    """Yield df as CSV, header first"""
+    yield df.iloc[:0].to_csv(index=False)
+    for chunk in export_chunks(df):
+        yield chunk.to_csv(header=False, index=False)
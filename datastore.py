@@ -0,0 +1,1070 @@
+import copy
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# Frames handed out by the store share memory with the cache. Copy-on-write
+# makes any column assignment or .loc update on them copy the touched block
+# first, so a route can never modify the cached frame in place.
+pd.set_option('mode.copy_on_write', True)
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, writes are unguarded
+    fcntl = None
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+    TEXT_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:  # same semantics, stored as Python objects; no columnar backend
+    pyarrow = None
+    TEXT_DTYPE = pd.StringDtype('python')
+
+# Writes remembered so caches can follow them instead of starting over
+CHANGE_LOG_SIZE = 32
+# Loads retried by load_versioned() when a write lands during them
+VERSIONED_LOAD_ATTEMPTS = 3
+# Rows converted at a time when a schema change is carried over to storage,
+# and how often a file is rebuilt before the rebuild takes the write lock
+COMPACT_CHUNK = 50000
+COMPACT_ATTEMPTS = 3
+
+# Nullable integer dtypes tried, smallest first, for bounded whole-number fields
+INT_DTYPES = [('UInt8', 0, 255), ('Int8', -128, 127), ('UInt16', 0, 65535), ('Int16', -32768, 32767)]
+
+
+def file_signature(path):
+    """Return (inode, mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class StaleWriteError(Exception):
+    """The data changed since the version token the caller was working from"""
+
+
+def version_token(signature):
+    """Render a backend signature as an opaque string for forms and links"""
+    if isinstance(signature, tuple):
+        return '-'.join(str(part) for part in signature)
+    return str(signature)
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock on <path>.lock while the block runs
+
+    Writers take the lock exclusively around the whole read-modify-write;
+    readers take it shared so they never see a half-appended row. The lock
+    is per open file, so it must not be re-acquired inside a locked block.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write(path, write, binary=False):
+    """Call write(f) on a temp file next to path, then swap it into place
+
+    Readers see either the old or the new file, never a partial one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', newline='', encoding='utf-8')) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def empty_value(field_config):
+    """Value used for a field that has no data yet"""
+    return '' if field_config['type'] == 'text' or field_config['type'] == 'textarea' else 0
+
+
+def ensure_fields(df, fields):
+    """Add any configured field missing from df, filled with its empty value"""
+    for field in fields.keys():
+        if field not in df.columns:
+            df[field] = empty_value(fields[field])
+    return df
+
+
+def is_whole(value):
+    return value is not None and float(value).is_integer()
+
+
+def field_dtype(field_config):
+    """Compact dtype for a configured field
+
+    Numbers with a configured min and max and a whole step (1 when unset)
+    get the smallest nullable integer dtype covering the range; other
+    numbers (doses, hours) float32. Single-line text is categorical; long
+    text and dates are strings (Arrow-backed when pyarrow is installed).
+    """
+    if field_config['type'] == 'number':
+        low, high = field_config.get('min'), field_config.get('max')
+        if is_whole(low) and is_whole(high) and is_whole(field_config.get('step', 1)):
+            for dtype, dtype_min, dtype_max in INT_DTYPES:
+                if dtype_min <= low and high <= dtype_max:
+                    return dtype
+        return 'float32'
+    if field_config['type'] == 'text':
+        return 'category'
+    return TEXT_DTYPE
+
+
+def read_dtypes(fields):
+    """dtypes to hand the CSV parser so it skips type inference
+
+    Numbers are parsed as float32 and narrowed to integers afterwards by
+    apply_dtypes, which also copes with values outside the configured range.
+    """
+    return {name: 'float32' if config['type'] == 'number' else field_dtype(config)
+            for name, config in fields.items()}
+
+
+def number_column(values, dtype):
+    """values as dtype, or float32 if they do not all fit a whole-number dtype"""
+    values = pd.to_numeric(values, errors='coerce')
+    if dtype != 'float32':
+        present = values.dropna()
+        info = np.iinfo(dtype.lower())
+        if ((present % 1 == 0) & (present >= info.min) & (present <= info.max)).all():
+            return values.astype(dtype)
+    return values.astype('float32')
+
+
+def apply_dtypes(df, fields):
+    """Convert the configured columns of df to their compact dtypes"""
+    for name, config in fields.items():
+        if name not in df.columns:
+            continue
+        dtype = field_dtype(config)
+        if df[name].dtype == dtype:
+            continue
+        if config['type'] == 'number':
+            df[name] = number_column(df[name], dtype)
+        else:
+            df[name] = df[name].astype(dtype)
+    return df
+
+
+def concat_typed(df, rows, fields, ignore_index):
+    """Append rows to a typed frame, keeping every column's dtype"""
+    df = df.copy(deep=False)
+    rows = apply_dtypes(rows, fields)
+    for col in rows.columns:
+        if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories
+            new = pd.Index(rows[col].dropna().unique()).difference(categories)
+            if len(new):
+                df[col] = df[col].cat.add_categories(new)
+            rows[col] = pd.Categorical(rows[col], categories=df[col].cat.categories)
+    return pd.concat([df, rows], ignore_index=ignore_index)
+
+
+def storage_frame(df):
+    """df with compact dtypes turned back into what the backends store
+
+    float32 values go through their shortest decimal form so 0.1 is stored
+    as 0.1 rather than 0.10000000149; whole floats become integers so the
+    CSV keeps 25 rather than 25.0.
+    """
+    for col in df.columns:
+        dtype = df[col].dtype
+        if dtype == 'float32':
+            values = df[col].astype(str).astype('float64')
+            present = values.dropna()
+            df[col] = values.astype('Int64') if (present % 1 == 0).all() else values
+        elif isinstance(dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def number_text(values):
+    """Numbers as the CSV holds them: 25 rather than 25.0, NaN as empty"""
+    # float32 prints its own shortest form (0.1, not 0.10000000149)
+    values = values if values.dtype == 'float32' else values.astype('float64')
+    return values.astype(str).str.replace(r'\.0$', '', regex=True).replace('nan', '')
+
+
+def stored_values(values, field_config):
+    """values converted for a field of field_config, and how many could not be
+
+    Numbers come back as float64 and dates as YYYY-MM-DD; values that do not
+    read as either are left empty. Text keeps numbers as the CSV writes them.
+    """
+    missing = values.isna().to_numpy(dtype=bool)
+    if not pd.api.types.is_numeric_dtype(values):
+        missing = missing | values.astype(str).str.strip().eq('').to_numpy()
+    if field_config['type'] == 'number':
+        converted = pd.to_numeric(values.where(~missing), errors='coerce').astype('float64')
+    elif field_config['type'] == 'date':
+        dates = pd.to_datetime(values.where(~missing).astype('string'), errors='coerce')
+        converted = dates.dt.strftime('%Y-%m-%d')
+    elif pd.api.types.is_numeric_dtype(values):
+        converted = number_text(values).where(~missing, empty_value(field_config))
+    else:
+        converted = values.astype(object).where(~missing, empty_value(field_config)).astype(str)
+    return converted, int((converted.isna().to_numpy() & ~missing).sum())
+
+
+def fsync_path(path):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+def columnar_frame(df):
+    """df with every object column given a single type Arrow can store
+
+    Columns of numbers become numeric and anything else strings, the way
+    a CSV round trip would have typed them.
+    """
+    for col in df.columns:
+        if df[col].dtype == object:
+            kind = pd.api.types.infer_dtype(df[col], skipna=True)
+            if kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+                df[col] = pd.to_numeric(df[col])
+            elif kind != 'boolean':
+                df[col] = df[col].astype(TEXT_DTYPE)
+    return df
+
+
+class FileBackend:
+    """Journal kept in a single file that is rewritten as a whole
+
+    Row ids are positions in the file, so they shift after a delete.
+    Subclasses read and write the file format in _read() and _write().
+    """
+
+    positional_ids = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def signature(self):
+        return file_signature(self.path)
+
+    def last_modified(self):
+        signature = self.signature()
+        return None if signature is None else signature[1] / 1e9
+
+    def _check_version(self, expected_version):
+        if expected_version is not None and expected_version != version_token(self.signature()):
+            raise StaleWriteError(self.path)
+
+    def read(self, dtypes=None, columns=None):
+        """Parse the file, or return None if there is no data
+
+        dtypes maps column names to the dtypes to parse them as; columns
+        limits the read to those of the named columns the file has.
+        """
+        with file_lock(self.path, shared=True):
+            return self._read(dtypes, columns)
+
+    def write(self, df):
+        """Replace the file atomically with the contents of df"""
+        with file_lock(self.path):
+            self._write(df)
+
+    def get(self, row_id):
+        df = self.read()
+        if df is None or row_id not in df.index:
+            return None
+        return df.loc[row_id].to_dict()
+
+    def update(self, row_id, entry, fields, expected_version=None):
+        """Rewrite the file with one entry changed
+
+        Returns (signature before, signature after, the old row as a one-row
+        DataFrame), or None if the id does not exist.
+        """
+        with file_lock(self.path):
+            self._check_version(expected_version)
+            before = self.signature()
+            df = self._read()
+            if df is None or row_id not in df.index:
+                return None
+            old_row = df.loc[[row_id]]
+            # As object columns so no value is rejected by a narrower dtype
+            df = ensure_fields(df, fields).astype({name: object for name in entry if name in df.columns})
+            for field_name, value in entry.items():
+                df.loc[row_id, field_name] = value
+            self._write(df)
+            return before, self.signature(), old_row
+
+    def delete(self, row_id, expected_version=None):
+        """Rewrite the file without one entry; returns what update() does"""
+        with file_lock(self.path):
+            self._check_version(expected_version)
+            before = self.signature()
+            df = self._read()
+            if df is None or row_id not in df.index:
+                return None
+            self._write(df.drop(row_id).reset_index(drop=True))
+            return before, self.signature(), df.loc[[row_id]]
+
+    def add_column(self, field_name, field_config):
+        """Nothing to write: reads fill a missing field with its empty value
+
+        The column is written out by the next compact() (or the next write
+        that rewrites the file), so adding a field costs the same for any
+        journal size.
+        """
+
+    def compact(self, plan):
+        """Carry a schema plan (see migrations.SchemaPlan) over to the file
+
+        The new file is built chunk by chunk next to the old one without
+        holding the lock, so reads and writes carry on meanwhile, and only
+        replaces the old file if nothing was written in between; otherwise
+        the work is redone, the last attempt under the lock. Returns
+        {field: values that could not be converted}.
+        """
+        for attempt in range(COMPACT_ATTEMPTS):
+            last = attempt == COMPACT_ATTEMPTS - 1
+            with file_lock(self.path) if last else nullcontext():
+                before = self.signature()
+                if before is None:
+                    return {}
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                                prefix='.' + os.path.basename(self.path) + '.', suffix='.tmp')
+                os.close(fd)
+                try:
+                    lost = self._compact_into(tmp_path, plan)
+                    fsync_path(tmp_path)
+                    if last:
+                        os.replace(tmp_path, self.path)
+                        return lost
+                    with file_lock(self.path):
+                        if self.signature() == before:
+                            os.replace(tmp_path, self.path)
+                            return lost
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+
+class CSVBackend(FileBackend):
+    """Journal stored as a single CSV file"""
+
+    def _read(self, dtypes=None, columns=None):
+        signature = self.signature()
+        if signature is None or signature[2] == 0:
+            return None
+        # Unselected columns are still scanned, but never turned into values
+        usecols = None if columns is None else [col for col in self._read_header() or [] if col in columns]
+        metrics.count('storage_bytes_total', signature[2], format='csv', direction='read')
+        if dtypes:
+            try:
+                return pd.read_csv(self.path, dtype=dtypes, usecols=usecols)
+            except ValueError:  # e.g. text in a number column: infer, apply_dtypes coerces
+                pass
+        return pd.read_csv(self.path, usecols=usecols)
+
+    def _write(self, df):
+        df = storage_frame(df)
+        atomic_write(self.path, lambda f: df.to_csv(f, index=False))
+        metrics.count('storage_bytes_total', os.path.getsize(self.path), format='csv', direction='written')
+
+    def _read_header(self):
+        """Return the CSV header as a list, or None if the file is missing or empty"""
+        try:
+            with open(self.path, 'r', newline='', encoding='utf-8') as f:
+                return next(csv.reader(f), None)
+        except FileNotFoundError:
+            return None
+
+    def columns(self):
+        return self._read_header() or []
+
+    def _compact_into(self, tmp_path, plan):
+        """Write the file with plan applied to tmp_path, COMPACT_CHUNK rows at a time
+
+        Untouched columns are copied as the text they are stored as.
+        """
+        header = self._read_header() or []
+        columns = [col for col in header if col not in plan.drop] + [name for name in plan.add if name not in header]
+        lost = dict.fromkeys(plan.convert, 0)
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False, lineterminator=os.linesep)
+            if not header:
+                return lost
+            for chunk in pd.read_csv(self.path, dtype=str, keep_default_na=False, chunksize=COMPACT_CHUNK):
+                for name, config in plan.add.items():
+                    if name not in chunk.columns:
+                        chunk[name] = empty_value(config)
+                for name, config in plan.convert.items():
+                    if name in chunk.columns:
+                        converted, count = stored_values(chunk[name], config)
+                        lost[name] += count
+                        chunk[name] = number_text(converted) if config['type'] == 'number' else converted.fillna('')
+                chunk[columns].to_csv(f, header=False, index=False, lineterminator=os.linesep)
+        return lost
+
+    def append(self, entry, fields):
+        """Append one entry without rewriting the existing rows; see append_rows()"""
+        return self.append_rows(pd.DataFrame([entry]), fields)
+
+    def append_rows(self, rows, fields):
+        """Append a batch of entries in one write without rewriting the existing rows
+
+        The rows are written in the file's own column order. The whole file
+        is only rewritten when its header lacks one of the rows' fields, i.e.
+        a field was added since the file was last written; None is returned
+        in that case. Otherwise returns (signature before, signature after,
+        the new rows).
+        """
+        with file_lock(self.path):
+            before = self.signature()
+            header = self._read_header()
+            if header is None or any(field not in header for field in rows.columns):
+                df = self._read()
+                df = ensure_fields(pd.DataFrame() if df is None else df, fields)
+                self._write(pd.concat([df, rows], ignore_index=True))
+                return None
+
+            text = storage_frame(rows.reindex(columns=header)).to_csv(header=False, index=False,
+                                                                      lineterminator=os.linesep)
+            with open(self.path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    text = os.linesep + text
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                f.write(text)
+            after = self.signature()
+            metrics.count('storage_bytes_total', after[2] - before[2], format='csv', direction='written')
+        return before, after, rows
+
+
+class ColumnarBackend(FileBackend):
+    """Journal stored as a Parquet or Feather file (needs pyarrow)
+
+    Columns are stored with their compact dtypes, so a read skips parsing
+    altogether, and reading a few columns never touches the others: the
+    graphs load the numbers without the free text. Files are memory-mapped
+    rather than read into a buffer first; Feather is written uncompressed
+    so its columns can be used straight from the mapping.
+
+    Every change rewrites the whole file, like the CSV backend does for
+    edits and deletes.
+    """
+
+    formats = ('parquet', 'feather')
+
+    def __init__(self, path, file_format='parquet'):
+        if pyarrow is None:
+            raise RuntimeError(f'The {file_format} storage backend needs pyarrow: pip install pyarrow')
+        if file_format not in self.formats:
+            raise ValueError(f'Unknown columnar format: {file_format}')
+        super().__init__(path)
+        self.file_format = file_format
+
+    def columns(self):
+        if self.signature() is None:
+            return []
+        if self.file_format == 'parquet':
+            return pyarrow.parquet.read_schema(self.path, memory_map=True).names
+        with pyarrow.memory_map(self.path) as source:
+            return pyarrow.ipc.open_file(source).schema.names
+
+    def _read(self, dtypes=None, columns=None):
+        # The file keeps its own dtypes; the caller narrows any that drifted
+        if self.signature() is None:
+            return None
+        if columns is not None:
+            columns = [col for col in self.columns() if col in columns]
+        if self.file_format == 'parquet':
+            table = pyarrow.parquet.read_table(self.path, columns=columns, memory_map=True)
+        else:
+            table = pyarrow.feather.read_table(self.path, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    def _write(self, df):
+        table = pyarrow.Table.from_pandas(columnar_frame(df), preserve_index=False)
+        if self.file_format == 'parquet':
+            atomic_write(self.path, lambda f: pyarrow.parquet.write_table(table, f), binary=True)
+        else:
+            atomic_write(self.path, lambda f: pyarrow.feather.write_feather(table, f, compression='uncompressed'),
+                         binary=True)
+
+    def _compact_into(self, tmp_path, plan):
+        """Write the file with plan applied to tmp_path, one record batch at a time
+
+        Untouched columns are copied without going through pandas.
+        Converted and added columns are float64 for numbers and strings
+        otherwise; the loader narrows them again.
+        """
+        if self.file_format == 'parquet':
+            source = pyarrow.parquet.ParquetFile(self.path, memory_map=True)
+            schema, batches = source.schema_arrow, source.iter_batches(batch_size=COMPACT_CHUNK)
+        else:
+            source = pyarrow.ipc.open_file(pyarrow.memory_map(self.path))
+            schema = source.schema
+            batches = (source.get_batch(i) for i in range(source.num_record_batches))
+
+        def target(name):
+            config = plan.convert.get(name) or plan.add.get(name)
+            if config is None or (name in plan.add and name in schema.names):
+                return None
+            return pyarrow.float64() if config['type'] == 'number' else pyarrow.string()
+
+        names = [name for name in schema.names if name not in plan.drop]
+        names += [name for name in plan.add if name not in schema.names]
+        types = {name: target(name) for name in names}
+        # The pandas metadata would still describe the old columns
+        out_schema = pyarrow.schema([pyarrow.field(name, types[name] or schema.field(name).type) for name in names])
+        lost = dict.fromkeys(plan.convert, 0)
+
+        if self.file_format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(tmp_path, out_schema)
+        else:
+            writer = pyarrow.ipc.new_file(tmp_path, out_schema)
+        with writer:
+            for batch in batches:
+                arrays = []
+                for name in names:
+                    if types[name] is None:
+                        arrays.append(batch.column(name))
+                    elif name in schema.names:
+                        converted, count = stored_values(batch.column(name).to_pandas(), plan.convert[name])
+                        lost[name] += count
+                        arrays.append(pyarrow.array(converted, type=types[name], from_pandas=True))
+                    else:
+                        empty = empty_value(plan.add[name])
+                        arrays.append(pyarrow.array([empty] * batch.num_rows, type=types[name]))
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=out_schema))
+        return lost
+
+    def get(self, row_id):
+        entry = super().get(row_id)
+        if entry is not None:  # missing values as None, like SQLite's NULL
+            entry = {name: None if pd.isna(value) else value for name, value in entry.items()}
+        return entry
+
+    def append(self, entry, fields):
+        """Rewrite the file with one more entry; see append_rows()"""
+        return self.append_rows(pd.DataFrame([entry]), fields)
+
+    def append_rows(self, rows, fields):
+        """Rewrite the file once with a batch of entries added
+
+        Returns (signature before, signature after, new rows).
+        """
+        with file_lock(self.path):
+            before = self.signature()
+            df = self._read()
+            df = apply_dtypes(ensure_fields(pd.DataFrame() if df is None else df, fields), fields)
+            self._write(concat_typed(df, rows.copy(deep=False), fields, ignore_index=True))
+            after = self.signature()
+        return before, after, rows
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_value(value):
+    """Convert a pandas/numpy cell into something sqlite3 can bind"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+class SQLiteBackend:
+    """Journal stored in an SQLite database in WAL mode
+
+    Each entry has a stable integer id, so edits and deletes touch exactly
+    one row. PRAGMA user_version is bumped by every write and serves as the
+    change signature for the cache.
+    """
+
+    positional_ids = False
+    table = 'entries'
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        # Field columns are added with ALTER TABLE as they are first used.
+        # Not a _transaction(): opening the journal must not change its
+        # version, or every start would make the caches and open forms stale
+        conn = self._connect()
+        try:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} '
+                         f'(id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_date ON {self.table} (date)')
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _column_definition(field_name, field_config):
+        if field_config['type'] == 'number':
+            return f'{quote_identifier(field_name)} NUMERIC DEFAULT 0'
+        if field_config['type'] in ('text', 'textarea'):
+            return f"{quote_identifier(field_name)} TEXT DEFAULT ''"
+        return f'{quote_identifier(field_name)} TEXT'
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run a write transaction that also bumps the change signature"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute(f'PRAGMA user_version = {self._version(conn) + 1}')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def _check_version(self, conn, expected_version):
+        if expected_version is not None and expected_version != version_token(self._version(conn)):
+            raise StaleWriteError(self.db_file)
+
+    @staticmethod
+    def _version(conn):
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def _columns(self, conn):
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({self.table})') if row[1] != 'id']
+
+    def signature(self):
+        conn = self._connect()
+        try:
+            return self._version(conn)
+        finally:
+            conn.close()
+
+    def last_modified(self):
+        """Newest mtime of the database and its write-ahead log"""
+        mtimes = [os.path.getmtime(path) for path in (self.db_file, self.db_file + '-wal')
+                  if os.path.exists(path)]
+        return max(mtimes) if mtimes else None
+
+    def columns(self):
+        conn = self._connect()
+        try:
+            return self._columns(conn)
+        finally:
+            conn.close()
+
+    def read(self, dtypes=None, columns=None):
+        # Types are applied by the caller: SQLite hands back Python values
+        conn = self._connect()
+        try:
+            selected = '*'
+            if columns is not None:
+                selected = ', '.join(['id'] + [quote_identifier(col) for col in self._columns(conn) if col in columns])
+            df = pd.read_sql_query(f'SELECT {selected} FROM {self.table} ORDER BY id', conn, index_col='id')
+        finally:
+            conn.close()
+        return None if df.empty else df
+
+    def write(self, df):
+        """Replace every row with the contents of df"""
+        df = storage_frame(df)
+        with self._transaction() as conn:
+            conn.execute(f'DELETE FROM {self.table}')
+            columns = self._columns(conn)
+            for column in df.columns:
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE {self.table} ADD COLUMN {quote_identifier(column)}')
+                    columns.append(column)
+            names = ', '.join(quote_identifier(column) for column in df.columns)
+            marks = ', '.join('?' for _ in df.columns)
+            conn.executemany(f'INSERT INTO {self.table} ({names}) VALUES ({marks})',
+                             ([sql_value(value) for value in row] for row in df.itertuples(index=False)))
+
+    def _add_missing_columns(self, conn, entry, fields):
+        columns = self._columns(conn)
+        for field_name in entry:
+            if field_name not in columns:
+                field_config = fields.get(field_name, {'type': 'text'})
+                conn.execute(f'ALTER TABLE {self.table} ADD COLUMN {self._column_definition(field_name, field_config)}')
+
+    def append(self, entry, fields):
+        """Insert one entry; see append_rows()"""
+        return self.append_rows(pd.DataFrame([entry]), fields)
+
+    def append_rows(self, rows, fields):
+        """Insert a batch of entries in one transaction
+
+        Returns (signature before, signature after, new rows indexed by id).
+        """
+        values = storage_frame(rows.copy(deep=False))
+        with self._transaction() as conn:
+            before = self._version(conn)
+            self._add_missing_columns(conn, rows.columns, fields)
+            last_id = conn.execute(f'SELECT coalesce(max(id), 0) FROM {self.table}').fetchone()[0]
+            names = ', '.join(quote_identifier(name) for name in rows.columns)
+            marks = ', '.join('?' for _ in rows.columns)
+            conn.executemany(f'INSERT INTO {self.table} ({names}) VALUES ({marks})',
+                             ([sql_value(value) for value in row] for row in values.itertuples(index=False)))
+            ids = [row[0] for row in conn.execute(f'SELECT id FROM {self.table} WHERE id > ? ORDER BY id', (last_id,))]
+        return before, before + 1, rows.set_axis(pd.Index(ids, name='id'))
+
+    def get(self, row_id):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute(f'SELECT * FROM {self.table} WHERE id = ?', (row_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        entry = dict(row)
+        del entry['id']
+        return entry
+
+    def _row(self, conn, row_id):
+        return pd.read_sql_query(f'SELECT * FROM {self.table} WHERE id = ?', conn, params=(row_id,), index_col='id')
+
+    def update(self, row_id, entry, fields, expected_version=None):
+        """Change one entry; returns (version before, version after, old row) or None"""
+        with self._transaction() as conn:
+            self._check_version(conn, expected_version)
+            before = self._version(conn)
+            old_row = self._row(conn, row_id)
+            if old_row.empty:
+                return None
+            self._add_missing_columns(conn, entry, fields)
+            assignments = ', '.join(f'{quote_identifier(name)} = ?' for name in entry)
+            conn.execute(f'UPDATE {self.table} SET {assignments} WHERE id = ?',
+                         [sql_value(value) for value in entry.values()] + [row_id])
+        return before, before + 1, old_row
+
+    def delete(self, row_id, expected_version=None):
+        """Remove one entry; returns (version before, version after, old row) or None"""
+        with self._transaction() as conn:
+            self._check_version(conn, expected_version)
+            before = self._version(conn)
+            old_row = self._row(conn, row_id)
+            if old_row.empty:
+                return None
+            conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (row_id,))
+        return before, before + 1, old_row
+
+    def add_column(self, field_name, field_config):
+        with self._transaction() as conn:
+            if field_name not in self._columns(conn):
+                conn.execute(f'ALTER TABLE {self.table} ADD COLUMN {self._column_definition(field_name, field_config)}')
+
+    def compact(self, plan):
+        """Carry a schema plan (see migrations.SchemaPlan) over to the table
+
+        New columns were added by add_column() already. Retyped columns are
+        converted COMPACT_CHUNK rows per transaction, so writers only ever
+        wait for one chunk. Deleted columns are dropped where SQLite
+        supports DROP COLUMN (3.35+). Returns {field: values that could not
+        be converted}.
+        """
+        lost = {}
+        for name, config in plan.convert.items():
+            lost[name], last_id = 0, 0
+            while True:
+                with self._transaction() as conn:
+                    chunk = pd.DataFrame()
+                    if name in self._columns(conn):
+                        chunk = pd.read_sql_query(f'SELECT id, {quote_identifier(name)} FROM {self.table} '
+                                                  f'WHERE id > ? ORDER BY id LIMIT ?', conn,
+                                                  params=(last_id, COMPACT_CHUNK), index_col='id')
+                    if not chunk.empty:
+                        converted, count = stored_values(chunk[name], config)
+                        conn.executemany(f'UPDATE {self.table} SET {quote_identifier(name)} = ? WHERE id = ?',
+                                         zip(map(sql_value, converted), chunk.index.tolist()))
+                if chunk.empty:
+                    break
+                lost[name] += count
+                last_id = int(chunk.index[-1])
+
+        if plan.drop and sqlite3.sqlite_version_info >= (3, 35, 0):
+            with self._transaction() as conn:
+                for name in plan.drop:
+                    if name in self._columns(conn):
+                        conn.execute(f'ALTER TABLE {self.table} DROP COLUMN {quote_identifier(name)}')
+        return lost
+
+
+class DataStore:
+    """In-process cache of the journal and the fields config
+
+    The journal lives in a storage backend (CSV, Parquet/Feather or
+    SQLite); the field configuration is always fields_config.json. Each is
+    read once and kept in memory until its signature changes (file
+    inode/mtime/size for files, the database generation for SQLite), so
+    writes made by another gunicorn worker are still picked up while an
+    unchanged journal costs one cheap check per request.
+    """
+
+    def __init__(self, backend, fields_config_file, default_fields):
+        self.backend = backend
+        self.fields_config_file = fields_config_file
+        self.default_fields = default_fields
+        self._lock = threading.Lock()
+        self._fields = None  # (signature, fields dict)
+        self._data = None    # (signatures, DataFrame)
+        self._projections = {}  # column tuple -> (signatures, DataFrame)
+        # (version before, version after, rows removed, rows added) of recent writes
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+
+    def _cached_fields(self):
+        signature = file_signature(self.fields_config_file)
+        with self._lock:
+            cached = self._fields
+        if cached is not None and cached[0] == signature:
+            return cached
+
+        if signature is None:
+            fields = copy.deepcopy(self.default_fields)
+        else:
+            with open(self.fields_config_file, 'r', encoding='utf-8') as f:
+                fields = json.load(f)
+        cached = (signature, fields)
+        with self._lock:
+            self._fields = cached
+        return cached
+
+    def load_fields(self):
+        """Return a private copy of the field configuration"""
+        return copy.deepcopy(self._cached_fields()[1])
+
+    def save_fields(self, fields):
+        """Write the field configuration atomically and drop the cached copy"""
+        with file_lock(self.fields_config_file):
+            atomic_write(self.fields_config_file,
+                         lambda f: json.dump(fields, f, indent=2, ensure_ascii=False))
+        self.invalidate()
+
+    def version(self):
+        """Token identifying the current generation of the journal
+
+        Carried through edit forms and delete links; passing it back to
+        update_entry()/delete_entry() rejects the write with StaleWriteError
+        if anything was written in between.
+        """
+        return version_token(self.backend.signature())
+
+    def columns(self):
+        """Names of the stored columns, in storage order"""
+        return self.backend.columns()
+
+    def _read(self, fields, columns=None):
+        with metrics.span('storage.read'):
+            df = self.backend.read(read_dtypes(fields), columns)
+        if df is None:
+            return pd.DataFrame()
+        with metrics.span('storage.dtypes'):
+            return apply_dtypes(ensure_fields(df, fields), fields)
+
+    def load_data(self, columns=None):
+        """Return a copy-on-write view of the journal DataFrame, indexed by row id
+
+        With columns, only those columns are loaded: taken from the whole
+        journal when that is cached and current, otherwise read on their own
+        and cached per selection.
+        """
+        fields_signature, fields = self._cached_fields()
+        signature = (self.backend.signature(), fields_signature)
+
+        with self._lock:
+            cached = self._data
+        if columns is not None:
+            if cached is not None and cached[0] == signature:
+                return cached[1][[col for col in columns if col in cached[1].columns]]
+            return self._load_columns(tuple(columns), fields, signature)
+
+        if cached is None or cached[0] != signature:
+            cached = (signature, self._read(fields))
+            with self._lock:
+                self._data = cached
+        return cached[1].copy(deep=False)
+
+    def load_versioned(self, columns=None):
+        """(version, frame) where the frame is the journal as of that version
+
+        Caches that follow changes() from a version must know the one their
+        frame was read at: version() read before a load is older than the
+        frame if a write lands in between. The version is read before and
+        after, and the load tried again when they differ; if writes keep
+        landing, the version is None (unknown).
+        """
+        for _ in range(VERSIONED_LOAD_ATTEMPTS):
+            version = self.version()
+            df = self.load_data(columns)
+            if self.version() == version:
+                return version, df
+        return None, df
+
+    def raw_data(self):
+        """The journal as the backend stores it, without the compact dtypes
+
+        Not cached. Values the loader would turn into NaN (text in a number
+        column) are still there, for validation.Validator.audit().
+        """
+        df = self.backend.read()
+        return pd.DataFrame() if df is None else df
+
+    def _load_columns(self, columns, fields, signature):
+        with self._lock:
+            cached = self._projections.get(columns)
+        if cached is None or cached[0] != signature:
+            selected = {name: config for name, config in fields.items() if name in columns}
+            cached = (signature, self._read(selected, list(columns)))
+            with self._lock:
+                # Selections of older versions are of no further use
+                self._projections = {key: value for key, value in self._projections.items() if value[0] == signature}
+                self._projections[columns] = cached
+        return cached[1].copy(deep=False)
+
+    def _record_change(self, before, after, removed=None, added=None):
+        with self._lock:
+            self._changes.append((version_token(before), version_token(after), removed, added))
+
+    def changes(self, since, until):
+        """[(rows removed, rows added)] for every write between two versions
+
+        Returns None when a write in between was not made through this
+        store (another gunicorn worker, save_data, a new column) and is
+        therefore unknown.
+        """
+        with self._lock:
+            log = list(self._changes)
+        steps, version = [], since
+        for before, after, removed, added in log:
+            if version == until:
+                break
+            if before == version:
+                steps.append((removed, added))
+                version = after
+        return steps if version == until else None
+
+    def save_data(self, df):
+        """Replace the whole journal with df and drop the cached copy"""
+        with metrics.span('storage.write'):
+            self.backend.write(df)
+        self._invalidate_data()
+
+    def last_modified(self):
+        """datetime of the last write to the journal, or None if unknown"""
+        timestamp = self.backend.last_modified()
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+
+    def get_entry(self, row_id):
+        """Return one entry as a dict, or None if the id does not exist"""
+        entry = self.backend.get(row_id)
+        if entry is not None:
+            fields = self._cached_fields()[1]
+            for field_name, field_config in fields.items():
+                entry.setdefault(field_name, empty_value(field_config))
+        return entry
+
+    def add_entry(self, entry):
+        """Store a new entry, extending the cached frame rather than re-reading"""
+        self.add_entries(pd.DataFrame([entry]))
+
+    def add_entries(self, rows):
+        """Store a DataFrame of new entries in one write, extending the cached frame"""
+        if rows.empty:
+            return
+        fields_signature, fields = self._cached_fields()
+        with metrics.span('storage.write'):
+            appended = self.backend.append_rows(rows, fields)
+        if appended is None:
+            self._invalidate_data()
+            return
+
+        before, after, rows = appended
+        self._record_change(before, after, added=rows)
+        with self._lock:
+            cached = self._data
+        if cached is None or cached[0] != (before, fields_signature):
+            return
+
+        df = concat_typed(cached[1], rows.copy(deep=False), fields, ignore_index=self.backend.positional_ids)
+        df = apply_dtypes(ensure_fields(df, fields), fields)
+        with self._lock:
+            self._data = ((after, fields_signature), df)
+
+    def update_entry(self, row_id, entry, expected_version=None):
+        """Change one entry; returns False if the id does not exist"""
+        with metrics.span('storage.write'):
+            updated = self.backend.update(row_id, entry, self._cached_fields()[1], expected_version)
+        self._invalidate_data()
+        if updated is None:
+            return False
+        before, after, old_row = updated
+        self._record_change(before, after, old_row, old_row.assign(**entry))
+        return True
+
+    def delete_entry(self, row_id, expected_version=None):
+        """Remove one entry; returns False if the id does not exist"""
+        with metrics.span('storage.write'):
+            deleted = self.backend.delete(row_id, expected_version)
+        self._invalidate_data()
+        if deleted is None:
+            return False
+        before, after, old_row = deleted
+        self._record_change(before, after, removed=old_row)
+        return True
+
+    def add_field(self, field_name, field_config):
+        """Create the storage column for a newly configured field, where that is cheap"""
+        self.backend.add_column(field_name, field_config)
+        self._invalidate_data()
+
+    def compact(self, plan):
+        """Bring storage in line with a migrations.SchemaPlan; returns unconverted value counts"""
+        lost = self.backend.compact(plan)
+        self._invalidate_data()
+        return lost
+
+    def _invalidate_data(self):
+        with self._lock:
+            self._data = None
+            self._projections = {}
+
+    def invalidate(self):
+        """Forget everything cached so the next load re-reads from storage"""
+        with self._lock:
+            self._fields = None
+            self._data = None
+            self._projections = {}
@@ -0,0 +1,123 @@
+"""Filtering, column projection and paging for the journal listing
+
+Only the page being shown is turned into records for the template, so the
+listing costs the same whether the journal holds a month or decades.
+
+Number filters accept `7`, `3-7`, `>5`, `>=5`, `<5` or `<=5`; text filters
+match a case-insensitive substring.
+"""
+import operator
+import re
+
+import pandas as pd
+
+PER_PAGE_CHOICES = [25, 50, 100, 250]
+DEFAULT_PER_PAGE = 50
+# Per-field filters are passed as f_<field name>=<expression>
+FILTER_PREFIX = 'f_'
+
+_NUMBER = r'-?\d+(?:\.\d+)?'
+_COMPARISON = re.compile(rf'^(<=|>=|<|>|=)?\s*({_NUMBER})$')
+_RANGE = re.compile(rf'^({_NUMBER})\s*(?:-|\.\.)\s*({_NUMBER})$')
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+              '=': operator.eq, None: operator.eq}
+
+
+def parse_number_filter(text):
+    """Turn a number filter into [(operator, value)] conditions, or raise ValueError"""
+    text = text.strip()
+    match = _RANGE.match(text)
+    if match:
+        low, high = sorted(float(value) for value in match.groups())
+        return [(operator.ge, low), (operator.le, high)]
+    match = _COMPARISON.match(text)
+    if match:
+        return [(_OPERATORS[match.group(1)], float(match.group(2)))]
+    raise ValueError(f'Not a number filter: {text}')
+
+
+def parse_filters(fields, args):
+    """Read the f_<field> filters out of the query string
+
+    Returns (filters, invalid) where filters maps field name to the raw
+    expression and invalid lists the labels of filters that could not be
+    understood (they are left out).
+    """
+    filters, invalid = {}, []
+    for field_name, field_config in fields.items():
+        text = args.get(FILTER_PREFIX + field_name, '').strip()
+        if not text or field_config['type'] == 'date':
+            continue
+        if field_config['type'] == 'number':
+            try:
+                parse_number_filter(text)
+            except ValueError:
+                invalid.append(field_config['label'])
+                continue
+        filters[field_name] = text
+    return filters, invalid
+
+
+def filter_entries(df, fields, start=None, end=None, filters=None):
+    """Rows within [start, end] matching every filter, in journal order
+
+    Unparseable date bounds are ignored.
+    """
+    mask = pd.Series(True, index=df.index)
+    start = pd.to_datetime(start, errors='coerce') if start else pd.NaT
+    end = pd.to_datetime(end, errors='coerce') if end else pd.NaT
+    if not (pd.isna(start) and pd.isna(end)):
+        dates = pd.to_datetime(df['date'], errors='coerce')
+        if not pd.isna(start):
+            mask &= dates >= start
+        if not pd.isna(end):
+            mask &= dates <= end
+
+    for field_name, text in (filters or {}).items():
+        if field_name not in df.columns:
+            mask &= False
+        elif fields[field_name]['type'] == 'number':
+            values = pd.to_numeric(df[field_name], errors='coerce')
+            for compare, value in parse_number_filter(text):
+                mask &= compare(values, value).fillna(False)
+        else:
+            mask &= df[field_name].astype('string').str.contains(text, case=False, regex=False).fillna(False)
+    return df[mask]
+
+
+def project_fields(fields, columns):
+    """The fields to show as columns; the date is always kept"""
+    if not columns:
+        return fields
+    return {name: config for name, config in fields.items() if name in columns or config['type'] == 'date'}
+
+
+def display_value(value):
+    """None for missing values and whole floats as ints
+
+    float32 columns hold doses like 25 as 25.0, which would otherwise read
+    "25.0" where the journal says 25.
+    """
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def display_records(rows, columns):
+    """One page of rows as template records with a row_id each"""
+    rows = rows.reindex(columns=columns).astype(object)
+    return [dict(zip(columns, map(display_value, values)), row_id=row_id)
+            for row_id, values in zip(rows.index, rows.itertuples(index=False, name=None))]
+
+
+def paginate(df, page, per_page):
+    """Slice out one page; returns (rows, page, page count) with page clamped to range"""
+    pages = max(1, -(-len(df) // per_page))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * per_page
+    return df.iloc[start:start + per_page], page, pages
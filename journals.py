@@ -0,0 +1,110 @@
+"""Named journals served side by side from one process
+
+Each directory in JOURNALS_DIR is one journal, e.g. journals/anna/ with its
+own fields_config.json, entries (in the file STORAGE_BACKEND uses) and
+schema_migrations.json. The app serves it under /j/anna/.
+
+A Journal bundles one journal's DataStore with what is cached from it:
+prepared data for the graphs and reports, the search index, and the
+background compactor of its field changes. JournalRegistry opens
+journals on first use and keeps the max_open most recently used ones in
+memory. A journal that falls out is dropped with its caches and opened
+again when next asked for. Requests still using it finish with the copy
+they have.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import analytics
+import metrics
+import migrations
+import search
+
+NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9_-]{0,63}')
+
+
+class Journal:
+    """One journal's storage and everything cached from it
+
+    name and directory are None for the default journal, which keeps its
+    files where the app's settings say.
+    """
+
+    def __init__(self, name, directory, store, schema_log):
+        self.name = name
+        self.directory = directory
+        self.store = store
+        self.schema_log = schema_log
+        self.compactor = migrations.Compactor(schema_log, store)
+        self.prepared_cache = analytics.PreparedCache(store.changes)
+        self.search_index = search.SearchIndex()
+
+
+class JournalRegistry:
+    """LRU of the open journals in root
+
+    open_journal(name, directory) creates the Journal for a directory.
+    """
+
+    def __init__(self, root, open_journal, max_open=32):
+        self.root = root
+        self.open_journal = open_journal
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+
+    def directory(self, name):
+        return os.path.join(self.root, name)
+
+    def names(self):
+        """Names of every journal in root, sorted"""
+        try:
+            entries = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in entries if NAME.fullmatch(name) and os.path.isdir(self.directory(name)))
+
+    def get(self, name):
+        """The open journal called name, opening it if needed; None if there is no such journal"""
+        with self._lock:
+            journal = self._open.get(name)
+            if journal is not None:
+                self._open.move_to_end(name)
+                return journal
+        if not NAME.fullmatch(name) or not os.path.isdir(self.directory(name)):
+            return None
+
+        journal = self.open_journal(name, self.directory(name))
+        with self._lock:
+            # Another request may have opened it meanwhile: keep the first
+            journal = self._open.setdefault(name, journal)
+            self._open.move_to_end(name)
+            self.opened += 1
+            evicted = 0
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+                evicted += 1
+            self.evicted += evicted
+        metrics.count('journals_opened_total')
+        if evicted:
+            metrics.count('journals_evicted_total', evicted)
+        return journal
+
+    def create(self, name):
+        """Make the directory of a new journal; raises ValueError for a bad or taken name"""
+        if not NAME.fullmatch(name):
+            raise ValueError('Journal names are letters, digits, - and _ (up to 64), starting with a letter or digit.')
+        try:
+            os.makedirs(self.directory(name))
+        except FileExistsError:
+            raise ValueError(f'A journal named "{name}" already exists.') from None
+        return self.get(name)
+
+    def stats(self):
+        with self._lock:
+            return {'open': list(self._open), 'max_open': self.max_open, 'opened': self.opened,
+                    'evicted': self.evicted}
@@ -0,0 +1,202 @@
+"""Request and stage timings, storage byte counters and the /metrics text
+
+span('storage.read') times a block into the klinikum_stage_seconds
+histogram, labelled by stage; the app times every request into
+klinikum_request_seconds by endpoint, method and status. count() adds to
+a counter such as klinikum_storage_bytes_total. exposition() renders it
+all in the Prometheus text format.
+
+Each process keeps its own figures, so /metrics shows those of the
+gunicorn worker that answers it. Plot and PDF pool workers hand their
+spans back with their results (collect() and record()), which adds them
+to the figures of the worker that started the job.
+
+With METRICS_ENABLED=0 span() returns a shared no-op context and
+observe() and count() return at once.
+
+ProfilerMiddleware answers a request carrying ?profile=1 with a cProfile
+breakdown of it, and the spans it went through, instead of the response.
+"""
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import parse_qs
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+PREFIX = 'klinikum_'
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+HELP = {
+    'request_seconds': 'Time taken to answer a request',
+    'stage_seconds': 'Time spent in one stage of a request or background job',
+    'storage_bytes_total': 'Bytes of journal file read and written',
+    'journals_opened_total': 'Named journals loaded into memory',
+    'journals_evicted_total': 'Named journals dropped from memory as the least recently used',
+}
+# Functions listed by a ?profile=1 report, and the orders it can be sorted in
+PROFILE_LIMIT = 40
+PROFILE_SORTS = ('cumulative', 'tottime', 'calls')
+
+_NO_SPAN = nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_local = threading.local()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """Add one timing to histogram name"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # One count per bucket plus +Inf, then the sum
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+
+def count(name, value=1, **labels):
+    """Add value to counter name"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def span(name, **labels):
+    """Context manager timing a block as stage name"""
+    if not ENABLED:
+        return _NO_SPAN
+    return _timed(name, labels)
+
+
+@contextmanager
+def _timed(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('stage_seconds', elapsed, stage=name, **labels)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append((name, labels, elapsed))
+
+
+@contextmanager
+def collect():
+    """Gather the spans of the block into the list yielded, e.g. to send back from a worker"""
+    previous = getattr(_local, 'trace', None)
+    _local.trace = spans = []
+    try:
+        yield spans
+    finally:
+        _local.trace = previous
+
+
+def record(spans):
+    """Add spans gathered by collect() in another process"""
+    for name, labels, elapsed in spans:
+        observe('stage_seconds', elapsed, stage=name, **labels)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _header(lines, name, kind):
+    lines.append(f'# HELP {PREFIX}{name} {HELP.get(name, name)}')
+    lines.append(f'# TYPE {PREFIX}{name} {kind}')
+
+
+def exposition():
+    """Every counter and histogram of this process in the Prometheus text format"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        _header(lines, name, 'counter')
+        for (_, labels), value in sorted(item for item in counters.items() if item[0][0] == name):
+            lines.append(f'{PREFIX}{name}{_labels(labels)} {value}')
+    for name in sorted({name for name, _ in histograms}):
+        _header(lines, name, 'histogram')
+        for (_, labels), values in sorted(item for item in histograms.items() if item[0][0] == name):
+            cumulative = 0
+            for bound, bucket in zip([*BUCKETS, '+Inf'], values):
+                cumulative += bucket
+                lines.append(f'{PREFIX}{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {values[-1]}')
+            lines.append(f'{PREFIX}{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class ProfilerMiddleware:
+    """WSGI middleware returning a profile of any request made with ?profile=1
+
+    The report lists the spans the request went through, in order, then
+    the PROFILE_LIMIT most expensive functions (&sort=tottime or calls to
+    order them differently). Work done in the plot and PDF pools is not
+    part of it.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        if query.get('profile') != ['1']:
+            return self.wsgi_app(environ, start_response)
+        sort = query.get('sort', [PROFILE_SORTS[0]])[0]
+        if sort not in PROFILE_SORTS:
+            sort = PROFILE_SORTS[0]
+
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response['status'] = status
+            return lambda data: None
+
+        profiler = cProfile.Profile()
+        size = 0
+        with collect() as spans:
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                body = self.wsgi_app(environ, capture)
+                try:
+                    size = sum(len(chunk) for chunk in body)
+                finally:
+                    if hasattr(body, 'close'):
+                        body.close()
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+
+        out = io.StringIO()
+        out.write(f'{environ["REQUEST_METHOD"]} {environ.get("PATH_INFO", "")} -> {response.get("status")}, '
+                  f'{size} bytes in {elapsed * 1000:.1f} ms\n\nSpans\n')
+        for name, labels, seconds in spans:
+            label = ' '.join(f'{key}={value}' for key, value in labels.items())
+            out.write(f'  {seconds * 1000:>10.1f} ms  {name} {label}\n')
+        out.write(f'\nTop {PROFILE_LIMIT} functions by {sort}\n')
+        pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(PROFILE_LIMIT)
+        start_response('200 OK', [('Content-Type', 'text/plain; charset=utf-8'), ('Cache-Control', 'no-store')])
+        return [out.getvalue().encode()]
@@ -0,0 +1,195 @@
+"""Field changes carried over to the stored journal in the background
+
+Adding, deleting or retyping a field only saves fields_config.json and
+appends a migration to the log, so the request returns at once whatever
+the size of the journal. Reads see the new schema straight away: a new
+field reads as its empty value (datastore.ensure_fields), a retyped one
+is converted as it is loaded (datastore.apply_dtypes) and a deleted one
+is no longer used. A Compactor then brings the stored journal in line in
+a background thread: it materializes new columns, converts retyped ones
+and drops deleted ones, chunk by chunk (see the backends' compact()).
+
+The log is a JSON file next to the field configuration:
+
+    {"version": 3, "migrations": [{"version": 1, "action": "add",
+      "field": "stress", "config": {...}, "previous": null,
+      "created": 1761000000.0, "applied": 1761000002.5}, ...]}
+
+Its version counts the schema changes made so far.
+"""
+import copy
+import json
+import logging
+import threading
+import time
+
+from datastore import atomic_write, file_lock
+
+try:
+    import fcntl
+except ImportError:  # Windows: compactors in different processes are not kept apart
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ('add', 'delete', 'retype')
+
+
+class SchemaPlan:
+    """Storage changes owed by a run of pending migrations
+
+    drop lists columns to remove; add and convert map a field to the
+    config its column is to be created with or converted to. A field that
+    is configured again is never dropped.
+    """
+
+    def __init__(self, migrations, fields):
+        self.drop, self.add, self.convert = [], {}, {}
+        for migration in migrations:
+            name = migration['field']
+            if migration['action'] == 'add':
+                self.add[name] = migration['config']
+            elif migration['action'] == 'delete':
+                self.add.pop(name, None)
+                self.convert.pop(name, None)
+                self.drop.append(name)
+            elif name in self.add:
+                self.add[name] = migration['config']
+            else:
+                self.convert[name] = migration['config']
+        self.drop = [name for name in dict.fromkeys(self.drop) if name not in fields]
+
+    def __bool__(self):
+        return bool(self.drop or self.add or self.convert)
+
+
+class MigrationLog:
+    """The versioned record of field changes and whether storage has caught up"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'version': 0, 'migrations': []}
+
+    def _update(self, change):
+        with file_lock(self.path):
+            log = self.read()
+            result = change(log)
+            atomic_write(self.path, lambda f: json.dump(log, f, indent=2, ensure_ascii=False))
+        return result
+
+    def record(self, action, field_name, config=None, previous=None):
+        """Log a field change; returns the new schema version"""
+        if action not in ACTIONS:
+            raise ValueError(f'Unknown migration: {action}')
+
+        def append(log):
+            log['version'] += 1
+            log['migrations'].append({'version': log['version'], 'action': action, 'field': field_name,
+                                      'config': copy.deepcopy(config), 'previous': copy.deepcopy(previous),
+                                      'created': time.time(), 'applied': None})
+            return log['version']
+        return self._update(append)
+
+    def version(self):
+        return self.read()['version']
+
+    def pending(self):
+        """Migrations storage has not caught up with yet, oldest first"""
+        return [migration for migration in self.read()['migrations'] if migration['applied'] is None]
+
+    def pending_delete(self, field_name):
+        """Whether a deleted field's column is still waiting to be dropped"""
+        return any(migration['action'] == 'delete' and migration['field'] == field_name
+                   for migration in self.pending())
+
+    def mark_applied(self, versions, lost=None, error=None):
+        """Mark migrations as carried over, noting values that could not be converted
+
+        With error, they stay pending and the error is noted instead.
+        """
+        lost = lost or {}
+
+        def mark(log):
+            for migration in log['migrations']:
+                if migration['version'] not in versions:
+                    continue
+                if error is not None:
+                    migration['error'] = error
+                    continue
+                migration.pop('error', None)
+                migration['applied'] = time.time()
+                if migration['action'] == 'retype' and lost.get(migration['field']):
+                    migration['unconverted'] = lost[migration['field']]
+        self._update(mark)
+
+
+class Compactor:
+    """Carries pending migrations over to storage in a background thread
+
+    One thread per process, and one process at a time: the others leave
+    the work to whichever holds <log>.compact.
+    """
+
+    def __init__(self, log, store):
+        self.log = log
+        self.store = store
+        self._lock = threading.Lock()
+        self._thread = None
+        self._again = False
+
+    def start(self):
+        """Run the pending migrations in the background unless already running"""
+        with self._lock:
+            if self._thread is not None:
+                self._again = True
+                return
+            self._thread = threading.Thread(target=self._run_in_thread, name='schema-compactor', daemon=True)
+            self._thread.start()
+
+    def _run_in_thread(self):
+        while True:
+            try:
+                self.run()
+            except Exception:
+                logger.exception('Schema compaction failed')
+            with self._lock:
+                if not self._again:
+                    self._thread = None
+                    return
+                self._again = False
+
+    def run(self):
+        """Carry every pending migration over to storage; returns how many were applied"""
+        if fcntl is None:
+            return self._apply_pending()
+        with open(self.log.path + '.compact', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                return self._apply_pending()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _apply_pending(self):
+        applied = 0
+        while True:
+            pending = self.log.pending()
+            if not pending:
+                return applied
+            versions = [migration['version'] for migration in pending]
+            plan = SchemaPlan(pending, self.store.load_fields())
+            try:
+                lost = self.store.compact(plan) if plan else {}
+            except Exception as e:
+                self.log.mark_applied(versions, error=str(e))
+                raise
+            self.log.mark_applied(versions, lost)
+            applied += len(versions)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+import metrics
+import plots
+from datastore import atomic_write, file_lock
+from plot_renderer import process_pool
+
+# Bump when the report layout changes so older PDFs are not reused
+REPORT_VERSION = 2
+# As pdf_report.DEFAULT_NOTE_FIELDS: pdf_report, and reportlab with it, is
+# only imported by the processes building the reports
+DEFAULT_NOTE_FIELDS = ('notes',)
+# Seconds between progress writes to a status file: each one is fsync'ed
+PROGRESS_INTERVAL = 0.5
+
+
+def report_fingerprint(df, fields, renderer, note_fields):
+    """Hash of everything that ends up in the report"""
+    digest = hashlib.sha1()
+    digest.update(repr((REPORT_VERSION, renderer, list(note_fields), plots.THEME_NAME, list(df.columns))).encode())
+    digest.update(json.dumps(fields, sort_keys=True).encode())
+    digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def read_status(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_status(path, status):
+    status['updated'] = time.time()
+    atomic_write(path, lambda f: json.dump(status, f))
+
+
+def _build_in_worker(status_path, pdf_path, df, fields, renderer, note_fields, summary):
+    """Build one report, recording progress in its status file; returns the metrics spans"""
+    import pdf_report
+    status = read_status(status_path) or {}
+    status.update(state='running', rows=0, rows_total=len(df), pages=0)
+    write_status(status_path, status)
+
+    written = time.monotonic()
+
+    def progress(**counts):
+        nonlocal written
+        status.update(counts)  # the final write below records the last counts
+        if time.monotonic() - written >= PROGRESS_INTERVAL:
+            write_status(status_path, status)
+            written = time.monotonic()
+
+    try:
+        tmp_path = pdf_path + f'.{os.getpid()}.tmp'
+        with metrics.collect() as spans:
+            pdf_report.build_report(df, fields, tmp_path, renderer, progress, note_fields, summary)
+        os.replace(tmp_path, pdf_path)
+    except Exception as e:
+        status.update(state='failed', error=str(e))
+        write_status(status_path, status)
+        raise
+    status.update(state='done', finished=time.time())
+    write_status(status_path, status)
+    return spans
+
+
+class PDFJobs:
+    """PDF exports built in the background, one file per distinct journal
+
+    A job's id is the fingerprint of the data it reports on, so exporting
+    an unchanged journal again returns the finished PDF at once. Job state
+    lives in <id>.json next to <id>.pdf in export_dir, which every gunicorn
+    worker can read whichever of them started the job.
+
+    Finished reports are kept while they fit in max_bytes and are younger
+    than max_age seconds; older ones are evicted least recently used first
+    whenever a job is submitted or finishes. The newest report is always kept, so the
+    directory holds at most max(max_bytes, newest report) plus the reports
+    being built.
+    """
+
+    def __init__(self, export_dir, workers=1, stale_after=600, max_bytes=200 * 1024 * 1024,
+                 max_age=7 * 24 * 3600):
+        self.export_dir = export_dir
+        self.workers = workers
+        self.stale_after = stale_after
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._executor = None
+        self._lock = threading.Lock()
+        # Serialises starting and evicting jobs across gunicorn workers
+        self._jobs_lock = os.path.join(export_dir, 'jobs')
+        os.makedirs(export_dir, exist_ok=True)
+
+    def _get_executor(self):
+        # Created lazily so each gunicorn worker builds its own after fork
+        if self._executor is None:
+            self._executor = process_pool(self.workers)
+        return self._executor
+
+    def status_path(self, job_id):
+        return os.path.join(self.export_dir, f'{job_id}.json')
+
+    def pdf_path(self, job_id):
+        return os.path.join(self.export_dir, f'{job_id}.pdf')
+
+    def _is_live(self, status):
+        """Whether a queued or running job is still making progress"""
+        if status['state'] not in ('queued', 'running'):
+            return False
+        return time.time() - status['updated'] < self.stale_after
+
+    def submit(self, df, fields, renderer, note_fields=DEFAULT_NOTE_FIELDS, summary=None):
+        """Start a report for df unless an identical one exists or is underway; returns the job id"""
+        self.evict()
+        job_id = report_fingerprint(df, fields, renderer, note_fields)
+        status_path = self.status_path(job_id)
+        with self._lock, file_lock(self._jobs_lock):
+            status = read_status(status_path)
+            if status is not None:
+                if status['state'] == 'done' and os.path.exists(self.pdf_path(job_id)):
+                    return job_id
+                if self._is_live(status):
+                    return job_id
+            write_status(status_path, {'id': job_id, 'state': 'queued', 'rows': 0, 'rows_total': len(df),
+                                       'pages': 0, 'created': time.time()})
+
+        future = self._get_executor().submit(_build_in_worker, status_path, self.pdf_path(job_id),
+                                             df, fields, renderer, list(note_fields), summary)
+
+        def done(finished):
+            if finished.cancelled():
+                pass
+            elif finished.exception() is None:
+                metrics.record(finished.result())
+            else:
+                # A worker that died never got to record the failure itself
+                status = read_status(status_path) or {'id': job_id}
+                if status.get('state') != 'failed':
+                    status.update(state='failed', error=str(finished.exception()))
+                    write_status(status_path, status)
+            self.evict()
+
+        future.add_done_callback(done)
+        return job_id
+
+    def status(self, job_id):
+        """The job's status dict, or None for an unknown job"""
+        status = read_status(self.status_path(job_id))
+        if status is None:
+            return None
+        if status['state'] in ('queued', 'running') and not self._is_live(status):
+            status.update(state='failed', error='The export stopped responding. Please start it again.')
+        elif status['state'] == 'done' and not os.path.exists(self.pdf_path(job_id)):
+            status.update(state='failed', error='The report has expired. Please export it again.')
+        return status
+
+    def touch(self, job_id):
+        """Mark a report as recently used so eviction keeps it longer"""
+        try:
+            os.utime(self.pdf_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def disk_usage(self):
+        """Bytes taken by everything in export_dir"""
+        total = 0
+        for entry in os.scandir(self.export_dir):
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def evict(self):
+        """Delete expired and least recently used reports beyond max_bytes
+
+        Also clears out what crashed jobs left behind: failed or dead status
+        files and half-written PDFs older than stale_after.
+        """
+        now = time.time()
+        reports = []
+        for entry in os.scandir(self.export_dir):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.pdf'):
+                reports.append((st.st_mtime, st.st_size, entry.name[:-len('.pdf')]))
+            elif entry.name.endswith('.tmp') and now - st.st_mtime > self.stale_after:
+                self._remove(entry.path)
+            elif entry.name.endswith('.json'):
+                status = read_status(entry.path)
+                if status is None or (status['state'] != 'done' and not self._is_live(status)
+                                      and now - status['updated'] > self.stale_after):
+                    self._discard(entry.name[:-len('.json')])
+
+        reports.sort(reverse=True)  # newest first
+        kept = 0
+        for position, (mtime, size, job_id) in enumerate(reports):
+            if position and (kept + size > self.max_bytes or now - mtime > self.max_age):
+                self._discard(job_id)
+            else:
+                kept += size
+
+    def _discard(self, job_id):
+        status_path = self.status_path(job_id)
+        with file_lock(self._jobs_lock):
+            status = read_status(status_path)
+            if status is not None and self._is_live(status):
+                return  # re-submitted in the meantime
+            self._remove(self.pdf_path(job_id))
+            self._remove(status_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
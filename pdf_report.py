@@ -0,0 +1,259 @@
+"""The PDF report: summary statistics, graphs and the daily notes
+
+Built by the export job in a worker process (see pdf_jobs.py), so nothing
+here touches Flask.
+"""
+import io
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+import matplotlib.pyplot as plt
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, PageBreak, Table, TableStyle
+
+import analytics
+import metrics
+import plot_drawing
+import plots
+
+# Daily Notes rows between two progress reports
+PROGRESS_EVERY = 500
+DEFAULT_NOTE_FIELDS = ('notes',)
+
+
+def no_progress(**counts):
+    pass
+
+
+def escape_markup(values):
+    """Escape a Series of free text for Paragraph markup, keeping line breaks"""
+    # Cast first: a categorical text field cannot take '' as a new value
+    return (values.astype('string').fillna('').str.strip()
+            .str.replace('&', '&amp;', regex=False)
+            .str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False)
+            .str.replace('\n', '<br/>', regex=False))
+
+
+def daily_notes(df, fields, note_fields=DEFAULT_NOTE_FIELDS):
+    """(date, [paragraph markup]) for every entry, built column-wise
+
+    Each non-empty note field becomes one paragraph, prefixed with its
+    label when there is more than one field; an entry without any gets
+    "No notes".
+    """
+    texts = []
+    labelled = len(note_fields) > 1
+    for name in note_fields:
+        if name in df.columns:
+            text = escape_markup(df[name])
+            if labelled:
+                label = escape(fields.get(name, {}).get('label', name))
+                text = (label + ': ' + text).where(text != '', '')
+            texts.append(text.tolist())
+    dates = df['date'].dt.strftime('%B %d, %Y').tolist()
+    return [(date, [text for text in entry if text] or ['No notes'])
+            for date, entry in zip(dates, zip(*texts) if texts else [()] * len(dates))]
+
+
+def build_story(df, fields, renderer='seaborn', progress=no_progress, note_fields=DEFAULT_NOTE_FIELDS,
+                summary=None):
+    """ReportLab flowables for a journal prepared by analytics.prepare"""
+    story = []
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#2c3e50'),
+        spaceAfter=30,
+        alignment=1  # Center
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=16,
+        textColor=colors.HexColor('#37b24d'),
+        spaceAfter=12,
+        spaceBefore=12
+    )
+
+    # Title
+    story.append(Paragraph("Medical Recovery Report", title_style))
+    story.append(Paragraph(f"Generated: {datetime.now().strftime('%B %d, %Y at %H:%M')}", styles['Normal']))
+    story.append(Paragraph(f"Total Entries: {len(df)}", styles['Normal']))
+    story.append(Paragraph(f"Date Range: {df['date'].min().strftime('%Y-%m-%d')} to {df['date'].max().strftime('%Y-%m-%d')}", styles['Normal']))
+    story.append(Spacer(1, 0.5*inch))
+
+    # Note to Readers
+    note_style = ParagraphStyle(
+        'NoteStyle',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#333333'),
+        spaceAfter=8,
+        leftIndent=20,
+        rightIndent=20,
+        alignment=4  # Justify
+    )
+
+    note_title_style = ParagraphStyle(
+        'NoteTitleStyle',
+        parent=styles['Heading3'],
+        fontSize=12,
+        textColor=colors.HexColor('#000000'),
+        spaceAfter=10,
+        fontName='Helvetica-Bold'
+    )
+
+    story.append(Paragraph("Note to Readers", note_title_style))
+    story.append(Paragraph(
+        "This data is subjective and reflects how I felt. This report is a personal and analytical reflection on my time in the Klinikum. "
+        "It combines information drawn from memory, journals, WhatsApp conversations, and available medical data to trace the patterns of my mental state during recovery.",
+        note_style
+    ))
+    story.append(Paragraph(
+        "The intention behind this work is not to diagnose or justify, but to understand — to recognize how sleep, medication, thought patterns, and emotional changes interacted across days and weeks.",
+        note_style
+    ))
+    story.append(Paragraph(
+        "While I have taken care to ensure the accuracy of data and interpretation, this report remains deeply personal and subjective in nature. "
+        "Some parts were reconstructed retrospectively and may not perfectly represent medical reality, but they reflect my lived experience as faithfully as possible.",
+        note_style
+    ))
+    story.append(Paragraph(
+        "Readers are encouraged to approach this document with empathy and respect, keeping in mind that mental health is complex, non-linear, and often resistant to tidy explanations. "
+        "What follows is not just data — it's the story of a mind learning to make sense of itself.",
+        note_style
+    ))
+    story.append(Spacer(1, 0.3*inch))
+
+    # Summary Statistics
+    story.append(Paragraph("Summary Statistics", heading_style))
+
+    if summary is None:
+        summary = analytics.summary_stats(df, fields)
+    summary_data = [['Metric', 'Average', 'Min', 'Max']]
+    summary_data += [[stats.label, f"{stats.mean:.1f}", f"{stats.min:.0f}", f"{stats.max:.0f}"]
+                     for stats in summary.itertuples()]
+
+    summary_table = Table(summary_data)
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#37b24d')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(summary_table)
+    story.append(PageBreak())
+
+    # Generate and add graphs
+    story.append(Paragraph("Visualizations", heading_style))
+    story.append(Spacer(1, 0.2*inch))
+
+    # Graph 1: Mood/Panic/Headache
+    if all(col in df.columns for col in ['mood_score', 'panic_intensity', 'headache_intensity']):
+        with metrics.span('pdf.graph', graph='symptoms'):
+            fig, ax = plt.subplots(figsize=(7,4))
+            plot_drawing.line(ax, df, 'mood_score', renderer, label='Mood', color='#000', lw=2, marker='o')
+            plot_drawing.line(ax, df, 'panic_intensity', renderer, label='Panic', color='#000', lw=2, ls='--', marker='s')
+            plot_drawing.line(ax, df, 'headache_intensity', renderer, label='Headache', color='#666', lw=2, ls=':', marker='^')
+            ax.set_title('Core Symptoms', fontweight='bold')
+            ax.legend()
+            fig.tight_layout()
+
+            img_buffer = io.BytesIO()
+            fig.savefig(img_buffer, format='png', dpi=plots.DPI, bbox_inches='tight')
+            img_buffer.seek(0)
+            story.append(RLImage(img_buffer, width=6*inch, height=3.5*inch))
+            plt.close(fig)
+        story.append(Spacer(1, 0.2*inch))
+
+    # Graph 2: Sleep
+    if 'sleep_hours' in df.columns:
+        with metrics.span('pdf.graph', graph='sleep'):
+            fig, ax = plt.subplots(figsize=(7,4))
+            plot_drawing.line(ax, df, 'sleep_hours', renderer, color='#000', lw=2, marker='o')
+            ax.axhline(y=7, color='#666', linestyle='--', linewidth=2, label='Recommended')
+            ax.set_title('Sleep Pattern', fontweight='bold')
+            ax.legend()
+            fig.tight_layout()
+
+            img_buffer = io.BytesIO()
+            fig.savefig(img_buffer, format='png', dpi=plots.DPI, bbox_inches='tight')
+            img_buffer.seek(0)
+            story.append(RLImage(img_buffer, width=6*inch, height=3.5*inch))
+            plt.close(fig)
+        story.append(PageBreak())
+
+    # Daily Notes
+    story.append(Paragraph("Daily Notes", heading_style))
+    story.append(Spacer(1, 0.1*inch))
+
+    # Bold through the style rather than <b> markup and the gap below each
+    # entry as spaceAfter rather than a Spacer: every paragraph is a single
+    # run of text, which ReportLab lays out on its fast path
+    date_style = ParagraphStyle('NoteDateStyle', parent=styles['Normal'], fontName='Helvetica-Bold')
+    note_style = ParagraphStyle('NoteTextStyle', parent=styles['Normal'])
+    last_note_style = ParagraphStyle('LastNoteTextStyle', parent=note_style, spaceAfter=0.15*inch)
+    with metrics.span('pdf.notes'):
+        for done, (date_str, notes) in enumerate(daily_notes(df, fields, note_fields), 1):
+            story.append(Paragraph(date_str, date_style))
+            for note_text in notes[:-1]:
+                story.append(Paragraph(note_text, note_style))
+            story.append(Paragraph(notes[-1], last_note_style))
+            if done % PROGRESS_EVERY == 0:
+                progress(rows=done)
+    progress(rows=len(df))
+
+    # Footer
+    story.append(PageBreak())
+    footer_style = ParagraphStyle(
+        'FooterStyle',
+        parent=styles['Normal'],
+        fontSize=9,
+        textColor=colors.HexColor('#666666'),
+        alignment=1  # Center
+    )
+    story.append(Spacer(1, 1*inch))
+    story.append(Paragraph("Generated with care and introspection", footer_style))
+    story.append(Paragraph(f"Data period: {df['date'].min().strftime('%B %Y')} - {df['date'].max().strftime('%B %Y')}", footer_style))
+    # Uncomment and modify the line below to add a link
+    # story.append(Paragraph('<link href="https://your-website.com">Additional Resources</link>', footer_style))
+
+    return story
+
+
+def build_report(df, fields, out, renderer='seaborn', progress=no_progress, note_fields=DEFAULT_NOTE_FIELDS,
+                 summary=None):
+    """Write the PDF report to out (a path or binary file object)
+
+    note_fields are the free-text fields listed under Daily Notes; summary
+    is analytics.summary_stats(df, fields) if already computed.
+    progress(rows=n) is called while the notes are laid out and
+    progress(pages=n) after each page is drawn.
+    """
+    plot_drawing.apply_theme()
+    try:
+        with metrics.span('pdf.story'):
+            story = build_story(df, fields, renderer, progress, note_fields, summary)
+    finally:
+        plt.close('all')  # Clean up any figures
+
+    def page_done(canvas, doc):
+        progress(pages=canvas.getPageNumber())
+
+    with metrics.span('pdf.layout'):
+        SimpleDocTemplate(out, pagesize=A4).build(story, onFirstPage=page_done, onLaterPages=page_done)
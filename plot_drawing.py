@@ -0,0 +1,226 @@
+"""Drawing the plots in the catalogue (plots.py) with matplotlib and seaborn
+
+Importing this module loads matplotlib, pyplot and seaborn, which take
+longer than the rest of the app together, so it is only imported once a
+plot is actually drawn: by plots.render_plot(), the plot workers and the
+PDF report.
+"""
+import io
+
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+
+import aggregation
+import metrics
+from analytics import MED_COLS
+from plots import DPI, RECENT_DAYS, THEME, TREND_WINDOWS, WELLNESS_LINES, custom_numeric_fields, series
+
+
+_theme_applied = False
+
+
+def apply_theme():
+    """Set the theme once per process; every figure is drawn under it"""
+    global _theme_applied
+    if not _theme_applied:
+        sns.set_theme(style="whitegrid", rc=THEME)
+        _theme_applied = True
+
+
+def line(ax, df, col, renderer, **style):
+    """Draw df[col] against date on ax, with its min/max band when bucketed"""
+    dates, values = series(df, col)
+    low, high = col + aggregation.BAND_SUFFIXES[0], col + aggregation.BAND_SUFFIXES[1]
+    if low in df.columns and high in df.columns:
+        ax.fill_between(df['date'].to_numpy(), df[low].to_numpy(dtype=float), df[high].to_numpy(dtype=float),
+                        color=style.get('color'), alpha=0.15, linewidth=0)
+    if renderer == 'fast':
+        # seaborn's default marker outline, so both renderers look alike
+        style.setdefault('markeredgecolor', 'w')
+        style.setdefault('markeredgewidth', 0.75)
+        ax.plot(dates, values, **style)
+    elif len(dates) < len(df):
+        sns.lineplot(x=dates, y=values, ax=ax, **style)
+    else:
+        sns.lineplot(df, x='date', y=col, ax=ax, **style)
+
+
+def bar(ax, df, col, renderer, **style):
+    """Draw df[col] as one bar per date (or per bucket) on ax"""
+    if renderer == 'fast':
+        dates, values = series(df, col)
+        spacing = np.median(np.diff(dates).astype('timedelta64[s]').astype(float)) / 86400 if len(dates) > 1 else 1
+        ax.bar(dates, values, width=0.8 * spacing, **style)
+    else:
+        sns.barplot(df, x='date', y=col, ax=ax, **style)
+
+
+def figure_bytes(fig, fmt='png', dpi=DPI):
+    """Render a figure to PNG/SVG bytes and release it"""
+    img = io.BytesIO()
+    fig.savefig(img, format=fmt, bbox_inches='tight', dpi=dpi)
+    plt.close(fig)
+    return img.getvalue()
+
+
+def build_symptoms(df, fields, renderer):
+    fig1, ax1 = plt.subplots(figsize=(12,6))
+    line(ax1, df, 'mood_score', renderer, label='Mood', color='#000', lw=2.5, marker='o')
+    line(ax1, df, 'panic_intensity', renderer, label='Panic', color='#000', lw=2.5, ls='--', marker='s')
+    line(ax1, df, 'headache_intensity', renderer, label='Headache', color='#666', lw=2.5, ls=':', marker='^')
+    ax1.set_title('Mood, Panic, and Headache Over Time', fontsize=14, fontweight='bold')
+    ax1.set_xlabel('Date'); ax1.set_ylabel('Score (1-10)')
+    ax1.legend(); fig1.tight_layout()
+    return fig1
+
+
+def build_medications(df, fields, renderer):
+    med_cols = [col for col in MED_COLS if col in df.columns]
+    fig2, ax2 = plt.subplots(figsize=(12,6))
+    colors_bw = ['#000', '#333', '#666', '#999']
+    markers = ['o', 's', '^', 'D']
+    linestyles = ['-', '--', '-.', ':']
+    for i, col in enumerate(med_cols):
+        line(ax2, df, col, renderer, lw=2.5, label=f'Med {i+1}',
+             color=colors_bw[i], marker=markers[i], linestyle=linestyles[i])
+    ax2.set_title('Medication Dosages Over Time', fontsize=14, fontweight='bold')
+    ax2.set_xlabel('Date'); ax2.set_ylabel('Dosage (mg)')
+    ax2.legend(); fig2.tight_layout()
+    return fig2
+
+
+def build_headache_meds(df, fields, renderer):
+    fig3, ax3 = plt.subplots(figsize=(12,6))
+    ax3_twin = ax3.twinx()
+    line(ax3, df, 'headache_intensity', renderer, label='Headache',
+         color='#000', lw=2.5, marker='o')
+    line(ax3_twin, df, 'total_med_mg', renderer, label='Total Medication',
+         color='#666', lw=2.5, ls='--', marker='s')
+    ax3.set_title('Headache vs Total Medication', fontsize=14, fontweight='bold')
+    ax3.set_xlabel('Date')
+    ax3.set_ylabel('Headache Intensity', color='#000')
+    ax3_twin.set_ylabel('Total Medication (mg)', color='#666')
+    ax3.legend(loc='upper left'); ax3_twin.legend(loc='upper right')
+    fig3.tight_layout()
+    return fig3
+
+
+def build_wellness(df, fields, renderer):
+    fig4, ax4 = plt.subplots(figsize=(12,6))
+    for col, label, color, marker, ls in WELLNESS_LINES:
+        if col in df.columns:
+            line(ax4, df, col, renderer, label=label, color=color, lw=2.5, marker=marker, linestyle=ls)
+    ax4.set_title('Wellness Metrics Over Time', fontsize=14, fontweight='bold')
+    ax4.set_xlabel('Date'); ax4.set_ylabel('Score (1-10)')
+    ax4.legend(); fig4.tight_layout()
+    return fig4
+
+
+def build_sleep(df, fields, renderer):
+    fig5, ax5 = plt.subplots(figsize=(12,6))
+    line(ax5, df, 'sleep_hours', renderer, color='#000', lw=2.5, marker='o')
+    ax5.axhline(y=7, color='#666', linestyle='--', linewidth=2, label='Recommended (7h)')
+    ax5.set_title('Sleep Pattern', fontsize=14, fontweight='bold')
+    ax5.set_xlabel('Date'); ax5.set_ylabel('Hours')
+    ax5.legend(); fig5.tight_layout()
+    return fig5
+
+
+def heatmap(corr, title, figsize=(10,8)):
+    fig, ax = plt.subplots(figsize=figsize)
+    sns.heatmap(corr, annot=True, cmap='Greys', center=0, fmt='.2f', ax=ax,
+                square=True, linewidths=2, linecolor='#000', cbar=True)
+    ax.set_title(title, fontsize=14, fontweight='bold')
+    return fig, ax
+
+
+def build_correlation(df, fields, renderer):
+    fig6, _ = heatmap(df, 'Correlation Matrix')
+    fig6.tight_layout()
+    return fig6
+
+
+def build_exercise(df, fields, renderer):
+    fig7, ax7 = plt.subplots(figsize=(12,6))
+    bar(ax7, df, 'exercise_minutes', renderer, color='#000', edgecolor='#000', linewidth=1.5)
+    ax7.set_title('Exercise Activity', fontsize=14, fontweight='bold')
+    ax7.set_xlabel('Date'); ax7.set_ylabel('Minutes')
+    ax7.tick_params(axis='x', rotation=45)
+    fig7.tight_layout()
+    return fig7
+
+
+def build_hope_mood(df, fields, renderer):
+    fig8, ax8 = plt.subplots(figsize=(12,6))
+    line(ax8, df, 'mood_score', renderer, label='Mood', color='#000', lw=2.5, marker='o')
+    line(ax8, df, 'hope_score', renderer, label='Hope', color='#666', lw=2.5, marker='s', linestyle='--')
+    ax8.set_title('Mood vs Hope Score', fontsize=14, fontweight='bold')
+    ax8.set_xlabel('Date'); ax8.set_ylabel('Score (1-10)')
+    ax8.legend(); fig8.tight_layout()
+    return fig8
+
+
+def build_die_thoughts(df, fields, renderer):
+    fig9, ax9 = plt.subplots(figsize=(12,6))
+    line(ax9, df, 'die_thoughts', renderer, color='#000', lw=3, marker='o', markersize=8)
+    ax9.fill_between(df['date'], df['die_thoughts'], alpha=0.2, color='#000')
+    ax9.set_title('Death Thoughts Intensity Over Time', fontsize=14, fontweight='bold')
+    ax9.set_xlabel('Date'); ax9.set_ylabel('Intensity (0-10)')
+    ax9.axhline(y=5, color='#666', linestyle='--', linewidth=1.5, alpha=0.5, label='Moderate Level')
+    ax9.legend(); fig9.tight_layout()
+    return fig9
+
+
+def build_custom(df, fields, renderer):
+    fig10, ax10 = plt.subplots(figsize=(12,6))
+    for field_name, field_label in custom_numeric_fields(df, fields):
+        line(ax10, df, field_name, renderer, label=field_label, lw=2.5, marker='o')
+    ax10.set_title('Custom Metrics Over Time', fontsize=14, fontweight='bold')
+    ax10.set_xlabel('Date'); ax10.set_ylabel('Value')
+    ax10.legend(); fig10.tight_layout()
+    return fig10
+
+
+TREND_LINES = [('mood_score', 'Mood', '#000'), ('panic_intensity', 'Panic', '#333'),
+               ('headache_intensity', 'Headache', '#666')]
+
+
+def build_trends(df, fields, renderer):
+    fig11, ax11 = plt.subplots(figsize=(12,6))
+    short, long = TREND_WINDOWS
+    for col, label, color in TREND_LINES:
+        if f'{col}_{long}d' in df.columns:
+            line(ax11, df, f'{col}_{short}d', renderer, label=f'{label} ({short}-day)', color=color, lw=1, ls=':')
+            line(ax11, df, f'{col}_{long}d', renderer, label=f'{label} ({long}-day)', color=color, lw=2.5)
+    ax11.set_title('Rolling Averages', fontsize=14, fontweight='bold')
+    ax11.set_xlabel('Date'); ax11.set_ylabel('Score (1-10)')
+    ax11.legend(); fig11.tight_layout()
+    return fig11
+
+
+def build_recent_correlation(df, fields, renderer):
+    fig12, _ = heatmap(df, f'Correlation Matrix, Last {RECENT_DAYS} Days (daily means)')
+    fig12.tight_layout()
+    return fig12
+
+
+def build_lagged(df, fields, renderer):
+    fig13, ax13 = heatmap(df, 'Medication Today vs Next Day', figsize=(12,5))
+    ax13.set_xlabel('Next day'); ax13.set_ylabel('Today')
+    fig13.tight_layout()
+    return fig13
+
+
+def render_plot(spec, df, fields, fmt='png', dpi=DPI, renderer='seaborn'):
+    """Draw one plot and return the encoded image bytes"""
+    apply_theme()
+    try:
+        with metrics.span('plot.draw', plot=spec.plot_id):
+            fig = globals()[spec.build](df, fields, renderer)
+        with metrics.span('plot.savefig', plot=spec.plot_id):
+            return figure_bytes(fig, fmt=fmt, dpi=dpi)
+    finally:
+        plt.close('all')  # Clean up any figures
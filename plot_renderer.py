@@ -0,0 +1,112 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+import plots
+
+
+def process_pool(workers, initializer=None):
+    """A pool of worker processes started from the forkserver where there is one
+
+    Forked from a clean server process rather than from a threaded web
+    worker; app.preload() has the server import the drawing code.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(workers, mp_context=context, initializer=initializer)
+
+
+def _init_worker():
+    # Loads matplotlib (Agg) and seaborn unless the forkserver preloaded them
+    plots.apply_theme()
+
+
+def _render_in_worker(plot_id, df, fields, fmt, dpi, renderer):
+    """The image bytes and the metrics spans of drawing them"""
+    with metrics.collect() as spans:
+        data = plots.render_plot(plots.PLOTS_BY_ID[plot_id], df, fields, fmt=fmt, dpi=dpi, renderer=renderer)
+    return data, spans
+
+
+class PlotRenderer:
+    """Renders plots through the plot cache, optionally on a process pool
+
+    matplotlib is not thread-safe, so concurrency comes from a pool of warm
+    worker processes (matplotlib, seaborn and the theme loaded once per
+    process). Each job ships only the plot id and the columns that plot
+    reads. A render already in flight is shared rather than started twice.
+    With workers=0 plots are drawn one at a time in the calling process.
+    """
+
+    def __init__(self, cache, workers=0, timeout=60, renderer='seaborn'):
+        self.cache = cache
+        self.renderer = renderer
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._inline_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so each gunicorn worker builds its own after fork
+        if self._executor is None:
+            self._executor = process_pool(self.workers, _init_worker)
+        return self._executor
+
+    def _submit(self, key, spec, df, fields, fmt):
+        """Start rendering key unless it is cached or already running"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None or key in self.cache:
+                return future
+            frame = plots.plot_frame(df, spec.columns(df, fields))
+            future = self._get_executor().submit(_render_in_worker, spec.plot_id, frame,
+                                                 fields, fmt, plots.DPI, self.renderer)
+            self._in_flight[key] = future
+
+        def done(finished):
+            try:
+                if not finished.cancelled() and finished.exception() is None:
+                    data, spans = finished.result()
+                    self.cache.put(key, data)
+                    metrics.record(spans)
+            finally:
+                # Even if caching failed: a dead future left here would be waited on forever
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+        future.add_done_callback(done)
+        return future
+
+    def prefetch(self, jobs):
+        """Start rendering every missing (key, spec, df, fields, fmt) job without waiting"""
+        if self.workers:
+            for job in jobs:
+                self._submit(*job)
+
+    def render(self, key, spec, df, fields, fmt):
+        """Return the image bytes for key, waiting at most timeout seconds
+
+        Raises concurrent.futures.TimeoutError if the plot is not ready in time.
+        """
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        if not self.workers:
+            with self._inline_lock:
+                data = plots.render_plot(spec, df, fields, fmt=fmt, renderer=self.renderer)
+            self.cache.put(key, data)
+            return data
+
+        future = self._submit(key, spec, df, fields, fmt)
+        if future is None:  # finished between the cache check and the submit
+            return self.cache.get(key)
+        return future.result(timeout=self.timeout)[0]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,256 @@
+"""Plot catalogue for the graphs page
+
+Each plot is a PlotSpec: a stable id, a title, a function naming the input
+columns it reads (or None when the plot does not apply to the data), the
+name of the plot_drawing function that draws it and the source frame it
+is drawn from. Knowing the inputs up front lets the plot cache key every
+image on exactly the data it depends on.
+
+Nothing here imports matplotlib or seaborn: they load with plot_drawing
+on the first render_plot(), so a worker that only serves entries and the
+catalogue never pays for them (PRELOAD in app.py loads them up front).
+
+Time series are drawn from the bucketed journal; the correlation heatmaps
+and rolling trends from the running statistics (running_stats), which are
+not recomputed from every entry on each view.
+"""
+import hashlib
+from collections import namedtuple
+
+import pandas as pd
+
+import aggregation
+from analytics import MED_COLS
+
+PREDEFINED_FIELDS = ['mood_score', 'panic_intensity', 'headache_intensity', 'sleep_hours',
+                     'hope_score', 'sedation_feeling', 'med1_mg', 'med2_mg', 'med3_mg', 'med4_mg',
+                     'energy_level', 'appetite', 'social_interaction', 'exercise_minutes', 'die_thoughts']
+
+# Minimal black and white
+THEME_NAME = 'bw'
+THEME = {"axes.facecolor": "#ffffff",
+         "grid.color": "#cccccc",
+         "figure.figsize": (12, 6),
+         "axes.edgecolor": "#000000",
+         "axes.linewidth": 2,
+         "grid.linewidth": 0.5,
+         "xtick.color": "#000000",
+         "ytick.color": "#000000",
+         "text.color": "#000000",
+         "font.family": "monospace"}
+DPI = 150
+
+# 'seaborn' draws through sns.lineplot/barplot; 'fast' draws the same styled
+# lines and bars with plain Axes.plot/bar on NumPy arrays, skipping seaborn's
+# grouping and confidence-interval machinery (there is one value per date)
+RENDERERS = ('seaborn', 'fast')
+
+# build names the plot_drawing function that draws the plot, source the
+# frame it is drawn from (see plot_frames())
+PlotSpec = namedtuple('PlotSpec', ['plot_id', 'title', 'columns', 'build', 'source'], defaults=['series'])
+
+# Rolling means drawn on the trends plot, and the windows in days
+TREND_COLUMNS = ['mood_score', 'panic_intensity', 'headache_intensity']
+TREND_WINDOWS = (7, 28)
+# Days the recent correlation heatmap covers
+RECENT_DAYS = 28
+
+
+def series(df, col):
+    """Dates and float values of df[col], thinned to the frame's point budget if it has one"""
+    dates = df['date'].to_numpy()
+    values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+    budget = df.attrs.get('point_budget')
+    if budget and len(values) > budget:
+        dates, values = aggregation.downsample(dates, values, budget)
+    return dates, values
+
+
+def band_columns(df, columns):
+    """The min/max band columns bucketed frames carry for the given columns"""
+    return [col + suffix for col in columns for suffix in aggregation.BAND_SUFFIXES
+            if col + suffix in df.columns]
+
+
+def plot_frame(df, columns):
+    """The part of df a plot needs: its input columns plus their bands"""
+    return df[columns + band_columns(df, columns)]
+
+
+def numeric_columns(df):
+    numeric_cols = df.select_dtypes(include='number').columns.tolist()
+    return [col for col in numeric_cols if col != 'total_med_mg']
+
+
+def custom_numeric_fields(df, fields):
+    return [(field_name, field_config['label']) for field_name, field_config in fields.items()
+            if field_name not in PREDEFINED_FIELDS and field_config['type'] == 'number' and field_name in df.columns]
+
+
+# 1. Mood / Panic / Headache
+def symptoms_columns(df, fields):
+    cols = ['mood_score', 'panic_intensity', 'headache_intensity']
+    return ['date'] + cols if all(col in df.columns for col in cols) else None
+
+
+# 2. Medications
+def medications_columns(df, fields):
+    med_cols = [col for col in MED_COLS if col in df.columns]
+    return ['date'] + med_cols if med_cols else None
+
+
+# 3. Headache vs Total Meds
+def headache_meds_columns(df, fields):
+    if 'headache_intensity' in df.columns and df['total_med_mg'].sum() > 0:
+        return ['date', 'headache_intensity', 'total_med_mg']
+    return None
+
+
+# 4. Energy, Appetite, Social (if available)
+WELLNESS_LINES = [('energy_level', 'Energy', '#000', 'o', '-'),
+                  ('appetite', 'Appetite', '#333', 's', '--'),
+                  ('social_interaction', 'Social', '#666', '^', '-.')]
+
+
+def wellness_columns(df, fields):
+    cols = [line[0] for line in WELLNESS_LINES if line[0] in df.columns]
+    return ['date'] + cols if cols else None
+
+
+# 5. Sleep Hours
+def sleep_columns(df, fields):
+    return ['date', 'sleep_hours'] if 'sleep_hours' in df.columns else None
+
+
+# 6. Correlation Heatmap (for numeric columns)
+def correlation_columns(df, fields):
+    # df is the correlation matrix itself
+    numeric_cols = numeric_columns(df)
+    return numeric_cols if len(numeric_cols) > 1 and df.notna().any().any() else None
+
+
+# 7. Exercise tracking (if available)
+def exercise_columns(df, fields):
+    return ['date', 'exercise_minutes'] if 'exercise_minutes' in df.columns else None
+
+
+# 8. Hope vs Mood (if available)
+def hope_mood_columns(df, fields):
+    if 'hope_score' in df.columns and 'mood_score' in df.columns:
+        return ['date', 'mood_score', 'hope_score']
+    return None
+
+
+# 9. Death Thoughts Tracking (if available)
+def die_thoughts_columns(df, fields):
+    return ['date', 'die_thoughts'] if 'die_thoughts' in df.columns else None
+
+
+# 10. Custom numeric fields (auto-detect and graph)
+def custom_columns(df, fields):
+    custom = custom_numeric_fields(df, fields)
+    return ['date'] + [field_name for field_name, _ in custom] if custom else None
+
+
+# 11. Rolling 7- and 28-day means of the symptom scores
+def trends_columns(df, fields):
+    cols = [f'{col}_{window}d' for col in TREND_COLUMNS for window in TREND_WINDOWS if f'{col}_{window}d' in df.columns]
+    return ['date'] + cols if cols else None
+
+
+# 13. Medication on one day against how the next day went
+def lagged_columns(df, fields):
+    # df is the (medication x next-day measure) correlation table itself
+    return list(df.columns) if len(df.index) and df.notna().any().any() else None
+
+
+PLOTS = [
+    PlotSpec('symptoms', 'Mood, Panic, and Headache Trends', symptoms_columns, 'build_symptoms'),
+    PlotSpec('medications', 'Medication Tracking', medications_columns, 'build_medications'),
+    PlotSpec('headache-vs-medication', 'Headache vs Medication Relationship', headache_meds_columns, 'build_headache_meds'),
+    PlotSpec('wellness', 'Wellness Tracking', wellness_columns, 'build_wellness'),
+    PlotSpec('sleep', 'Sleep Tracking', sleep_columns, 'build_sleep'),
+    PlotSpec('correlation', 'Correlation Analysis', correlation_columns, 'build_correlation', 'correlation'),
+    PlotSpec('exercise', 'Exercise Log', exercise_columns, 'build_exercise'),
+    PlotSpec('hope-vs-mood', 'Emotional Well-being', hope_mood_columns, 'build_hope_mood'),
+    PlotSpec('die-thoughts', 'Death Thoughts Tracking', die_thoughts_columns, 'build_die_thoughts'),
+    PlotSpec('custom', 'Custom Fields Tracking', custom_columns, 'build_custom'),
+    PlotSpec('trends', 'Rolling Averages', trends_columns, 'build_trends', 'trends'),
+    # 12. Correlations over the most recent weeks only, drawn from their own matrix
+    PlotSpec('recent-correlation', f'Correlation Analysis, Last {RECENT_DAYS} Days', correlation_columns,
+             'build_recent_correlation', 'recent-correlation'),
+    PlotSpec('lagged-correlation', 'Medication and the Next Day', lagged_columns, 'build_lagged', 'lagged'),
+]
+PLOTS_BY_ID = {spec.plot_id: spec for spec in PLOTS}
+
+
+def correlation_table(stats):
+    return stats.correlation([col for col in stats.columns if col != 'total_med_mg'])
+
+
+def recent_correlation_table(stats):
+    return stats.window_correlation(RECENT_DAYS, [col for col in stats.columns if col != 'total_med_mg'])
+
+
+def lagged_table(stats):
+    causes = [col for col in MED_COLS + ['total_med_mg'] if col in stats.columns]
+    return stats.lagged_correlation(causes, [col for col in stats.columns if col not in causes])
+
+
+def trend_frame(stats):
+    return stats.rolling_means([col for col in TREND_COLUMNS if col in stats.columns], TREND_WINDOWS)
+
+
+def plot_frames(rows, stats, bucket='auto', max_points=aggregation.DEFAULT_MAX_POINTS, sources=None):
+    """The frames plots draw from, by PlotSpec.source
+
+    rows are the prepared entries of the selected window and stats their
+    running_stats.JournalStats. 'series' and 'trends' (the rolling means)
+    are bucketed to the point budget; the correlation sources are small
+    tables read off the running sums. sources limits which are built.
+    """
+    builders = {
+        'series': lambda: aggregation.aggregate(rows, bucket, max_points),
+        'trends': lambda: aggregation.aggregate(trend_frame(stats), bucket, max_points),
+        'correlation': lambda: correlation_table(stats),
+        'recent-correlation': lambda: recent_correlation_table(stats),
+        'lagged': lambda: lagged_table(stats),
+    }
+    return {source: builders[source]() for source in sources or builders}
+
+
+def data_fingerprint(df, columns, fields):
+    """Hash of exactly the data (and labels) a plot is drawn from"""
+    frame = plot_frame(df, columns)
+    digest = hashlib.sha1()
+    digest.update(repr(list(frame.columns)).encode())
+    if frame.index.dtype == object:  # the row labels of a correlation table
+        digest.update(repr(list(frame.index)).encode())
+    digest.update(repr(sorted(df.attrs.items())).encode())
+    digest.update(repr([fields[col]['label'] for col in columns if col in fields]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def available_plots(frames, fields):
+    """Yield (spec, frame, fingerprint) for every plot that applies
+
+    frames maps each source to its frame, as plot_frames() returns them.
+    """
+    for spec in PLOTS:
+        frame = frames[spec.source]
+        columns = spec.columns(frame, fields)
+        if columns is not None:
+            yield spec, frame, data_fingerprint(frame, columns, fields)
+
+
+def apply_theme():
+    """Load the drawing modules and set the theme once per process"""
+    import plot_drawing
+    plot_drawing.apply_theme()
+
+
+def render_plot(spec, df, fields, fmt='png', dpi=DPI, renderer='seaborn'):
+    """Draw one plot and return the encoded image bytes"""
+    import plot_drawing
+    return plot_drawing.render_plot(spec, df, fields, fmt, dpi, renderer)
@@ -0,0 +1,225 @@
+"""Correlations and rolling means kept up to date as entries change
+
+JournalStats holds running sums from which the graphs read the
+correlation matrix, lagged correlations (one day's values against the
+next day's) and rolling 7- and 28-day means. Adding, editing or deleting
+an entry adjusts the sums of the days it touches rather than going over
+the whole journal again, so reading a correlation costs the same for a
+month of entries as for decades.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+class CrossSums:
+    """Running sums for the Pearson correlation of every x column with every y column
+
+    Each pair only counts the observations where both values are present,
+    as DataFrame.corr() does. Values are summed relative to a fixed shift
+    per column (their mean when the sums were started), which keeps the
+    variances as accurate as Welford's update does while still letting an
+    observation be taken out again exactly.
+    """
+
+    def __init__(self, x_shift, y_shift):
+        self.x_shift = np.asarray(x_shift, dtype=float)
+        self.y_shift = np.asarray(y_shift, dtype=float)
+        shape = (len(self.x_shift), len(self.y_shift))
+        self.n, self.sx, self.sy, self.sxx, self.syy, self.sxy = (np.zeros(shape) for _ in range(6))
+
+    def update(self, x, y, sign=1):
+        """Add (sign=1) or remove (sign=-1) observations; row i of x is paired with row i of y"""
+        x = np.asarray(x, dtype=float) - self.x_shift
+        y = np.asarray(y, dtype=float) - self.y_shift
+        x_present, y_present = ~np.isnan(x), ~np.isnan(y)
+        x, y = np.where(x_present, x, 0.0), np.where(y_present, y, 0.0)
+        x_present, y_present = x_present.astype(float), y_present.astype(float)
+        self.n += sign * (x_present.T @ y_present)
+        self.sx += sign * (x.T @ y_present)
+        self.sy += sign * (x_present.T @ y)
+        self.sxx += sign * ((x * x).T @ y_present)
+        self.syy += sign * (x_present.T @ (y * y))
+        self.sxy += sign * (x.T @ y)
+
+    def corr(self):
+        """Matrix of correlations; NaN where a pair has too few values or no spread"""
+        covariance = self.n * self.sxy - self.sx * self.sy
+        x_spread = self.n * self.sxx - self.sx ** 2
+        y_spread = self.n * self.syy - self.sy ** 2
+        # What removals leave behind of a spread that is really zero
+        flat = (x_spread <= 1e-10 * self.n * self.sxx) | (y_spread <= 1e-10 * self.n * self.syy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = covariance / np.sqrt(x_spread * y_spread)
+        r[flat | (self.n < 2)] = np.nan
+        return np.clip(r, -1, 1)
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+
+def day_totals(days, values):
+    """Sorted distinct days with the per-day sums and counts of values"""
+    if not len(days):
+        return days, np.zeros((0, values.shape[1])), np.zeros((0, values.shape[1]), dtype=np.int64)
+    order = np.argsort(days, kind='stable')
+    days, values = days[order], values[order]
+    unique, starts = np.unique(days, return_index=True)
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present, values, 0.0), starts, axis=0)
+    counts = np.add.reduceat(present.astype(np.int64), starts, axis=0)
+    return unique, sums, counts
+
+
+class JournalStats:
+    """Correlations and per-day sums of the number columns of a prepared journal
+
+    Days are numbered from the epoch; a day only appears once it has at
+    least one value.
+    """
+
+    def __init__(self, df, columns=None):
+        if columns is None:
+            columns = df.select_dtypes(include='number').columns.tolist()
+        self.columns = list(columns)
+        days, values = self.observations(df)
+        self.days, self.sums, self.counts = day_totals(days, values)
+
+        totals, counts = self.sums.sum(axis=0), self.counts.sum(axis=0)
+        shift = np.divide(totals, counts, out=np.zeros(len(self.columns)), where=counts > 0)
+        self.rows = CrossSums(shift, shift)
+        self.rows.update(values, values)
+        self.lagged = CrossSums(shift, shift)
+        self._update_lagged(self.days, 1)
+
+    def observations(self, df):
+        """(day numbers, float values) of the rows of df with a valid date"""
+        if 'date' not in df.columns:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.columns)))
+        dates = pd.to_datetime(df['date'], errors='coerce')
+        valid = dates.notna().to_numpy()
+        days = dates[valid].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+        values = np.full((int(valid.sum()), len(self.columns)), np.nan)
+        for position, col in enumerate(self.columns):
+            if col in df.columns:
+                # Through float32 like the prepared journal, so a row taken out
+                # again later subtracts exactly what it added
+                column = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+                values[:, position] = column[valid]
+        return days, values
+
+    def _positions(self, days):
+        """Index of each day in self.days, and whether it is there at all"""
+        positions = np.searchsorted(self.days, days)
+        found = positions < len(self.days)
+        found[found] = self.days[positions[found]] == days[found]
+        return positions, found
+
+    def _daily_means(self, positions):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts[positions] > 0, self.sums[positions] / self.counts[positions], np.nan)
+
+    def _update_lagged(self, starts, sign):
+        """Add or remove the (day, next day) pairs that start on the given days"""
+        today, has_today = self._positions(starts)
+        tomorrow, has_tomorrow = self._positions(starts + 1)
+        paired = has_today & has_tomorrow
+        if paired.any():
+            self.lagged.update(self._daily_means(today[paired]), self._daily_means(tomorrow[paired]), sign)
+
+    def _update_days(self, days, values, sign):
+        unique, sums, counts = day_totals(days, values)
+        positions, found = self._positions(unique)
+        self.sums[positions[found]] += sign * sums[found]
+        self.counts[positions[found]] += sign * counts[found]
+        if sign > 0 and not found.all():
+            new = ~found
+            self.days = np.insert(self.days, positions[new], unique[new])
+            self.sums = np.insert(self.sums, positions[new], sums[new], axis=0)
+            self.counts = np.insert(self.counts, positions[new], counts[new], axis=0)
+        self.sums[self.counts == 0] = 0.0
+        if sign < 0:
+            kept = self.counts.any(axis=1)
+            self.days, self.sums, self.counts = self.days[kept], self.sums[kept], self.counts[kept]
+
+    def update(self, removed=None, added=None):
+        """Take the rows of removed out and put the rows of added in
+
+        Both are prepared frames (or None). An edit is the old row removed
+        and the new one added. Only the days the rows fall on, and the
+        lagged pairs next to them, are touched.
+        """
+        changes = [(self.observations(frame), sign) for frame, sign in ((removed, -1), (added, 1))
+                   if frame is not None and len(frame)]
+        if not changes:
+            return
+        touched = np.unique(np.concatenate([days for (days, _), _ in changes]))
+        starts = np.union1d(touched - 1, touched)
+        self._update_lagged(starts, -1)
+        for (days, values), sign in changes:
+            self.rows.update(values, values, sign)
+            self._update_days(days, values, sign)
+        self._update_lagged(starts, 1)
+
+    def _table(self, matrix, rows, columns):
+        index = [self.columns.index(col) for col in rows]
+        positions = [self.columns.index(col) for col in columns]
+        return pd.DataFrame(matrix[np.ix_(index, positions)], index=rows, columns=columns)
+
+    def correlation(self, columns=None):
+        """Correlation matrix of columns over all entries, as DataFrame.corr() gives it"""
+        columns = self.columns if columns is None else columns
+        return self._table(self.rows.corr(), columns, columns)
+
+    def lagged_correlation(self, causes, effects):
+        """Correlation of each cause on one day with each effect on the next day
+
+        Uses daily means, over every pair of consecutive days with entries.
+        """
+        return self._table(self.lagged.corr(), causes, effects)
+
+    def _recent(self, days):
+        """Positions of the days within the last `days` days up to the latest entry"""
+        if not len(self.days):
+            return np.zeros(0, dtype=np.int64)
+        return np.arange(np.searchsorted(self.days, self.days[-1] - days + 1), len(self.days))
+
+    def window_means(self, days):
+        """Mean of every column over the last `days` days up to the latest entry"""
+        positions = self._recent(days)
+        totals, counts = self.sums[positions].sum(axis=0), self.counts[positions].sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.Series(np.where(counts > 0, totals / counts, np.nan), index=self.columns)
+
+    def window_correlation(self, days, columns=None):
+        """Correlation of the daily means over the last `days` days up to the latest entry"""
+        columns = self.columns if columns is None else columns
+        means = self._daily_means(self._recent(days))
+        recent = CrossSums(self.rows.x_shift, self.rows.x_shift)
+        recent.update(means, means)
+        return self._table(recent.corr(), columns, columns)
+
+    def rolling_means(self, columns, windows):
+        """Trailing means over each window (in days), for every day with entries
+
+        Returns a frame with a date column and <column>_<window>d columns,
+        e.g. mood_score_7d: the mean of the mood scores of that day and the
+        six before it.
+        """
+        positions = [self.columns.index(col) for col in columns]
+        sums = np.vstack([np.zeros((1, len(positions))), np.cumsum(self.sums[:, positions], axis=0)])
+        counts = np.vstack([np.zeros((1, len(positions))), np.cumsum(self.counts[:, positions], axis=0)])
+        out = {'date': self.days.astype('datetime64[D]').astype('datetime64[ns]')}
+        end = np.arange(1, len(self.days) + 1)
+        for window in windows:
+            start = np.searchsorted(self.days, self.days - window + 1)
+            total, count = sums[end] - sums[start], counts[end] - counts[start]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.where(count > 0, total / count, np.nan)
+            for position, col in enumerate(columns):
+                out[f'{col}_{window}d'] = means[:, position]
+        return pd.DataFrame(out)
+
+    def copy(self):
+        return copy.deepcopy(self)
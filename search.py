@@ -0,0 +1,232 @@
+"""Full-text search over the journal's free-text fields
+
+SearchIndex keeps the text and textarea fields of every entry (notes,
+thoughts, remarks, therapy sessions) in an in-memory SQLite FTS5 table:
+
+    index.sync(store, fields)
+    hits, page, pages, total = index.search('"panic attack" sleep* -work', start='2020-01-01')
+
+A query is a list of words, "quoted phrases" and prefixes ending in *, all
+of which an entry must contain; -word leaves out entries containing word.
+Matching ignores case and accents. Hits come newest first (or by relevance)
+with a highlighted snippet of every field that matched.
+
+sync() brings the index up to date with the store's change log, the way
+analytics.PreparedCache does, so adding, editing or deleting an entry
+updates one row of it; writes the log does not know (another gunicorn
+worker, a new text field) rebuild it from the text columns, which takes
+well under a second for ten years of entries.
+"""
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+from markupsafe import Markup, escape
+
+import metrics
+from datastore import quote_identifier
+
+TEXT_TYPES = ('text', 'textarea')
+ORDERS = ('newest', 'relevance')
+# Hits per page: each snippet of a prefix query costs about a millisecond
+PER_PAGE = 20
+# Words either side of the first match in a snippet
+SNIPPET_WORDS = 16
+# Prefix lengths indexed on their own so that short prefix queries stay fast
+PREFIX_LENGTHS = '2 3'
+
+# Marks the highlighted words of a snippet until it has been escaped
+_OPEN, _CLOSE, _ELLIPSIS = '\x02', '\x03', '…'
+QUERY_TERM = re.compile(r'(-?)"([^"]*)"?|(-?)([^\s"]+)')
+
+
+def fts5_available():
+    """Whether the sqlite3 module was built with FTS5"""
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(text)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+FTS5 = fts5_available()
+
+
+def text_fields(fields):
+    """Names of the configured free-text fields, in configuration order"""
+    return tuple(name for name, config in fields.items() if config['type'] in TEXT_TYPES)
+
+
+def match_expression(query):
+    """The FTS5 MATCH expression for a search box query, or None if it has no words
+
+    Every word and phrase is quoted, so FTS5 operators and column filters
+    typed into the box are searched for as text.
+    """
+    include, exclude = [], []
+    for negated, phrase, word_negated, word in QUERY_TERM.findall(query):
+        text = phrase if phrase or not word else word
+        prefix = text.endswith('*') and not phrase
+        text = text.rstrip('*') if prefix else text
+        if not re.search(r'\w', text):
+            continue
+        term = '"' + text.replace('"', '""') + '"' + ('*' if prefix else '')
+        (exclude if negated or word_negated else include).append(term)
+    if not include:
+        return None
+    expression = ' AND '.join(include)
+    if exclude:
+        expression = f'({expression}) NOT ({" OR ".join(exclude)})'
+    return expression
+
+
+def _text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    return str(value)
+
+
+def _day(value):
+    """YYYY-MM-DD of a date bound, or None if it is empty or unparseable"""
+    parsed = pd.to_datetime(value, errors='coerce') if value else pd.NaT
+    return None if pd.isna(parsed) else parsed.strftime('%Y-%m-%d')
+
+
+def highlight(snippet):
+    """Escape an FTS5 snippet and turn its match markers into <mark> tags"""
+    return Markup(str(escape(snippet)).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>'))
+
+
+class SearchIndex:
+    """In-memory FTS5 index of a journal's free-text fields"""
+
+    def __init__(self):
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._lock = threading.Lock()
+        self._key = None
+        self._columns = ()
+        self._next_doc = 0
+
+    def sync(self, store, fields):
+        """Bring the index up to date with the journal and its text fields"""
+        columns = text_fields(fields)
+        version = store.version()
+        with self._lock:
+            if self._key == (version, columns):
+                return
+            steps = None
+            if self._key is not None and self._key[1] == columns:
+                steps = store.changes(self._key[0], version)
+            with metrics.span('search.sync'), self._db:
+                if steps is None:
+                    # Keyed on the version the rows were read at, which a
+                    # write landing meanwhile moves past the one read above
+                    version, df = store.load_versioned(['date', *columns])
+                    self._rebuild(df, columns)
+                else:
+                    for removed, added in steps:
+                        self._apply(removed, added, store.backend.positional_ids)
+            # An unknown version (None) rebuilds on the next sync
+            self._key = None if version is None else (version, columns)
+
+    def _rebuild(self, df, columns):
+        db = self._db
+        db.execute('DROP TABLE IF EXISTS entries')
+        db.execute('DROP TABLE IF EXISTS texts')
+        # doc ties an FTS row to an entry; row_id is the entry's id in the
+        # store, which shifts on a delete from a file backend
+        db.execute('CREATE TABLE entries (doc INTEGER PRIMARY KEY, row_id INTEGER NOT NULL, date TEXT)')
+        db.execute('CREATE INDEX entries_row_id ON entries (row_id)')
+        db.execute('CREATE INDEX entries_date ON entries (date)')
+        if columns:
+            db.execute(f'CREATE VIRTUAL TABLE texts USING fts5({", ".join(quote_identifier(c) for c in columns)}, '
+                       f"tokenize='unicode61 remove_diacritics 2', prefix='{PREFIX_LENGTHS}')")
+        self._columns = columns
+        self._next_doc = 0
+        self._insert(df, df.index)
+
+    def _insert(self, rows, row_ids):
+        docs = range(self._next_doc, self._next_doc + len(rows))
+        self._next_doc += len(rows)
+        dates = rows['date'] if 'date' in rows.columns else [None] * len(rows)
+        self._db.executemany('INSERT INTO entries (doc, row_id, date) VALUES (?, ?, ?)',
+                             zip(docs, (int(row_id) for row_id in row_ids), (_text(date)[:10] for date in dates)))
+        if self._columns:
+            texts = [[_text(value) for value in rows[column]] if column in rows.columns else [''] * len(rows)
+                     for column in self._columns]
+            placeholders = ', '.join('?' * (len(self._columns) + 1))
+            self._db.executemany(f'INSERT INTO texts (rowid, {", ".join(quote_identifier(c) for c in self._columns)}) '
+                                 f'VALUES ({placeholders})', zip(docs, *texts))
+
+    def _delete(self, row_id):
+        for (doc,) in self._db.execute('SELECT doc FROM entries WHERE row_id = ?', (row_id,)).fetchall():
+            self._db.execute('DELETE FROM entries WHERE doc = ?', (doc,))
+            if self._columns:
+                self._db.execute('DELETE FROM texts WHERE rowid = ?', (doc,))
+
+    def _apply(self, removed, added, positional_ids):
+        if removed is not None:
+            for row_id in sorted(removed.index, reverse=True):
+                self._delete(int(row_id))
+                if added is None and positional_ids:
+                    # Later rows of a CSV or Parquet journal move up one
+                    self._db.execute('UPDATE entries SET row_id = row_id - 1 WHERE row_id > ?', (int(row_id),))
+        if added is not None:
+            if removed is None and positional_ids:
+                # Appended rows come after every stored one
+                count = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+                row_ids = range(count, count + len(added))
+            else:
+                row_ids = added.index
+            self._insert(added, row_ids)
+
+    def search(self, query, start='', end='', order='newest', page=1, per_page=PER_PAGE):
+        """One page of hits for a query: (hits, page, page count, matching entries)
+
+        Each hit is a dict of the entry's id and date and a list of
+        (field name, highlighted snippet) for the fields that matched.
+        start and end are inclusive bounds on the date; unparseable ones
+        are ignored.
+        """
+        expression = match_expression(query)
+        start, end = _day(start), _day(end)
+        with self._lock:
+            if expression is None or not self._columns:
+                return [], 1, 1, 0
+            where = 'texts MATCH ?'
+            params = [expression]
+            if start:
+                where += ' AND entries.date >= ?'
+                params.append(start)
+            if end:
+                where += ' AND entries.date <= ?'
+                params.append(end)
+            ordering = 'rank' if order == 'relevance' else 'entries.date DESC, entries.row_id DESC'
+            snippets = ', '.join(f"snippet(texts, {i}, '{_OPEN}', '{_CLOSE}', '{_ELLIPSIS}', {SNIPPET_WORDS})"
+                                 for i in range(len(self._columns)))
+            with metrics.span('search.query'):
+                try:
+                    total = self._db.execute(f'SELECT COUNT(*) FROM texts JOIN entries ON entries.doc = texts.rowid '
+                                             f'WHERE {where}', params).fetchone()[0]
+                    pages = max(1, -(-total // per_page))
+                    page = min(max(page, 1), pages)
+                    rows = self._db.execute(f'SELECT entries.doc, entries.row_id, entries.date FROM texts '
+                                            f'JOIN entries ON entries.doc = texts.rowid WHERE {where} '
+                                            f'ORDER BY {ordering} LIMIT ? OFFSET ?',
+                                            params + [per_page, (page - 1) * per_page]).fetchall()
+                    # Snippets only for the page shown: for a common word
+                    # they would cost far more than the search itself
+                    docs = [doc for doc, _, _ in rows]
+                    found = {doc: snippets for doc, *snippets in self._db.execute(
+                        f'SELECT rowid, {snippets} FROM texts WHERE texts MATCH ? '
+                        f'AND rowid IN ({", ".join("?" * len(docs))})', [expression, *docs])}
+                except sqlite3.OperationalError:
+                    # A query FTS5 cannot run, e.g. a phrase of nothing but a prefix marker
+                    return [], 1, 1, 0
+            columns = self._columns
+        hits = [{'id': row_id, 'date': date,
+                 'snippets': [(column, highlight(snippet)) for column, snippet in zip(columns, found.get(doc, ()))
+                              if _OPEN in snippet]}
+                for doc, row_id, date in rows]
+        return hits, page, pages, total
@@ -0,0 +1,186 @@
+"""Checking entries against the field configuration
+
+A Validator is compiled once per field configuration into one check per
+field: required fields need a value, numbers must be numbers within the
+field's min and max, dates must read as YYYY-MM-DD and fields that are
+not configured are refused. Every check runs on a whole column at a time,
+so a form submission, a bulk import batch and an audit of the whole
+journal all go through the same code at the same cost per value.
+
+Optional numbers left empty are stored as 0 (see datastore.empty_value),
+so an optional field holding 0 counts as empty rather than out of range.
+"""
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+
+from datastore import apply_dtypes, empty_value, storage_frame
+
+# Row ids listed per problem in an audit
+AUDIT_SAMPLE = 20
+
+
+def blank(values):
+    """Whether each value is missing: None, NaN or an empty string"""
+    missing = values.isna().to_numpy(dtype=bool)
+    if not pd.api.types.is_numeric_dtype(values):
+        missing = missing | values.astype(str).str.strip().eq('').to_numpy()
+    return missing
+
+
+def booleans(values):
+    """Whether each value is a bool, which to_numeric would take as 1 or 0"""
+    if values.dtype == bool:
+        return np.ones(len(values), dtype=bool)
+    if values.dtype == object:
+        return values.map(lambda value: isinstance(value, bool)).to_numpy(dtype=bool)
+    return np.zeros(len(values), dtype=bool)
+
+
+def number_check(field_config, label):
+    low, high = field_config.get('min'), field_config.get('max')
+    empty = empty_value(field_config)
+    required = field_config.get('required')
+
+    def check(values, missing):
+        numbers = pd.to_numeric(values.where(~missing), errors='coerce')
+        # to_numeric reads 'inf' and '1e999' as infinite: no use to any statistic
+        finite = np.isfinite(numbers.to_numpy(dtype=float, na_value=np.nan))
+        failed = [((~finite & ~missing) | booleans(values), f'{label} must be a number')]
+        filled = numbers.notna() if required else numbers.notna() & numbers.ne(empty)
+        # Nullable integer columns (as Parquet stores them) compare to a
+        # masked boolean array
+        if low is not None:
+            failed.append(((filled & (numbers < low)).to_numpy(dtype=bool, na_value=False),
+                           f'{label} must be at least {low}'))
+        if high is not None:
+            failed.append(((filled & (numbers > high)).to_numpy(dtype=bool, na_value=False),
+                           f'{label} must be at most {high}'))
+        return numbers.fillna(empty), failed
+    return check
+
+
+def date_check(field_config, label):
+    def check(values, missing):
+        dates = pd.to_datetime(values.where(~missing).astype('string'), format='%Y-%m-%d', errors='coerce')
+        return dates.dt.strftime('%Y-%m-%d'), [(dates.isna().to_numpy() & ~missing,
+                                                 f'{label} must be a date (YYYY-MM-DD)')]
+    return check
+
+
+def text_check(field_config, label):
+    empty = empty_value(field_config)
+
+    def check(values, missing):
+        return values.astype(object).where(~missing, empty).astype(str), []
+    return check
+
+
+FIELD_CHECKS = {'number': number_check, 'date': date_check}
+
+
+class Validator:
+    """Column-wise checks compiled from one field configuration"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.checks = {}
+        self.required = {}
+        for field_name, field_config in fields.items():
+            label = field_config.get('label', field_name)
+            self.checks[field_name] = FIELD_CHECKS.get(field_config['type'], text_check)(field_config, label)
+            if field_config.get('required'):
+                self.required[field_name] = f'{label} is required'
+
+    def check(self, df, unknown=True):
+        """(converted columns, [(field, failed mask, message)]) for df
+
+        With unknown, a value in a column that is not a configured field is
+        a failure too.
+        """
+        failures = []
+        if unknown:
+            for field_name in df.columns.difference(list(self.fields), sort=False):
+                failures.append((field_name, ~blank(df[field_name]), 'Unknown field'))
+        columns = {}
+        for field_name, check in self.checks.items():
+            values = df[field_name] if field_name in df.columns else pd.Series(None, index=df.index, dtype=object)
+            missing = blank(values)
+            if field_name in self.required:
+                failures.append((field_name, missing, self.required[field_name]))
+            columns[field_name], failed = check(values, missing)
+            failures.extend((field_name, mask, message) for mask, message in failed)
+        return columns, failures
+
+    def validate(self, df):
+        """Check every row of df; returns (valid rows, errors)
+
+        errors is a list of {'row', 'field', 'message'} dicts, row being the
+        index label of the offending row, in row order. Rows with any error
+        are left out of the valid rows, which carry every configured field
+        (missing optional values as the field's empty value) in its compact
+        dtype.
+        """
+        columns, failures = self.check(df)
+        rejected = np.zeros(len(df), dtype=bool)
+        labels = df.index.tolist()
+        errors = []
+        for field_name, failed, message in failures:
+            rejected |= failed
+            errors.extend((position, {'row': labels[position], 'field': field_name, 'message': message})
+                          for position in np.flatnonzero(failed))
+        errors.sort(key=lambda error: error[0])
+
+        rows = pd.DataFrame(columns, index=df.index)[~rejected]
+        return apply_dtypes(rows, self.fields), [error for _, error in errors]
+
+    def validate_entry(self, values):
+        """Check one submitted entry (a dict, e.g. a form)
+
+        Returns (entry, errors): the entry with numbers as int or float and
+        every configured field present, or None when errors lists any
+        {'row', 'field', 'message'} problems.
+        """
+        rows, errors = self.validate(pd.DataFrame([{name: values.get(name) for name in self.fields}]))
+        if errors:
+            return None, errors
+        entry = storage_frame(rows).astype(object).iloc[0]
+        return {name: None if pd.isna(value) else value for name, value in entry.items()}, []
+
+    def audit(self, df):
+        """Data health report of stored entries
+
+        Returns {'entries', 'invalid', 'problems', 'unknown_columns'}:
+        problems lists each failed check with the number of entries failing
+        it and the ids of the first AUDIT_SAMPLE, most frequent first;
+        unknown_columns are stored columns no configured field uses.
+        """
+        _, failures = self.check(df, unknown=False)
+        invalid = np.zeros(len(df), dtype=bool)
+        problems = []
+        for field_name, failed, message in failures:
+            invalid |= failed
+            count = int(failed.sum())
+            if count:
+                problems.append({'field': field_name, 'message': message, 'count': count,
+                                 'rows': df.index[failed][:AUDIT_SAMPLE].tolist()})
+        problems.sort(key=lambda problem: -problem['count'])
+        return {'entries': len(df), 'invalid': int(invalid.sum()), 'problems': problems,
+                'unknown_columns': df.columns.difference(list(self.fields), sort=False).tolist()}
+
+
+@functools.lru_cache(maxsize=8)
+def _compiled(fields_json):
+    return Validator(json.loads(fields_json))
+
+
+def validator(fields):
+    """The Validator for a field configuration, compiled on first use"""
+    return _compiled(json.dumps(fields))
+
+
+def validate(df, fields):
+    """Check every row of df against fields; see Validator.validate()"""
+    return validator(fields).validate(df)